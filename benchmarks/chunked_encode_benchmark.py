@@ -0,0 +1,64 @@
+"""
+2pass変換の所要時間比較ベンチマーク（従来のTwoPassConversionThreadと分割並列エンコード）
+
+使い方:
+    python benchmarks/chunked_encode_benchmark.py 動画.mp4 [--size 10] [--chunks 8] [--h265]
+
+bin/ffmpeg.exe（main.pyと同じ配置）を使用し、同じ目標サイズで両方式を1回ずつ実行する。
+出力は一時ディレクトリに書き出し、計測後に削除する。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import BitBudget, ChunkedTwoPassConversionThread, MediaProbe, TwoPassConversionThread
+
+
+def run_thread(thread):
+    """スレッドのrun()を同期実行して (成功したか, 所要秒, エラー) を返す"""
+    result = {}
+    thread.finished_signal.connect(lambda success, path, error: result.update(success=success, error=error))
+    start = time.perf_counter()
+    thread.run()
+    return result.get('success', False), time.perf_counter() - start, result.get('error', '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='2pass変換 従来方式/分割並列 のベンチマーク')
+    parser.add_argument('file', help='計測する動画ファイル')
+    parser.add_argument('--size', type=float, default=10, help='目標ファイルサイズ(MB)')
+    parser.add_argument('--chunks', type=int, default=None, help='分割数（省略時はCPUコア数から自動）')
+    parser.add_argument('--h265', action='store_true', help='H.265でエンコード')
+    args = parser.parse_args()
+
+    record, _ = MediaProbe.probe_cached(args.file)
+    duration = record.duration
+    budget = BitBudget.allocate(args.size, duration, record)
+    print(f"入力: {os.path.basename(args.file)} ({duration:.1f}秒) / 目標 {args.size}MB / {budget.describe()} / CPU {os.cpu_count()}コア")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = []
+        for label, thread in (
+            ('従来 (TwoPass)', TwoPassConversionThread(
+                args.file, os.path.join(temp_dir, 'twopass.mp4'), budget.video_kbps, duration, use_h265=args.h265,
+                audio_plan=budget.audio_plan)),
+            ('分割並列', ChunkedTwoPassConversionThread(
+                args.file, os.path.join(temp_dir, 'chunked.mp4'), budget.video_kbps, duration, use_h265=args.h265,
+                chunk_count=args.chunks, audio_plan=budget.audio_plan)),
+        ):
+            success, elapsed, error = run_thread(thread)
+            size_mb = os.path.getsize(thread.output_path) / (1024 * 1024) if success else 0
+            results.append(elapsed)
+            status = f"{size_mb:.2f}MB ({(size_mb / args.size - 1) * 100:+.1f}%)" if success else f"失敗: {error}"
+            print(f"{label:<16} {elapsed:>8.1f}秒  {status}")
+
+        if len(results) == 2 and results[1] > 0:
+            print(f"高速化: {results[0] / results[1]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+目標サイズ変換の所要時間比較ベンチマーク（従来のTwoPassConversionThreadとCRF探索）
+
+使い方:
+    python benchmarks/crf_search_benchmark.py 動画1.mp4 [動画2.mp4 ...] [--size 10] [--h265] [--preset balanced]
+
+bin/ffmpeg.exe（main.pyと同じ配置）を使用し、同じ入力・同じ目標サイズで両方式を1回ずつ実行する。
+2passの1pass統計キャッシュは一時ディレクトリに切り替え、キャッシュのヒットで速く見えないようにする。
+出力は一時ディレクトリに書き出し、計測後に削除する。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as clipitbro
+from main import (ENCODER_SPEED_PRESETS, BitBudget, CrfSearchConversionThread, MediaProbe, PassStatsCache,
+                  TwoPassConversionThread)
+
+
+def run_thread(thread):
+    """スレッドのrun()を同期実行して (成功したか, 所要秒, エラー) を返す"""
+    result = {}
+    thread.finished_signal.connect(lambda success, path, error: result.update(success=success, error=error))
+    start = time.perf_counter()
+    thread.run()
+    return result.get('success', False), time.perf_counter() - start, result.get('error', '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='目標サイズ変換 2pass/CRF探索 のベンチマーク')
+    parser.add_argument('files', nargs='+', help='計測する動画ファイル（短いクリップを想定）')
+    parser.add_argument('--size', type=float, default=10, help='目標ファイルサイズ(MB)')
+    parser.add_argument('--h265', action='store_true', help='H.265でエンコード')
+    parser.add_argument('--preset', default='balanced', choices=list(ENCODER_SPEED_PRESETS), help='速度/画質の段階')
+    args = parser.parse_args()
+
+    print(f"目標 {args.size}MB / {'H.265' if args.h265 else 'H.264'} / "
+          f"{ENCODER_SPEED_PRESETS[args.preset][0]} / CPU {os.cpu_count()}コア")
+    total = {'2pass': 0.0, 'CRF探索': 0.0}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index, video_file in enumerate(args.files):
+            record, _ = MediaProbe.probe_cached(video_file)
+            duration = record.duration
+            # CRF探索と同じBitBudgetで配分し、同じ予算で比較する
+            budget = BitBudget.allocate(args.size, duration, record)
+            print(f"\n入力: {os.path.basename(video_file)} ({duration:.1f}秒, {budget.describe()})")
+
+            # 入力ごとに空のキャッシュを使う
+            cache_dir = os.path.join(temp_dir, f'passlog_{index}')
+            os.makedirs(cache_dir)
+            clipitbro._pass_stats_cache = PassStatsCache(cache_dir)
+            for label, thread in (
+                ('2pass', TwoPassConversionThread(
+                    video_file, os.path.join(temp_dir, f'twopass_{index}.mp4'), budget.video_kbps, duration,
+                    use_h265=args.h265, speed_preset=args.preset, audio_plan=budget.audio_plan)),
+                ('CRF探索', CrfSearchConversionThread(
+                    video_file, os.path.join(temp_dir, f'crfsearch_{index}.mp4'), args.size, duration,
+                    use_h265=args.h265, speed_preset=args.preset)),
+            ):
+                success, elapsed, error = run_thread(thread)
+                if not success:
+                    print(f"  {label:<8} 失敗: {error}")
+                    continue
+                total[label] += elapsed
+                size = os.path.getsize(thread.output_path)
+                status = f"{size / (1024 * 1024):.2f}MB (目標比 {(size / (args.size * 1024 * 1024) - 1) * 100:+.1f}%)"
+                predicted = getattr(thread, 'predicted_size', 0)
+                if predicted:
+                    status += f" CRF {thread.final_crf} 予測比 {(size / predicted - 1) * 100:+.1f}%"
+                print(f"  {label:<8} {elapsed:>8.1f}秒  {status}")
+
+    if total['CRF探索'] > 0:
+        print(f"\n合計: 2pass {total['2pass']:.1f}秒 / CRF探索 {total['CRF探索']:.1f}秒 "
+              f"({total['2pass'] / total['CRF探索']:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+1pass目（解析のみ）の所要時間比較ベンチマーク
+
+使い方:
+    python benchmarks/first_pass_benchmark.py 動画.mp4 [--presets fast balanced] [--h265] [--repeat 1]
+
+従来の1passコマンド（音声もエンコードしてnullへ出力）と、映像以外を無効化した
+軽量1pass（FirstPassThreadが使うもの）を同じ速度/画質の段階で実行して比較する。
+bin/ffmpeg.exe（main.pyと同じ配置）を使用し、passログは一時ディレクトリに書き出す。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (ENCODER_SPEED_PRESETS, MediaProbe, build_encoder_args, build_first_pass_args,
+                  get_ffmpeg_env, get_ffmpeg_executable_path)
+
+
+def build_command(video_file, video_codec, speed_preset, passlog_prefix, lean):
+    """1pass目のコマンドを作成（lean=Falseは従来の形式）"""
+    cmd = [get_ffmpeg_executable_path('ffmpeg.exe'), '-y', '-v', 'error', '-i', video_file, '-c:v', video_codec]
+    cmd += build_encoder_args(video_codec, speed_preset)
+    if lean:
+        cmd += build_first_pass_args(video_codec)
+    cmd += ['-b:v', '1000k', '-pass', '1', '-passlogfile', passlog_prefix, '-f', 'null', os.devnull]
+    return cmd
+
+
+def measure(cmd, repeat):
+    """コマンドをrepeat回実行して最短の所要秒を返す"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=get_ffmpeg_env())
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', 'replace').strip()[-300:])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='1pass目 従来/軽量 のベンチマーク')
+    parser.add_argument('file', help='計測する動画ファイル（1080p60を想定）')
+    parser.add_argument('--presets', nargs='+', default=list(ENCODER_SPEED_PRESETS),
+                        choices=list(ENCODER_SPEED_PRESETS), help='計測する速度/画質の段階')
+    parser.add_argument('--h265', action='store_true', help='H.265で計測')
+    parser.add_argument('--repeat', type=int, default=1, help='各条件の実行回数（最短値を採用）')
+    args = parser.parse_args()
+
+    record, _ = MediaProbe.probe_cached(args.file)
+    video_stream = record.video_stream()
+    video_codec = 'libx265' if args.h265 else 'libx264'
+    resolution = f"{video_stream.width}x{video_stream.height}" if video_stream else '?'
+    print(f"入力: {os.path.basename(args.file)} ({resolution}, {record.duration:.1f}秒, "
+          f"音声{len(record.audio_streams())}本) / {video_codec} / CPU {os.cpu_count()}コア")
+    print(f"{'段階':<12} {'従来':>8} {'軽量':>8} {'短縮':>8}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        passlog_prefix = os.path.join(temp_dir, 'ffmpeg2pass')
+        for speed_preset in args.presets:
+            legacy = measure(build_command(args.file, video_codec, speed_preset, passlog_prefix, False), args.repeat)
+            lean = measure(build_command(args.file, video_codec, speed_preset, passlog_prefix, True), args.repeat)
+            label = f"{ENCODER_SPEED_PRESETS[speed_preset][0]}({ENCODER_SPEED_PRESETS[speed_preset][1]})"
+            print(f"{label:<12} {legacy:>7.2f}s {lean:>7.2f}s {(1 - lean / legacy) * 100:>7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
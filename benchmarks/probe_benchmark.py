@@ -0,0 +1,73 @@
+"""
+動画情報取得のレイテンシ比較ベンチマーク（FFprobe full/lean とヘッダー直接解析）
+
+使い方:
+    python benchmarks/probe_benchmark.py 動画1.mkv 動画2.mp4 [--runs 5]
+
+bin/ffprobe.exe（main.pyと同じ配置）を使用し、キャッシュは使わずに毎回FFprobeを実行する。
+OSのファイルキャッシュの影響を揃えるため、計測前に各プロファイルを1回ずつ空実行する。
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MediaProbe, MediaRecord, NativeMediaParser
+
+
+def measure(file_path, profile, runs):
+    """指定プロファイルでFFprobeを実行し、各回の所要時間（ミリ秒）を返す"""
+    cmd = MediaProbe.build_command(file_path, profile)
+    MediaProbe.run_ffprobe(cmd)  # ウォームアップ
+
+    timings = []
+    record = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        data = MediaProbe.run_ffprobe(cmd)
+        timings.append((time.perf_counter() - start) * 1000)
+        record = MediaRecord.from_ffprobe(file_path, data)
+    return timings, record
+
+
+def measure_native(file_path, runs):
+    """ヘッダー直接解析の各回の所要時間（ミリ秒）を返す（対応外の形式はNone）"""
+    if NativeMediaParser.parse(file_path) is None:
+        return None
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        NativeMediaParser.parse(file_path)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FFprobe lean/full プロファイルのベンチマーク')
+    parser.add_argument('files', nargs='+', help='計測する動画ファイル')
+    parser.add_argument('--runs', type=int, default=5, help='プロファイルごとの実行回数')
+    args = parser.parse_args()
+
+    print(f"{'ファイル':<40} {'サイズ(MB)':>10} {'full(ms)':>10} {'lean(ms)':>10} {'高速化':>8} {'lean完全':>8} {'native(ms)':>10}")
+    for file_path in args.files:
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        full_timings, _ = measure(file_path, MediaProbe.PROFILE_FULL, args.runs)
+        lean_timings, lean_record = measure(file_path, MediaProbe.PROFILE_LEAN, args.runs)
+
+        full_median = statistics.median(full_timings)
+        lean_median = statistics.median(lean_timings)
+        speedup = full_median / lean_median if lean_median > 0 else 0
+        complete = 'OK' if lean_record.is_complete() else 'NG'
+        native_timings = measure_native(file_path, args.runs)
+        native_text = f"{statistics.median(native_timings):.2f}" if native_timings else '-'
+
+        name = os.path.basename(file_path)[:40]
+        print(f"{name:<40} {size_mb:>10.1f} {full_median:>10.1f} {lean_median:>10.1f} {speedup:>7.2f}x {complete:>8} {native_text:>10}")
+
+
+if __name__ == '__main__':
+    main()
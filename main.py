@@ -6,13 +6,26 @@ import datetime
 import platform
 import random
 import glob
+import sqlite3
+import threading
+import time
+import concurrent.futures
+import array
+import math
+import mmap
+import struct
+import hashlib
+import shutil
+import tempfile
 import ctypes
 import webbrowser
 import urllib.request
 import urllib.error
 from ctypes import wintypes
-from PyQt5.QtWidgets import QApplication, QMainWindow, QTextEdit, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QPushButton, QProgressBar, QMessageBox, QMenuBar, QAction, QDialog, QMenu, QActionGroup, QSystemTrayIcon
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSettings, QTimer
+import logging
+import numpy as np
+from PyQt5.QtWidgets import QApplication, QMainWindow, QTextEdit, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QSlider, QPushButton, QProgressBar, QMessageBox, QMenuBar, QAction, QDialog, QMenu, QActionGroup, QSystemTrayIcon, QListWidget, QListWidgetItem, QSpinBox, QLineEdit, QCheckBox
+from PyQt5.QtCore import Qt, QThread, QObject, pyqtSignal, QSettings, QTimer
 from PyQt5.QtGui import QPixmap, QIcon, QFont, QMovie
 
 # アプリケーション情報
@@ -21,6 +34,10 @@ APP_VERSION = "1.1.1"
 APP_DEVELOPER = "菊池組"
 APP_COPYRIGHT = "2025"
 
+# デバッグ用の詳細出力（環境変数 CLIPITBRO_LOG_LEVEL=DEBUG で表示。既定はWARNING以上のみ）
+LOG_LEVEL = os.environ.get('CLIPITBRO_LOG_LEVEL', 'WARNING').upper()
+estimation_logger = logging.getLogger(f'{APP_NAME}.estimation')
+
 def get_ffmpeg_executable_path(executable_name):
     """
     FFmpeg実行ファイルのパスを取得（単一exe環境対応）
@@ -40,6 +57,67 @@ def get_ffmpeg_executable_path(executable_name):
     
     return os.path.join(exe_dir, 'bin', executable_name)
 
+def get_app_data_dir(*sub_dirs):
+    """
+    キャッシュ等を保存するアプリケーションデータディレクトリを取得（無ければ作成）
+
+    Args:
+        *sub_dirs (str): データディレクトリ配下のサブディレクトリ名
+
+    Returns:
+        str: ディレクトリの絶対パス
+    """
+    if os.name == 'nt':
+        # Windows: %LOCALAPPDATA%\ClipItBro
+        base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        # その他: ~/.cache/ClipItBro
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    data_dir = os.path.join(base_dir, APP_NAME, *sub_dirs)
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+def get_ffmpeg_env():
+    """FFmpeg/FFprobe実行用の環境変数を取得（Windows環境の文字エンコーディング対策）"""
+    env = os.environ.copy()
+    env['PYTHONIOENCODING'] = 'utf-8'
+    if os.name == 'nt':  # Windows環境の場合
+        env['LANG'] = 'ja_JP.UTF-8'
+    return env
+
+def get_hidden_window_kwargs():
+    """Windowsでコマンドプロンプトウィンドウを表示しないためのsubprocess引数を取得"""
+    kwargs = {}
+    if os.name == 'nt':  # Windows環境の場合
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        kwargs['startupinfo'] = startupinfo
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    return kwargs
+
+def get_low_priority_kwargs():
+    """
+    バックグラウンド処理用に優先度を下げてプロセスを起動するsubprocess引数を取得
+
+    Windows以外では起動後にlower_process_priorityで下げる
+    （preexec_fnはスレッドから並列にPopenするとデッドロックし得るため使わない）
+    """
+    kwargs = get_hidden_window_kwargs()
+    if os.name == 'nt':
+        kwargs['creationflags'] |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    return kwargs
+
+def lower_process_priority(process):
+    """起動済みプロセスの優先度を下げる（Windowsは起動時のcreationflagsで設定済み）"""
+    if os.name == 'nt':
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, process.pid, 10)
+    except OSError:
+        pass  # 既に終了している場合など
+
 # Windows タスクバープログレス用のインポート（利用可能性をチェック）
 try:
     from PyQt5.QtWinExtras import QWinTaskbarButton, QWinTaskbarProgress
@@ -940,265 +1018,2350 @@ class ThemeManager:
         """
         text_edit.setStyleSheet(status_style)
 
-class DragDropTextEdit(QTextEdit):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setAcceptDrops(True)
-        self.setReadOnly(True)
-        self.video_file_path = None  # ドロップされた動画ファイルのパスを保存
-        self.original_style = ""  # 元のスタイルを保存
-        self.log_messages = []  # ログメッセージを保存
-        self.video_info = None  # 動画情報を保存
-        self.parent_window = parent  # 親ウィンドウへの参照を保存
-        self.first_pass_completed = False  # 1pass目完了フラグ
-        self.first_pass_data = None  # 1pass目で生成されたデータ
+def parse_frame_rate(rate_str):
+    """FFprobeのフレームレート表記（'60000/1001' など）をfloatに変換"""
+    if not rate_str:
+        return 0
+    try:
+        if '/' in str(rate_str):
+            num, den = map(int, str(rate_str).split('/'))
+            return num / den if den != 0 else 0
+        return float(rate_str)
+    except (TypeError, ValueError):
+        return 0
 
-    def contextMenuEvent(self, event):
-        """右クリックコンテキストメニューを表示"""
-        context_menu = QMenu(self)
-        
-        # Aboutアクション
-        about_action = QAction('ClipItBro について', self)
-        about_action.triggered.connect(self.show_about_from_context)
-        context_menu.addAction(about_action)
-        
-        # セパレーター
-        context_menu.addSeparator()
-        
-        # ログクリアアクション
-        clear_action = QAction('ログをクリア', self)
-        clear_action.triggered.connect(self.clear_logs)
-        context_menu.addAction(clear_action)
-        
-        # コンテキストメニューを表示
-        context_menu.exec_(event.globalPos())
-    
-    def show_about_from_context(self):
-        """コンテキストメニューからAboutダイアログを表示"""
-        if self.parent_window and hasattr(self.parent_window, 'show_about_dialog'):
-            self.parent_window.show_about_dialog()
-        else:
-            # 直接Aboutダイアログを作成
-            about_dialog = AboutDialog(self)
-            about_dialog.exec_()
-    
-    def clear_logs(self):
-        """ログをクリア"""
-        self.log_messages.clear()
-        self.update_display()
+def parse_timecode(text):
+    """'90', '1:30', '0:01:30.5' 形式の時刻を秒に変換（空欄はNone、不正な値はValueError）"""
+    text = (text or '').strip()
+    if not text:
+        return None
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0 or len(text.split(':')) > 3:
+        raise ValueError(text)
+    return seconds
 
-    def add_log(self, message):
-        """ログメッセージを追加してテキストエリアに表示"""
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {message}"
-        self.log_messages.append(log_entry)
-        print(log_entry)  # コンソールにも出力
-        
-        # ログが多くなりすぎないよう、最新の15件のみ保持
-        if len(self.log_messages) > 15:
-            self.log_messages = self.log_messages[-15:]
-        
-        self.update_display()
+def format_timecode(seconds):
+    """秒を 'H:MM:SS.ss' / 'M:SS.ss' 形式の文字列に変換"""
+    minutes, secs = divmod(max(0.0, seconds), 60)
+    hours, minutes = divmod(int(minutes), 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:05.2f}"
+    return f"{minutes}:{secs:05.2f}"
 
-    def update_display(self):
-        """現在の状態に応じてテキストエリアの内容を更新"""
-        if self.video_file_path:
-            content = f"動画ファイルが選択されました:\n{self.video_file_path}\n\n"
-            
-            # 動画情報を表示
-            if self.video_info:
-                content += "=== 動画情報 ===\n"
-                content += f"解像度: {self.video_info.get('width', 'N/A')}x{self.video_info.get('height', 'N/A')}\n"
-                content += f"フレームレート: {self.video_info.get('fps', 'N/A')} fps\n"
-                content += f"長さ: {self.video_info.get('duration', 'N/A')} 秒\n"
-                content += f"ビットレート: {self.video_info.get('bitrate', 'N/A')} kbps\n"
-                content += f"ファイルサイズ: {self.video_info.get('file_size', 'N/A')} MB\n"
-                
-                # 親ウィンドウからエンコード方式を取得
-                parent = self.parent()
-                while parent and not hasattr(parent, 'encoding_mode'):
-                    parent = parent.parent()
-                
-                # エンコード方式に応じた1pass状態表示
-                if parent and parent.encoding_mode == 'twopass':
-                    if self.first_pass_completed:
-                        content += f"✓ 1pass解析完了: 最適化準備完了\n"
-                    elif hasattr(self, '_first_pass_running') and self._first_pass_running:
-                        content += f"🔄 1pass解析中...\n"
-                    else:
-                        content += f"⏳ 1pass解析待機中\n"
-                else:
-                    content += f"📊 CRF方式選択中 (1pass解析不要)\n"
-                content += "\n"
-        else:
-            content = f"{APP_NAME} v{APP_VERSION} powered by {APP_DEVELOPER}\n"
-            content += "動画ファイル（mp4, avi, mov等）をここにドラッグ&ドロップしてください\n"
-            content += "2pass方式では、ドロップ時に自動的に1pass解析を実行します\n\n"
+class StreamRecord:
+    """メディアストリーム1本分の情報（キャッシュ用のコンパクトな型付きレコード）"""
 
-        content += "=== ログ ===\n"
-        content += "\n".join(self.log_messages)
-        
-        self.setText(content)
+    FIELDS = (
+        'index', 'codec_type', 'codec_name', 'width', 'height',
+        'r_frame_rate', 'avg_frame_rate', 'bit_rate',
+        'channels', 'channel_layout', 'sample_rate', 'language', 'title'
+    )
+    __slots__ = FIELDS
 
-    def get_video_info(self, file_path):
-        """FFprobeを使って動画情報を取得"""
-        ffprobe_path = get_ffmpeg_executable_path('ffprobe.exe')
-        try:
-            # ファイルパスを適切に処理（空白を含むパスに対応）
-            # Windowsの場合、パスを正規化
-            normalized_path = os.path.normpath(file_path)
-            
-            # FFprobeで動画情報を取得（リスト形式でコマンドを構築することで空白を含むパスに対応）
-            cmd = [
-                ffprobe_path,
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                '-show_streams',
-                normalized_path  # 正規化されたパスを使用
-            ]
-            
-            # Windows環境での文字エンコーディング問題を解決するため、環境変数を設定
-            env = os.environ.copy()
-            env['PYTHONIOENCODING'] = 'utf-8'
-            if os.name == 'nt':  # Windows環境の場合
-                env['LANG'] = 'ja_JP.UTF-8'
-            
-            # Windowsでコマンドプロンプトウィンドウを表示しないための設定
-            kwargs = {
-                'capture_output': True, 
-                'text': True, 
-                'check': True,
-                'encoding': 'utf-8', 
-                'errors': 'replace', 
-                'env': env
-            }
-            if os.name == 'nt':  # Windows環境の場合
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-                kwargs['startupinfo'] = startupinfo
-                kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-            
-            result = subprocess.run(cmd, **kwargs)
-            
-            # デバッグ用：コマンドと出力を記録
-            self.add_log(f"FFprobe実行: {' '.join(cmd[:3])} ... {os.path.basename(normalized_path)}")
-            
-            if not result.stdout or result.stdout.strip() == "":
-                self.add_log(f"FFprobe出力が空です。stderr: {result.stderr}")
-                return None
-                
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_ffprobe(cls, stream):
+        """FFprobeのstream辞書からレコードを作成"""
+        tags = stream.get('tags', {}) or {}
+
+        def to_int(value):
             try:
-                data = json.loads(result.stdout)
-            except json.JSONDecodeError as json_err:
-                self.add_log(f"JSON解析エラー: {json_err}")
-                self.add_log(f"FFprobe出力の最初の100文字: {result.stdout[:100]}")
-                self.add_log(f"FFprobe stderr: {result.stderr}")
-                return None
-            
-            # 動画ストリームを探す
-            video_stream = None
-            for stream in data.get('streams', []):
-                if stream.get('codec_type') == 'video':
-                    video_stream = stream
-                    break
-            
-            if video_stream:
-                # フレームレートの計算
-                fps_str = video_stream.get('r_frame_rate', '0/1')
-                if '/' in fps_str:
-                    num, den = map(int, fps_str.split('/'))
-                    fps = round(num / den, 2) if den != 0 else 0
-                else:
-                    fps = float(fps_str)
-                
-                # ファイルサイズの取得
-                file_size = round(int(data.get('format', {}).get('size', 0)) / (1024 * 1024), 2)
-                
-                # ビットレートの取得
-                bitrate = data.get('format', {}).get('bit_rate')
-                if bitrate:
-                    bitrate = round(int(bitrate) / 1000)  # kbpsに変換
-                
-                info = {
-                    'width': video_stream.get('width'),
-                    'height': video_stream.get('height'),
-                    'fps': fps,
-                    'duration': round(float(data.get('format', {}).get('duration', 0)), 2),
-                    'bitrate': bitrate,
-                    'file_size': file_size,
-                    'codec': video_stream.get('codec_name')
-                }
-                
-                self.add_log(f"動画情報を取得: {info['width']}x{info['height']}, {info['fps']}fps, {info['duration']}秒")
-                return info
-            else:
-                self.add_log("動画ストリームが見つかりませんでした")
+                return int(value) if value not in (None, '', 'N/A') else None
+            except (TypeError, ValueError):
                 return None
-                
-        except subprocess.CalledProcessError as e:
-            self.add_log(f"FFprobe実行エラー: {e}")
-            return None
-        except json.JSONDecodeError as e:
-            self.add_log(f"JSON解析エラー: {e}")
+
+        return cls(
+            index=to_int(stream.get('index')),
+            codec_type=stream.get('codec_type'),
+            codec_name=stream.get('codec_name'),
+            width=to_int(stream.get('width')),
+            height=to_int(stream.get('height')),
+            r_frame_rate=stream.get('r_frame_rate'),
+            avg_frame_rate=stream.get('avg_frame_rate'),
+            bit_rate=to_int(stream.get('bit_rate')),
+            channels=to_int(stream.get('channels')),
+            channel_layout=stream.get('channel_layout'),
+            sample_rate=to_int(stream.get('sample_rate')),
+            language=tags.get('language'),
+            title=tags.get('title') or tags.get('handler_name'),
+        )
+
+    def to_dict(self):
+        """Noneのフィールドを省いた辞書に変換（保存サイズ削減のため）"""
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+class MediaRecord:
+    """1ファイル分のメディア情報（全ストリームを保持）"""
+
+    def __init__(self, path, duration=0, size=0, bit_rate=None, format_name=None, streams=None):
+        self.path = path
+        self.duration = duration  # 秒
+        self.size = size  # バイト
+        self.bit_rate = bit_rate  # bps
+        self.format_name = format_name
+        self.streams = streams or []
+        self.probe_method = None  # native, ffprobe-lean, ffprobe-full
+        self.frame_timing = None  # パケットのタイムスタンプの抽出結果（FrameTiming.sampleの辞書、未抽出はNone）
+
+    @classmethod
+    def from_ffprobe(cls, path, data):
+        """FFprobeのJSON出力（-show_format -show_streams）からレコードを作成"""
+        format_info = data.get('format', {}) or {}
+
+        try:
+            duration = float(format_info.get('duration', 0) or 0)
+        except (TypeError, ValueError):
+            duration = 0
+        try:
+            size = int(format_info.get('size', 0) or 0)
+        except (TypeError, ValueError):
+            size = 0
+        try:
+            bit_rate = int(format_info.get('bit_rate')) if format_info.get('bit_rate') else None
+        except (TypeError, ValueError):
+            bit_rate = None
+
+        streams = [StreamRecord.from_ffprobe(stream) for stream in data.get('streams', [])]
+        return cls(path, duration, size, bit_rate, format_info.get('format_name'), streams)
+
+    def video_stream(self):
+        """最初の動画ストリームを取得"""
+        for stream in self.streams:
+            if stream.codec_type == 'video':
+                return stream
+        return None
+
+    def audio_streams(self):
+        """全ての音声ストリームを取得"""
+        return [stream for stream in self.streams if stream.codec_type == 'audio']
+
+    def frame_rate(self):
+        """
+        実際の平均フレームレート
+
+        ヘッダーの平均（avg_frame_rate）を優先し、ヘッダーでは固定フレームレートに見えるのに
+        タイムスタンプの抽出でVFRと分かった場合（MKV等）は抽出区間の平均を使う。
+        """
+        video_stream = self.video_stream()
+        if not video_stream:
+            return 0
+        average = parse_frame_rate(video_stream.avg_frame_rate) or parse_frame_rate(video_stream.r_frame_rate)
+        if not self.header_is_vfr() and self.frame_timing and self.frame_timing.get('vfr'):
+            return self.frame_timing['fps']
+        return average
+
+    def header_is_vfr(self):
+        """ヘッダーの平均（avg_frame_rate）と基準（r_frame_rate）のフレームレートが異なるかどうか"""
+        video_stream = self.video_stream()
+        if not video_stream:
+            return False
+        nominal = parse_frame_rate(video_stream.r_frame_rate)
+        average = parse_frame_rate(video_stream.avg_frame_rate)
+        return bool(nominal and average and abs(average - nominal) / nominal > FrameTiming.RATE_TOLERANCE)
+
+    def is_vfr(self):
+        """可変フレームレート（VFR）かどうか（ヘッダーとタイムスタンプの抽出結果のどちらかでVFRと分かればTrue）"""
+        return self.header_is_vfr() or bool(self.frame_timing and self.frame_timing.get('vfr'))
+
+    def is_complete(self):
+        """サイズ推定と変換に必要な情報が揃っているかどうか"""
+        video_stream = self.video_stream()
+        return bool(
+            video_stream
+            and video_stream.width and video_stream.height
+            and parse_frame_rate(video_stream.r_frame_rate) > 0
+            and self.duration > 0
+        )
+
+    def to_video_info(self):
+        """従来のvideo_info辞書形式に変換（動画ストリームが無い場合はNone）"""
+        video_stream = self.video_stream()
+        if not video_stream:
             return None
-        except Exception as e:
-            self.add_log(f"動画情報取得エラー: {e}")
+
+        return {
+            'width': video_stream.width,
+            'height': video_stream.height,
+            'fps': round(self.frame_rate(), 2),  # 実際の平均（VFRの場合は基準のフレームレートより低い）
+            'nominal_fps': round(parse_frame_rate(video_stream.r_frame_rate), 2),
+            'vfr': self.is_vfr(),
+            'duration': round(self.duration, 2),
+            'bitrate': round(self.bit_rate / 1000) if self.bit_rate else None,  # kbps
+            'file_size': round(self.size / (1024 * 1024), 2),  # MB
+            'codec': video_stream.codec_name,
+            'audio_tracks': len(self.audio_streams()),
+            'audio_kbps': plan_crf_audio(self).bitrate_kbps  # CRF方式で出力する音声のビットレート（既定のトラック）
+        }
+
+    def to_dict(self):
+        return {
+            'duration': self.duration,
+            'size': self.size,
+            'bit_rate': self.bit_rate,
+            'format_name': self.format_name,
+            'probe_method': self.probe_method,
+            'frame_timing': self.frame_timing,
+            'streams': [stream.to_dict() for stream in self.streams]
+        }
+
+    @classmethod
+    def from_dict(cls, path, data):
+        streams = [StreamRecord.from_dict(stream) for stream in data.get('streams', [])]
+        record = cls(path, data.get('duration', 0), data.get('size', 0), data.get('bit_rate'),
+                     data.get('format_name'), streams)
+        record.probe_method = data.get('probe_method')
+        record.frame_timing = data.get('frame_timing')
+        return record
+
+class MediaInfoCache:
+    """
+    メディア情報の永続キャッシュ（SQLite）
+
+    正規化パス + ファイルサイズ + 更新日時をキーとし、ヒット時はFFprobeを起動しない。
+    合計サイズが上限を超えた場合は最終アクセスが古いものから削除する（LRU）。
+    """
+
+    DEFAULT_MAX_BYTES = 8 * 1024 * 1024  # 8MB（1件あたり数百バイト程度）
+
+    def __init__(self, db_path=None, max_bytes=DEFAULT_MAX_BYTES):
+        if db_path is None:
+            db_path = os.path.join(get_app_data_dir('cache'), 'media_info.sqlite3')
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS media_info ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " record TEXT NOT NULL,"
+                " nbytes INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_media_info_last_access ON media_info (last_access)")
+
+    @staticmethod
+    def normalize_path(file_path):
+        """キャッシュキー用にパスを正規化（Windowsでは大文字小文字を区別しない）"""
+        return os.path.normcase(os.path.abspath(os.path.normpath(file_path)))
+
+    def get(self, file_path):
+        """キャッシュからMediaRecordを取得（無い・古い場合はNone）"""
+        key = self.normalize_path(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.misses += 1
             return None
 
-    def dragEnterEvent(self, event):
-        self.add_log("ドラッグが開始されました")
-        
-        # FFmpegが利用できない場合はドラッグを拒否
-        if hasattr(self, 'parent_window') and self.parent_window and hasattr(self.parent_window, 'ffmpeg_available'):
-            if not self.parent_window.ffmpeg_available:
-                self.add_log("FFmpegが利用できないため、ドラッグを拒否しました")
-                event.ignore()
-                return
-                
-        if event.mimeData().hasUrls():
-            urls = [url.toLocalFile() for url in event.mimeData().urls()]
-            self.add_log(f"ファイルを検出: {', '.join([os.path.basename(url) for url in urls])}")
-            # 元のスタイルを保存
-            self.original_style = self.styleSheet()
-            # ドラッグ中のスタイルを設定（境界線を追加）
-            self.setStyleSheet(self.original_style + "border: 2px dashed #007acc;")
-            # 全てのドロップアクションを受け入れ
-            event.setDropAction(Qt.CopyAction)
-            event.accept()
-            self.add_log("ドラッグイベント受け入れ完了")
-            return
-        event.ignore()
-        self.add_log("ドラッグイベント無視")
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, record FROM media_info WHERE path = ?", (key,)
+            ).fetchone()
 
-    def dragMoveEvent(self, event):
-        # dragMoveEventも追加してみる
-        if event.mimeData().hasUrls():
-            event.setDropAction(Qt.CopyAction)
-            event.accept()
-            return
-        event.ignore()
+            if row is None:
+                self.misses += 1
+                return None
 
-    def dragOverEvent(self, event):
-        # FFmpegが利用できない場合はドラッグを拒否
-        if hasattr(self, 'parent_window') and self.parent_window and hasattr(self.parent_window, 'ffmpeg_available'):
-            if not self.parent_window.ffmpeg_available:
-                event.ignore()
-                return
-                
-        if event.mimeData().hasUrls():
-            # ドラッグ中のカーソル表示を適切に設定
-            event.setDropAction(Qt.CopyAction)
-            event.accept()
+            size, mtime_ns, record_json = row
+            if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                # ファイルが更新されているので古いエントリを破棄
+                with self._conn:
+                    self._conn.execute("DELETE FROM media_info WHERE path = ?", (key,))
+                self.misses += 1
+                return None
+
+            with self._conn:
+                self._conn.execute("UPDATE media_info SET last_access = ? WHERE path = ?", (time.time(), key))
+            self.hits += 1
+
+        return MediaRecord.from_dict(file_path, json.loads(record_json))
+
+    def put(self, file_path, record):
+        """MediaRecordをキャッシュに保存"""
+        key = self.normalize_path(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
             return
-        event.ignore()
 
-    def dragLeaveEvent(self, event):
-        # ドラッグが離れた時に元のスタイルに戻す
-        self.add_log("ドラッグが離脱しました")
-        self.setStyleSheet(self.original_style)
-        super().dragLeaveEvent(event)
+        record_json = json.dumps(record.to_dict(), separators=(',', ':'), ensure_ascii=False)
+        nbytes = len(key) + len(record_json)
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_info (path, size, mtime_ns, record, nbytes, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stat.st_size, stat.st_mtime_ns, record_json, nbytes, time.time())
+            )
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """合計サイズが上限を超えていれば古いエントリから削除（ロック取得済みで呼ぶ）"""
+        total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM media_info").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        # 上限の90%まで削減して頻繁な削除を避ける
+        target_bytes = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT path, nbytes FROM media_info ORDER BY last_access ASC").fetchall()
+        evict_paths = []
+        for path, nbytes in rows:
+            if total_bytes <= target_bytes:
+                break
+            evict_paths.append((path,))
+            total_bytes -= nbytes
+        self._conn.executemany("DELETE FROM media_info WHERE path = ?", evict_paths)
+
+    def clear(self):
+        """キャッシュを全削除"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM media_info")
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ヒット/ミス数と保存状況を取得"""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM media_info"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+_media_info_cache = None
+
+def get_media_info_cache():
+    """共有のメディア情報キャッシュを取得（作成できない環境ではNone）"""
+    global _media_info_cache
+    if _media_info_cache is None:
+        try:
+            _media_info_cache = MediaInfoCache()
+        except Exception as e:
+            print(f"メディア情報キャッシュ初期化エラー: {e}")
+            return None
+    return _media_info_cache
+
+_fingerprint_memo = {}
+_fingerprint_lock = threading.Lock()
+
+def compute_content_fingerprint(file_path, sample_bytes=1024 * 1024, cached_only=False):
+    """
+    ファイル内容のフィンガープリント（サイズ + 先頭・中央・末尾のサンプルのSHA-1）
+
+    パスや更新日時に依存しないため、コピー・移動したファイルでも同じ値になる。
+    計算結果はパス・サイズ・更新日時ごとにメモリ上で再利用する。
+    cached_only=Trueの場合はファイルを読まず、計算済みでなければNoneを返す（GUIスレッド用）。
+    """
+    stat = os.stat(file_path)
+    memo_key = (MediaInfoCache.normalize_path(file_path), stat.st_size, stat.st_mtime_ns)
+    with _fingerprint_lock:
+        if memo_key in _fingerprint_memo:
+            return _fingerprint_memo[memo_key]
+    if cached_only:
+        return None
+
+    digest = hashlib.sha1(str(stat.st_size).encode('ascii'))
+    with open(file_path, 'rb') as f:
+        for offset in sorted({0, max(0, stat.st_size // 2 - sample_bytes // 2), max(0, stat.st_size - sample_bytes)}):
+            f.seek(offset)
+            digest.update(f.read(sample_bytes))
+    fingerprint = digest.hexdigest()
+    with _fingerprint_lock:
+        _fingerprint_memo[memo_key] = fingerprint
+    return fingerprint
+
+class PassStatsCache:
+    """
+    2pass変換の1pass目の統計（passログ・mbtree）の永続キャッシュ
+
+    入力のフィンガープリント + コーデック + トリミング範囲 + フィルタをキーとし、
+    ヒット時は1pass目を省略して2pass目から実行できる（目標サイズが違っても再利用可能）。
+    ファイルはキーごとのディレクトリに保存し、索引はSQLiteで管理する。
+    合計サイズが上限を超えた場合は最終アクセスが古いものから削除する（LRU）。
+    """
+
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB（1080p60の10分でmbtreeが約600MB）
+    FILE_PREFIX = 'pass'  # 保存時のファイル名（passログのプレフィックスを置き換える）
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or get_app_data_dir('cache', 'passlog')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite3'), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pass_stats ("
+                " key TEXT PRIMARY KEY,"
+                " nbytes INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pass_stats_last_access ON pass_stats (last_access)")
+
+    @staticmethod
+    def make_key(video_file, use_h265=False, trim_range=None, filter_chain='', encoder_profile=''):
+        """キャッシュキーを作成（入力が読めない場合はNone）"""
+        try:
+            fingerprint = compute_content_fingerprint(video_file)
+        except OSError:
+            return None
+        codec = 'libx265' if use_h265 else 'libx264'
+        range_text = f"{trim_range[0]:.3f}-{trim_range[1]:.3f}" if trim_range else 'full'
+        key = f"{fingerprint}|{codec}|{range_text}|{filter_chain}|{encoder_profile}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, passlog_prefix):
+        """
+        キャッシュ済みの統計をpassログのプレフィックスの位置に復元
+
+        Returns:
+            bool: 復元できたかどうか
+        """
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            row = self._conn.execute("SELECT key FROM pass_stats WHERE key = ?", (key,)).fetchone()
+            names = os.listdir(entry_dir) if row and os.path.isdir(entry_dir) else []
+            if not names:
+                if row:
+                    # ファイルが消えているエントリは破棄
+                    with self._conn:
+                        self._conn.execute("DELETE FROM pass_stats WHERE key = ?", (key,))
+                self.misses += 1
+                return False
+            try:
+                for name in names:
+                    shutil.copyfile(os.path.join(entry_dir, name), passlog_prefix + name[len(self.FILE_PREFIX):])
+            except OSError:
+                self.misses += 1
+                return False
+            with self._conn:
+                self._conn.execute("UPDATE pass_stats SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return True
+
+    def store(self, key, passlog_prefix):
+        """1pass目の出力（プレフィックス-0.log、.mbtree等）をキャッシュに保存"""
+        directory, base = os.path.split(passlog_prefix)
+        try:
+            names = [name for name in os.listdir(directory)
+                     if name.startswith(base + '-') and not name.endswith('.temp')]
+        except OSError:
+            return False
+        if not names:
+            return False
+
+        entry_dir = self._entry_dir(key)
+        staging_dir = tempfile.mkdtemp(prefix='store_', dir=self.cache_dir)
+        try:
+            nbytes = 0
+            for name in names:
+                target = os.path.join(staging_dir, self.FILE_PREFIX + name[len(base):])
+                shutil.copyfile(os.path.join(directory, name), target)
+                nbytes += os.path.getsize(target)
+            with self._lock:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(staging_dir, entry_dir)
+                now = time.time()
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO pass_stats (key, nbytes, created, last_access) VALUES (?, ?, ?, ?)",
+                        (key, nbytes, now, now)
+                    )
+                    self._evict_locked()
+            return True
+        except OSError:
+            return False
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _evict_locked(self):
+        """合計サイズが上限を超えていれば古いエントリから削除（ロック取得済みで呼ぶ）"""
+        total_bytes = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM pass_stats").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+
+        # 上限の90%まで削減して頻繁な削除を避ける
+        target_bytes = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, nbytes FROM pass_stats ORDER BY last_access ASC").fetchall()
+        evict_keys = []
+        for key, nbytes in rows:
+            if total_bytes <= target_bytes:
+                break
+            evict_keys.append((key,))
+            total_bytes -= nbytes
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        self._conn.executemany("DELETE FROM pass_stats WHERE key = ?", evict_keys)
+
+    def clear(self):
+        """キャッシュを全削除"""
+        with self._lock, self._conn:
+            for (key,) in self._conn.execute("SELECT key FROM pass_stats").fetchall():
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            self._conn.execute("DELETE FROM pass_stats")
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ヒット/ミス数と保存状況を取得"""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM pass_stats"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+_pass_stats_cache = None
+
+def get_pass_stats_cache():
+    """共有の1pass統計キャッシュを取得（作成できない環境ではNone）"""
+    global _pass_stats_cache
+    if _pass_stats_cache is None:
+        try:
+            _pass_stats_cache = PassStatsCache()
+        except Exception as e:
+            print(f"1pass統計キャッシュ初期化エラー: {e}")
+            return None
+    return _pass_stats_cache
+
+class AudioTrackCache(PassStatsCache):
+    """
+    エンコード済みの音声（AudioTrack）の永続キャッシュ
+
+    入力のフィンガープリント + トリミング範囲 + 音声設定をキーとし、目標サイズ・コーデック・
+    2pass目のやり直しが変わっても同じ音声を再エンコードせずに結合できる。
+    保存形式とLRUによる削除はPassStatsCacheと同じ。
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(cache_dir or get_app_data_dir('cache', 'audio'), max_bytes)
+
+    @staticmethod
+    def make_key(video_file, trim_range=None, audio_plan=None):
+        """キャッシュキーを作成（入力が読めない場合はNone）"""
+        try:
+            fingerprint = compute_content_fingerprint(video_file)
+        except OSError:
+            return None
+        range_text = f"{trim_range[0]:.3f}-{trim_range[1]:.3f}" if trim_range else 'full'
+        key = f"audio|mp4|{fingerprint}|{range_text}|{audio_plan.cache_text()}"
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+_audio_track_cache = None
+
+def get_audio_track_cache():
+    """共有の音声キャッシュを取得（作成できない環境ではNone）"""
+    global _audio_track_cache
+    if _audio_track_cache is None:
+        try:
+            _audio_track_cache = AudioTrackCache()
+        except Exception as e:
+            print(f"音声キャッシュ初期化エラー: {e}")
+            return None
+    return _audio_track_cache
+
+class NativeMediaParser:
+    """
+    MP4/MOV/MKV/WebMのヘッダーをPythonで直接読むパーサー（FFprobeを起動しない高速経路）
+
+    ファイルはメモリマップで開き、MP4はmoov/trak、MKVはSegmentのInfo/Tracksのみを読む。
+    解析できない・情報が足りない場合はNoneを返し、呼び出し側でFFprobeにフォールバックする。
+    """
+
+    MP4_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.3gp')
+    MKV_EXTENSIONS = ('.mkv', '.webm')
+
+    # MP4サンプルエントリ → FFprobeのcodec_name
+    MP4_CODECS = {
+        b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc',
+        b'av01': 'av1', b'vp09': 'vp9', b'mp4v': 'mpeg4',
+        b'mp4a': 'aac', b'ac-3': 'ac3', b'ec-3': 'eac3', b'Opus': 'opus', b'fLaC': 'flac',
+        b'sowt': 'pcm_s16le', b'twos': 'pcm_s16be', b'lpcm': 'pcm_s16le', b'.mp3': 'mp3'
+    }
+
+    # MKV CodecID → FFprobeのcodec_name（前方一致）
+    MKV_CODECS = (
+        ('V_MPEG4/ISO/AVC', 'h264'), ('V_MPEGH/ISO/HEVC', 'hevc'), ('V_AV1', 'av1'),
+        ('V_VP9', 'vp9'), ('V_VP8', 'vp8'),
+        ('A_AAC', 'aac'), ('A_OPUS', 'opus'), ('A_EAC3', 'eac3'), ('A_AC3', 'ac3'),
+        ('A_FLAC', 'flac'), ('A_VORBIS', 'vorbis'), ('A_MPEG/L3', 'mp3'),
+        ('A_PCM/INT/LIT', 'pcm_s16le'), ('A_PCM/FLOAT/IEEE', 'pcm_f32le')
+    )
+
+    # 一般的なフレームレート（MKVのDefaultDurationから分数表記を復元するため）
+    COMMON_FRAME_RATES = (
+        (24000, 1001), (24, 1), (25, 1), (30000, 1001), (30, 1), (48, 1),
+        (50, 1), (60000, 1001), (60, 1), (90, 1), (120, 1), (144, 1), (165, 1), (240, 1)
+    )
+
+    # MKV要素ID
+    EBML_HEADER = 0x1A45DFA3
+    EBML_DOCTYPE = 0x4282
+    MKV_SEGMENT = 0x18538067
+    MKV_INFO = 0x1549A966
+    MKV_TIMESTAMP_SCALE = 0x2AD7B1
+    MKV_DURATION = 0x4489
+    MKV_TRACKS = 0x1654AE6B
+    MKV_TRACK_ENTRY = 0xAE
+    MKV_TRACK_TYPE = 0x83
+    MKV_CODEC_ID = 0x86
+    MKV_DEFAULT_DURATION = 0x23E383
+    MKV_LANGUAGE = 0x22B59C
+    MKV_NAME = 0x536E
+    MKV_VIDEO = 0xE0
+    MKV_PIXEL_WIDTH = 0xB0
+    MKV_PIXEL_HEIGHT = 0xBA
+    MKV_AUDIO = 0xE1
+    MKV_SAMPLING_FREQUENCY = 0xB5
+    MKV_CHANNELS = 0x9F
+    MKV_CLUSTER = 0x1F43B675
+
+    @staticmethod
+    def parse(file_path):
+        """ヘッダーを解析してMediaRecordを返す（対応外・解析失敗時はNone）"""
+        lower_path = file_path.lower()
+        if lower_path.endswith(NativeMediaParser.MP4_EXTENSIONS):
+            parse_func = NativeMediaParser._parse_mp4
+        elif lower_path.endswith(NativeMediaParser.MKV_EXTENSIONS):
+            parse_func = NativeMediaParser._parse_mkv
+        else:
+            return None
+
+        try:
+            with open(file_path, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    record = parse_func(file_path, data, file_size)
+        except (OSError, ValueError, struct.error, IndexError, StopIteration):
+            return None
+
+        if record is not None:
+            record.probe_method = 'native'
+        return record
+
+    @staticmethod
+    def _fraction(num, den):
+        """約分した分数表記（'60000/1001' など）"""
+        if num <= 0 or den <= 0:
+            return None
+        divisor = math.gcd(int(num), int(den))
+        return f"{int(num) // divisor}/{int(den) // divisor}"
+
+    # === MP4/MOV ===
+
+    @staticmethod
+    def _iter_boxes(data, start, end):
+        """指定範囲のボックスを列挙して (type, 本体開始位置, 終了位置) を返す"""
+        pos = start
+        while pos + 8 <= end:
+            size, box_type = struct.unpack_from('>I4s', data, pos)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack_from('>Q', data, pos + 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = end - pos  # ファイル末尾まで
+            if size < header_size or pos + size > end:
+                return
+            yield box_type, pos + header_size, pos + size
+            pos += size
+
+    @staticmethod
+    def _find_box(data, start, end, path):
+        """ボックスの階層パス（[b'mdia', b'minf', ...]）をたどって本体範囲を返す"""
+        for box_type, body_start, body_end in NativeMediaParser._iter_boxes(data, start, end):
+            if box_type == path[0]:
+                if len(path) == 1:
+                    return body_start, body_end
+                return NativeMediaParser._find_box(data, body_start, body_end, path[1:])
+        return None
+
+    @staticmethod
+    def _parse_mp4(file_path, data, file_size):
+        moov = NativeMediaParser._find_box(data, 0, file_size, [b'moov'])
+        if not moov:
+            return None
+
+        # mvhd: ファイル全体のタイムスケールと長さ
+        mvhd = NativeMediaParser._find_box(data, moov[0], moov[1], [b'mvhd'])
+        if not mvhd:
+            return None
+        version = data[mvhd[0]]
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', data, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', data, mvhd[0] + 12)
+        if timescale == 0:
+            return None
+        duration_seconds = duration / timescale
+
+        streams = []
+        for box_type, trak_start, trak_end in NativeMediaParser._iter_boxes(data, moov[0], moov[1]):
+            if box_type != b'trak':
+                continue
+            stream = NativeMediaParser._parse_mp4_track(data, trak_start, trak_end)
+            if stream is not None:
+                stream.index = len(streams)
+                streams.append(stream)
+
+        bit_rate = int(file_size * 8 / duration_seconds) if duration_seconds > 0 else None
+        return MediaRecord(file_path, duration_seconds, file_size, bit_rate, 'mov,mp4,m4a,3gp,3g2,mj2', streams)
+
+    @staticmethod
+    def _parse_mp4_track(data, trak_start, trak_end):
+        mdia = NativeMediaParser._find_box(data, trak_start, trak_end, [b'mdia'])
+        if not mdia:
+            return None
+
+        hdlr = NativeMediaParser._find_box(data, mdia[0], mdia[1], [b'hdlr'])
+        mdhd = NativeMediaParser._find_box(data, mdia[0], mdia[1], [b'mdhd'])
+        stbl = NativeMediaParser._find_box(data, mdia[0], mdia[1], [b'minf', b'stbl'])
+        if not (hdlr and mdhd and stbl):
+            return None
+
+        handler = data[hdlr[0] + 8:hdlr[0] + 12]
+        if handler == b'vide':
+            codec_type = 'video'
+        elif handler == b'soun':
+            codec_type = 'audio'
+        else:
+            return None  # 字幕・タイムコード等は対象外
+
+        # mdhd: トラックのタイムスケールと長さ
+        if data[mdhd[0]] == 1:
+            timescale, track_duration = struct.unpack_from('>IQ', data, mdhd[0] + 20)
+        else:
+            timescale, track_duration = struct.unpack_from('>II', data, mdhd[0] + 12)
+
+        stream = StreamRecord(codec_type=codec_type)
+
+        # stsd: コーデックと解像度/音声パラメータ
+        stsd = NativeMediaParser._find_box(data, stbl[0], stbl[1], [b'stsd'])
+        if stsd and stsd[1] - stsd[0] >= 16:
+            entry_start = stsd[0] + 8
+            fourcc = bytes(data[entry_start + 4:entry_start + 8])
+            stream.codec_name = NativeMediaParser.MP4_CODECS.get(fourcc, fourcc.decode('latin-1').strip())
+            body = entry_start + 8 + 8  # SampleEntryヘッダー（reserved 6 + data_reference_index 2）の後
+            if codec_type == 'video':
+                stream.width, stream.height = struct.unpack_from('>HH', data, body + 16)
+            else:
+                stream.channels = struct.unpack_from('>H', data, body + 8)[0]
+                stream.sample_rate = struct.unpack_from('>I', data, body + 16)[0] >> 16
+
+        # stts: フレーム数とフレーム間隔（最頻の間隔を基準フレームレートとする）
+        stts = NativeMediaParser._find_box(data, stbl[0], stbl[1], [b'stts'])
+        sample_count = 0
+        if stts and timescale:
+            entry_count = struct.unpack_from('>I', data, stts[0] + 4)[0]
+            total_ticks = 0
+            dominant_delta, dominant_count = 0, 0
+            for i in range(entry_count):
+                count, delta = struct.unpack_from('>II', data, stts[0] + 8 + i * 8)
+                sample_count += count
+                total_ticks += count * delta
+                if count > dominant_count:
+                    dominant_delta, dominant_count = delta, count
+            if codec_type == 'video' and dominant_delta and total_ticks:
+                stream.r_frame_rate = NativeMediaParser._fraction(timescale, dominant_delta)
+                stream.avg_frame_rate = NativeMediaParser._fraction(sample_count * timescale, total_ticks)
+
+        # stsz: 総データ量からストリームのビットレートを算出
+        stsz = NativeMediaParser._find_box(data, stbl[0], stbl[1], [b'stsz'])
+        if stsz and timescale and track_duration:
+            sample_size, count = struct.unpack_from('>II', data, stsz[0] + 4)
+            if sample_size:
+                total_bytes = sample_size * count
+            else:
+                sizes = array.array('I', bytes(data[stsz[0] + 12:stsz[0] + 12 + count * 4]))
+                if sys.byteorder == 'little':
+                    sizes.byteswap()
+                total_bytes = sum(sizes)
+            stream.bit_rate = int(total_bytes * 8 * timescale / track_duration)
+
+        return stream
+
+    # === MKV/WebM ===
+
+    @staticmethod
+    def _read_vint(data, pos, keep_marker):
+        """EBMLの可変長整数を読む（IDはマーカービットを残し、サイズは除く）"""
+        first = data[pos]
+        if first == 0:
+            raise ValueError("不正なEBML可変長整数")
+        length = 1
+        mask = 0x80
+        while not (first & mask):
+            mask >>= 1
+            length += 1
+        value = first if keep_marker else first & (mask - 1)
+        for i in range(1, length):
+            value = (value << 8) | data[pos + i]
+        unknown = not keep_marker and value == (1 << (7 * length)) - 1
+        return value, length, unknown
+
+    @staticmethod
+    def _iter_elements(data, start, end):
+        """指定範囲のEBML要素を列挙して (ID, 本体開始位置, 終了位置) を返す"""
+        pos = start
+        while pos < end:
+            element_id, id_length, _ = NativeMediaParser._read_vint(data, pos, True)
+            size, size_length, unknown = NativeMediaParser._read_vint(data, pos + id_length, False)
+            body_start = pos + id_length + size_length
+            body_end = end if unknown else min(end, body_start + size)
+            yield element_id, body_start, body_end
+            if unknown:
+                return  # サイズ不明の要素は読み飛ばせない
+            pos = body_start + size
+
+    @staticmethod
+    def _read_uint(data, start, end):
+        return int.from_bytes(data[start:end], 'big')
+
+    @staticmethod
+    def _read_float(data, start, end):
+        if end - start == 4:
+            return struct.unpack_from('>f', data, start)[0]
+        if end - start == 8:
+            return struct.unpack_from('>d', data, start)[0]
+        return 0.0
+
+    @staticmethod
+    def _read_string(data, start, end):
+        return bytes(data[start:end]).rstrip(b'\x00').decode('utf-8', errors='replace')
+
+    @staticmethod
+    def _parse_mkv(file_path, data, file_size):
+        elements = NativeMediaParser._iter_elements(data, 0, file_size)
+        element_id, header_start, header_end = next(elements)
+        if element_id != NativeMediaParser.EBML_HEADER:
+            return None
+
+        format_name = 'matroska,webm'
+        for child_id, body_start, body_end in NativeMediaParser._iter_elements(data, header_start, header_end):
+            if child_id == NativeMediaParser.EBML_DOCTYPE:
+                doc_type = NativeMediaParser._read_string(data, body_start, body_end)
+                if doc_type not in ('matroska', 'webm'):
+                    return None
+
+        segment = None
+        for element_id, body_start, body_end in elements:
+            if element_id == NativeMediaParser.MKV_SEGMENT:
+                segment = (body_start, body_end)
+                break
+        if not segment:
+            return None
+
+        timestamp_scale = 1000000  # ナノ秒（デフォルト1ms）
+        duration = None
+        streams = []
+        for element_id, body_start, body_end in NativeMediaParser._iter_elements(data, segment[0], segment[1]):
+            if element_id == NativeMediaParser.MKV_INFO:
+                for child_id, child_start, child_end in NativeMediaParser._iter_elements(data, body_start, body_end):
+                    if child_id == NativeMediaParser.MKV_TIMESTAMP_SCALE:
+                        timestamp_scale = NativeMediaParser._read_uint(data, child_start, child_end)
+                    elif child_id == NativeMediaParser.MKV_DURATION:
+                        duration = NativeMediaParser._read_float(data, child_start, child_end)
+            elif element_id == NativeMediaParser.MKV_TRACKS:
+                for child_id, child_start, child_end in NativeMediaParser._iter_elements(data, body_start, body_end):
+                    if child_id == NativeMediaParser.MKV_TRACK_ENTRY:
+                        stream = NativeMediaParser._parse_mkv_track(data, child_start, child_end)
+                        if stream is not None:
+                            stream.index = len(streams)
+                            streams.append(stream)
+            elif element_id == NativeMediaParser.MKV_CLUSTER:
+                break  # ヘッダー情報はクラスターより前にある
+
+        if not duration:
+            return None  # 録画中断などでDurationが書かれていない場合はFFprobeに任せる
+
+        duration_seconds = duration * timestamp_scale / 1e9
+        bit_rate = int(file_size * 8 / duration_seconds) if duration_seconds > 0 else None
+        return MediaRecord(file_path, duration_seconds, file_size, bit_rate, format_name, streams)
+
+    @staticmethod
+    def _parse_mkv_track(data, start, end):
+        values = {}
+        for element_id, body_start, body_end in NativeMediaParser._iter_elements(data, start, end):
+            if element_id in (NativeMediaParser.MKV_VIDEO, NativeMediaParser.MKV_AUDIO):
+                for child_id, child_start, child_end in NativeMediaParser._iter_elements(data, body_start, body_end):
+                    values[child_id] = (child_start, child_end)
+            else:
+                values[element_id] = (body_start, body_end)
+
+        def uint_value(element_id):
+            span = values.get(element_id)
+            return NativeMediaParser._read_uint(data, *span) if span else None
+
+        def string_value(element_id):
+            span = values.get(element_id)
+            return NativeMediaParser._read_string(data, *span) if span else None
+
+        track_type = uint_value(NativeMediaParser.MKV_TRACK_TYPE)
+        if track_type == 1:
+            codec_type = 'video'
+        elif track_type == 2:
+            codec_type = 'audio'
+        else:
+            return None
+
+        codec_id = string_value(NativeMediaParser.MKV_CODEC_ID) or ''
+        codec_name = codec_id
+        for prefix, name in NativeMediaParser.MKV_CODECS:
+            if codec_id.startswith(prefix):
+                codec_name = name
+                break
+
+        stream = StreamRecord(
+            codec_type=codec_type,
+            codec_name=codec_name,
+            language=string_value(NativeMediaParser.MKV_LANGUAGE),
+            title=string_value(NativeMediaParser.MKV_NAME)
+        )
+
+        if codec_type == 'video':
+            stream.width = uint_value(NativeMediaParser.MKV_PIXEL_WIDTH)
+            stream.height = uint_value(NativeMediaParser.MKV_PIXEL_HEIGHT)
+            default_duration = uint_value(NativeMediaParser.MKV_DEFAULT_DURATION)  # ナノ秒/フレーム
+            if default_duration:
+                stream.r_frame_rate = NativeMediaParser._frame_rate_from_duration(default_duration)
+                stream.avg_frame_rate = stream.r_frame_rate
+        else:
+            stream.channels = uint_value(NativeMediaParser.MKV_CHANNELS) or 1
+            span = values.get(NativeMediaParser.MKV_SAMPLING_FREQUENCY)
+            stream.sample_rate = int(NativeMediaParser._read_float(data, *span)) if span else 8000
+
+        return stream
+
+    @staticmethod
+    def _frame_rate_from_duration(frame_duration_ns):
+        """フレーム間隔（ナノ秒）から分数表記のフレームレートを求める"""
+        fps = 1e9 / frame_duration_ns
+        for num, den in NativeMediaParser.COMMON_FRAME_RATES:
+            if abs(fps - num / den) / (num / den) < 0.001:
+                return f"{num}/{den}"
+        return NativeMediaParser._fraction(1000000000, frame_duration_ns)
+
+class MediaProbeError(Exception):
+    """動画情報の取得に失敗した場合の例外"""
+
+class MediaProbe:
+    """FFprobeによるメディア情報取得（GUIに依存しないのでワーカースレッドから呼べる）"""
+
+    TIMEOUT_SECONDS = 120  # ネットワークドライブ等で無限に待たないための上限
+
+    # 解析プロファイル
+    PROFILE_LEAN = 'lean'  # 必要な項目のみ・読み込み範囲を制限
+    PROFILE_FULL = 'full'  # 全項目（leanで情報が欠けた場合のフォールバック）
+
+    # leanプロファイルで取得する項目（MediaRecordが使う項目のみ）
+    LEAN_ENTRIES = (
+        'format=duration,size,bit_rate,format_name'
+        ':stream=index,codec_type,codec_name,width,height,r_frame_rate,avg_frame_rate,'
+        'bit_rate,channels,channel_layout,sample_rate'
+        ':stream_tags=language,title,handler_name'
+    )
+    LEAN_PROBESIZE = 5 * 1000 * 1000  # バイト
+    LEAN_ANALYZEDURATION = 2 * 1000 * 1000  # マイクロ秒
+
+    @staticmethod
+    def build_command(file_path, profile=PROFILE_LEAN):
+        """解析プロファイルに応じたFFprobeコマンドを構築"""
+        ffprobe_path = get_ffmpeg_executable_path('ffprobe.exe')
+
+        if profile == MediaProbe.PROFILE_FULL:
+            return [
+                ffprobe_path,
+                '-v', 'quiet',
+                '-print_format', 'json',
+                '-show_format',
+                '-show_streams',
+                file_path
+            ]
+
+        return [
+            ffprobe_path,
+            '-v', 'quiet',
+            # ストリーム解析で読み込む量を制限（巨大ファイルでもヘッダー付近のみ読む）
+            '-probesize', str(MediaProbe.LEAN_PROBESIZE),
+            '-analyzeduration', str(MediaProbe.LEAN_ANALYZEDURATION),
+            '-read_intervals', '%+#1',
+            '-show_entries', MediaProbe.LEAN_ENTRIES,
+            '-print_format', 'json=compact=1',
+            file_path
+        ]
+
+    @staticmethod
+    def run_ffprobe(cmd):
+        """
+        FFprobeを実行してJSON出力を辞書で返す
+
+        Raises:
+            MediaProbeError: FFprobeの実行や出力の解析に失敗した場合
+        """
+        kwargs = {
+            'capture_output': True,
+            'text': True,
+            'check': True,
+            'encoding': 'utf-8',
+            'errors': 'replace',
+            'env': get_ffmpeg_env(),
+            'timeout': MediaProbe.TIMEOUT_SECONDS
+        }
+        kwargs.update(get_hidden_window_kwargs())
+
+        try:
+            result = subprocess.run(cmd, **kwargs)
+        except subprocess.CalledProcessError as e:
+            raise MediaProbeError(f"FFprobe実行エラー: {e}")
+        except subprocess.TimeoutExpired:
+            raise MediaProbeError(f"FFprobeがタイムアウトしました ({MediaProbe.TIMEOUT_SECONDS}秒)")
+        except OSError as e:
+            raise MediaProbeError(f"FFprobe起動エラー: {e}")
+
+        if not result.stdout or result.stdout.strip() == "":
+            raise MediaProbeError(f"FFprobe出力が空です。stderr: {result.stderr}")
+
+        try:
+            return json.loads(result.stdout)
+        except json.JSONDecodeError as e:
+            raise MediaProbeError(f"JSON解析エラー: {e} (出力の最初の100文字: {result.stdout[:100]})")
+
+    @staticmethod
+    def probe(file_path, profile=PROFILE_LEAN):
+        """
+        FFprobeを実行してMediaRecordを取得
+
+        leanプロファイルで必要な情報が揃わなかった場合はfullプロファイルで再解析する。
+
+        Raises:
+            MediaProbeError: FFprobeの実行や出力の解析に失敗した場合
+        """
+        normalized_path = os.path.normpath(file_path)
+
+        if profile == MediaProbe.PROFILE_LEAN:
+            # MP4/MKVはヘッダーを直接読んでFFprobeの起動を省く
+            record = NativeMediaParser.parse(normalized_path)
+            if record is not None and record.is_complete():
+                return record
+
+            try:
+                data = MediaProbe.run_ffprobe(MediaProbe.build_command(normalized_path, MediaProbe.PROFILE_LEAN))
+                record = MediaRecord.from_ffprobe(normalized_path, data)
+                if record.is_complete():
+                    record.probe_method = 'ffprobe-lean'
+                    return record
+            except MediaProbeError:
+                pass
+
+        data = MediaProbe.run_ffprobe(MediaProbe.build_command(normalized_path, MediaProbe.PROFILE_FULL))
+        record = MediaRecord.from_ffprobe(normalized_path, data)
+        record.probe_method = 'ffprobe-full'
+        return record
+
+    @staticmethod
+    def probe_cached(file_path, cache=None, sample_timing=False):
+        """
+        キャッシュを優先してMediaRecordを取得
+
+        sample_timing=Trueの場合はパケットのタイムスタンプも抽出してVFRの判定に使う
+        （抽出結果もキャッシュに保存し、抽出済みなら読み直さない）。
+
+        Returns:
+            tuple: (MediaRecord, キャッシュヒットしたかどうか)
+        """
+        if cache is None:
+            cache = get_media_info_cache()
+
+        from_cache = False
+        record = cache.get(file_path) if cache else None
+        if record and record.video_stream():
+            if not sample_timing or record.frame_timing:
+                return record, True
+            from_cache = True
+        else:
+            record = MediaProbe.probe(file_path)
+
+        if sample_timing and record.video_stream():
+            record.frame_timing = FrameTiming.sample(os.path.normpath(file_path), record.duration)
+        if cache and record.video_stream():
+            cache.put(file_path, record)
+        return record, from_cache
+
+class ProbeService(QObject):
+    """
+    FFprobeをワーカースレッドプールで非同期実行するサービス
+
+    同じパスの解析が実行中の場合は新たに起動せず、実行中のFutureを共有する。
+    結果はprobe_finishedシグナル（GUIスレッドにキューイングされる）とFutureの両方で受け取れる。
+    """
+    probe_finished = pyqtSignal(str, object, bool, str)  # file_path, MediaRecord, from_cache, error_message
+
+    def __init__(self, max_workers=None, parent=None):
+        super().__init__(parent)
+        if not max_workers:
+            max_workers = min(4, os.cpu_count() or 1)
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='probe')
+        self._in_flight = {}  # 正規化パス -> Future
+        self._lock = threading.Lock()
+        self.sample_frame_timing = False  # パケットのタイムスタンプも抽出してVFRを判定する
+
+    def submit(self, file_path):
+        """解析を要求してFutureを返す（同じパスが実行中ならそのFutureを返す）"""
+        key = MediaInfoCache.normalize_path(file_path)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(MediaProbe.probe_cached, file_path, None, self.sample_frame_timing)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda f, key=key, path=file_path: self._on_done(key, path, f))
+        return future
+
+    def is_probing(self, file_path):
+        """指定パスの解析が実行中かどうか"""
+        with self._lock:
+            return MediaInfoCache.normalize_path(file_path) in self._in_flight
+
+    def _on_done(self, key, file_path, future):
+        """ワーカースレッドで呼ばれる完了処理"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+        if future.cancelled():
+            self.probe_finished.emit(file_path, None, False, "解析がキャンセルされました")
+            return
+
+        error = future.exception()
+        if error is not None:
+            self.probe_finished.emit(file_path, None, False, str(error))
+        else:
+            record, from_cache = future.result()
+            self.probe_finished.emit(file_path, record, from_cache, "")
+
+    def set_max_workers(self, max_workers):
+        """同時実行数を変更（実行中の解析は旧プールでそのまま完了させる）"""
+        max_workers = max(1, int(max_workers))
+        if max_workers == self.max_workers:
+            return
+        with self._lock:
+            old_executor = self._executor
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='probe')
+            self.max_workers = max_workers
+        old_executor.shutdown(wait=False)
+
+    def shutdown(self):
+        """未着手の解析を破棄してプールを停止"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp')
+
+def is_video_file(file_path):
+    """ファイルが動画ファイルかどうかを拡張子で判定"""
+    return file_path.lower().endswith(VIDEO_EXTENSIONS)
+
+def scan_video_files(paths):
+    """
+    ファイル/フォルダのリストから動画ファイルを収集（フォルダは再帰的に走査）
+
+    Returns:
+        list: 重複を除いた動画ファイルパスのリスト（指定順、フォルダ内は名前順）
+    """
+    video_files = []
+    seen = set()
+
+    def add_file(file_path):
+        key = MediaInfoCache.normalize_path(file_path)
+        if key not in seen and is_video_file(file_path):
+            seen.add(key)
+            video_files.append(os.path.normpath(file_path))
+
+    def scan_dir(dir_path):
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name.lower())
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    scan_dir(entry.path)
+                elif entry.is_file():
+                    add_file(entry.path)
+            except OSError:
+                continue
+
+    for path in paths:
+        if os.path.isdir(path):
+            scan_dir(path)
+        elif os.path.isfile(path):
+            add_file(path)
+
+    return video_files
+
+class MediaBatchItem:
+    """バッチ内の1ファイル分の状態"""
+
+    def __init__(self, path):
+        self.path = path
+        self.record = None  # MediaRecord
+        self.video_info = None  # 従来形式の動画情報
+        self.status = 'pending'  # pending, probing, ready, error
+        self.error = None
+
+class MediaBatch(QObject):
+    """
+    複数ファイルドロップ時のファイルとメタデータの一覧
+
+    解析はProbeServiceのワーカープールで並列実行され、同時実行数はプールの上限に従う。
+    変換処理はready_items()で解析済みのファイルを取得して利用する。
+    """
+    item_updated = pyqtSignal(int)  # 更新された項目のインデックス
+    batch_finished = pyqtSignal()
+
+    def __init__(self, paths, probe_service, parent=None):
+        super().__init__(parent)
+        self.items = [MediaBatchItem(path) for path in paths]
+        self.probe_service = probe_service
+        self._index_by_key = {MediaInfoCache.normalize_path(item.path): i for i, item in enumerate(self.items)}
+        self._started_at = None
+        self._finished_at = None
+        probe_service.probe_finished.connect(self._on_probe_finished)
+
+    def start(self):
+        """全ファイルの解析を投入"""
+        self._started_at = time.time()
+        for item in self.items:
+            item.status = 'probing'
+            self.probe_service.submit(item.path)
+
+    def _on_probe_finished(self, file_path, record, from_cache, error_message):
+        index = self._index_by_key.get(MediaInfoCache.normalize_path(file_path))
+        if index is None:
+            return
+
+        item = self.items[index]
+        if item.status not in ('pending', 'probing'):
+            return
+
+        video_info = record.to_video_info() if record else None
+        if video_info:
+            item.record = record
+            item.video_info = video_info
+            item.status = 'ready'
+        else:
+            item.error = error_message or "動画ストリームが見つかりませんでした"
+            item.status = 'error'
+        self.item_updated.emit(index)
+
+        if self.is_finished():
+            self._finished_at = time.time()
+            self.batch_finished.emit()
+
+    def is_finished(self):
+        return all(item.status in ('ready', 'error') for item in self.items)
+
+    def release(self):
+        """ProbeServiceとの接続を解除（新しいバッチに置き換える時に呼ぶ）"""
+        try:
+            self.probe_service.probe_finished.disconnect(self._on_probe_finished)
+        except TypeError:
+            pass
+        self.deleteLater()
+
+    def ready_items(self):
+        """解析済みの項目を取得"""
+        return [item for item in self.items if item.status == 'ready']
+
+    def elapsed_seconds(self):
+        if self._started_at is None:
+            return 0
+        return (self._finished_at or time.time()) - self._started_at
+
+    def summary_text(self):
+        """表示用のバッチ概要"""
+        ready_count = len(self.ready_items())
+        error_count = sum(1 for item in self.items if item.status == 'error')
+        text = f"=== バッチ ({len(self.items)}件) ===\n"
+        text += f"解析済み: {ready_count} / エラー: {error_count} / 全体: {len(self.items)}\n"
+        return text
+
+class ComplexityProfile:
+    """
+    動画ストリームの秒単位の複雑度プロファイル
+
+    圧縮済みパケットサイズとキーフレーム位置から作成し、
+    フレームサンプリングを行った場合は空間/時間情報（SI/TI）も保持する。
+    """
+
+    # SI/TIの基準値（160px幅のグレースケールで一般的なゲーム映像を想定）
+    REFERENCE_SI = 45.0
+    REFERENCE_TI = 12.0
+    # キーフレームに対する非キーフレームの平均サイズ比の基準値
+    REFERENCE_INTER_RATIO = 0.25
+
+    def __init__(self, bytes_per_second, keyframes_per_second, key_bytes=0, key_count=0,
+                 inter_bytes=0, inter_count=0, si=None, ti=None):
+        self.bytes_per_second = bytes_per_second  # np.ndarray (float64)
+        self.keyframes_per_second = keyframes_per_second  # np.ndarray (int64)
+        self.key_bytes = key_bytes
+        self.key_count = key_count
+        self.inter_bytes = inter_bytes
+        self.inter_count = inter_count
+        self.si = si  # np.ndarray またはNone（フレームごとの空間情報）
+        self.ti = ti  # np.ndarray またはNone（フレーム間の時間情報）
+
+    @property
+    def duration(self):
+        return len(self.bytes_per_second)
+
+    def kbps_per_second(self, start=0, end=None):
+        """秒ごとのビットレート（kbps）"""
+        return self.bytes_per_second[int(start):None if end is None else int(math.ceil(end))] * 8 / 1000
+
+    def mean_kbps(self, start=0, end=None):
+        """動画ストリームのみの平均ビットレート（kbps）"""
+        kbps = self.kbps_per_second(start, end)
+        return float(kbps.mean()) if len(kbps) else 0.0
+
+    def percentile_kbps(self, percentile, start=0, end=None):
+        kbps = self.kbps_per_second(start, end)
+        return float(np.percentile(kbps, percentile)) if len(kbps) else 0.0
+
+    def inter_ratio(self):
+        """キーフレームに対する非キーフレームの平均サイズ比（動きが激しいほど大きい）"""
+        if not self.key_count or not self.inter_count or not self.key_bytes:
+            return None
+        return (self.inter_bytes / self.inter_count) / (self.key_bytes / self.key_count)
+
+    def complexity_factor(self):
+        """
+        基準的な映像に対する符号化の難しさ（CRFでの出力ビットレートの補正係数）
+
+        SI/TIがあればそれを使い、無ければキーフレーム/非キーフレームのサイズ比から推定する。
+        """
+        if self.si is not None and self.ti is not None and len(self.si) and len(self.ti):
+            si_factor = (float(self.si.mean()) + 1) / (self.REFERENCE_SI + 1)
+            ti_factor = (float(self.ti.mean()) + 1) / (self.REFERENCE_TI + 1)
+            factor = (si_factor ** 0.2) * (ti_factor ** 0.3)
+            return float(min(1.4, max(0.7, factor)))
+
+        # サイズ比は元動画のエンコーダー設定にも左右されるため、補正は控えめにする
+        ratio = self.inter_ratio()
+        if ratio is None:
+            return 1.0
+        factor = (ratio / self.REFERENCE_INTER_RATIO) ** 0.3
+        return float(min(1.25, max(0.8, factor)))
+
+    def save(self, file_path):
+        arrays = {
+            'bytes_per_second': self.bytes_per_second,
+            'keyframes_per_second': self.keyframes_per_second,
+            'counters': np.array([self.key_bytes, self.key_count, self.inter_bytes, self.inter_count], dtype=np.float64)
+        }
+        if self.si is not None and self.ti is not None:
+            arrays['si'] = self.si
+            arrays['ti'] = self.ti
+        with open(file_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            key_bytes, key_count, inter_bytes, inter_count = data['counters'].tolist()
+            return cls(
+                data['bytes_per_second'], data['keyframes_per_second'],
+                key_bytes, int(key_count), inter_bytes, int(inter_count),
+                data['si'] if 'si' in data else None,
+                data['ti'] if 'ti' in data else None
+            )
+
+class RateCurve:
+    """
+    1ファイル専用のCRF方式の出力ビットレート曲線
+
+    log(kbps) = 切片 + 傾き×CRF + 指数×log(画素比) の形で、サンプルエンコードの実測値に当てはめる。
+    スケールを変えた計測が無い場合、画素比の指数は一般的な値（DEFAULT_SCALE_EXPONENT）を使う。
+    """
+
+    DEFAULT_SCALE_EXPONENT = 0.75  # 画素数が半分になるとビットレートは約0.6倍
+    SLOPE_RANGE = (-0.25, -0.03)  # CRF+1あたりの対数ビットレートの変化（x264では約-0.11）
+    SCALE_EXPONENT_RANGE = (0.4, 2.0)
+
+    def __init__(self, intercept, crf_slope, scale_exponent=DEFAULT_SCALE_EXPONENT, points=None):
+        self.intercept = intercept
+        self.crf_slope = crf_slope
+        self.scale_exponent = scale_exponent
+        self.points = list(points or [])  # [(CRF, スケール, 実測kbps), ...]
+
+    @classmethod
+    def fit(cls, points):
+        """実測点 [(CRF, スケール, kbps), ...] に最小二乗で当てはめる"""
+        points = [(crf, scale, kbps) for crf, scale, kbps in points if kbps > 0 and scale > 0]
+        if len(points) < 2:
+            return None
+        crfs = np.array([p[0] for p in points], dtype=np.float64)
+        log_pixels = np.array([2 * math.log(p[1]) for p in points], dtype=np.float64)
+        log_kbps = np.array([math.log(p[2]) for p in points], dtype=np.float64)
+
+        if len(points) >= 3 and np.ptp(log_pixels) > 0:
+            design = np.column_stack([np.ones(len(points)), crfs, log_pixels])
+            intercept, slope, exponent = np.linalg.lstsq(design, log_kbps, rcond=None)[0]
+            exponent = min(cls.SCALE_EXPONENT_RANGE[1], max(cls.SCALE_EXPONENT_RANGE[0], exponent))
+        else:
+            exponent = cls.DEFAULT_SCALE_EXPONENT
+            design = np.column_stack([np.ones(len(points)), crfs])
+            intercept, slope = np.linalg.lstsq(design, log_kbps - exponent * log_pixels, rcond=None)[0]
+        slope = min(cls.SLOPE_RANGE[1], max(cls.SLOPE_RANGE[0], slope))
+        # 傾き・指数を制限した場合でも実測点の中心を通るように切片を合わせ直す
+        intercept = float(np.mean(log_kbps - slope * crfs - exponent * log_pixels))
+        return cls(intercept, float(slope), float(exponent), points)
+
+    def predict_kbps(self, crf, scale_factor=1.0):
+        """指定CRF・スケールでの映像ビットレート（kbps、配列を渡すとまとめて計算）"""
+        return np.exp(self.intercept + self.crf_slope * np.asarray(crf, dtype=np.float64)
+                      + self.scale_exponent * 2 * np.log(scale_factor))
+
+    def to_dict(self):
+        return {
+            'intercept': self.intercept,
+            'crf_slope': self.crf_slope,
+            'scale_exponent': self.scale_exponent,
+            'points': self.points,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['intercept'], data['crf_slope'], data.get('scale_exponent', cls.DEFAULT_SCALE_EXPONENT),
+                   [tuple(p) for p in data.get('points', [])])
+
+    def save(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @staticmethod
+    def cache_path(file_path, encoder_profile=''):
+        """校正結果の保存先（ファイル内容のフィンガープリントとエンコーダー設定から決まる）"""
+        key = f"{compute_content_fingerprint(file_path)}|{encoder_profile}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(get_app_data_dir('cache', 'calibration'), f"{digest}.json")
+
+class PacketComplexityAnalyzer:
+    """
+    FFprobeのパケット情報を逐次読み込んで複雑度プロファイルを作成
+
+    -show_packets の出力はCSVで1行ずつ処理し、全体をJSONとして保持しない。
+    """
+
+    BATCH_SIZE = 65536  # NumPy配列にまとめて集計するパケット数
+    SAMPLE_WIDTH = 160  # フレームサンプリング時の縮小幅
+    SAMPLE_FPS = 2  # フレームサンプリングの間隔（毎秒）
+
+    def __init__(self, file_path, duration, should_stop=None):
+        self.file_path = file_path
+        self.duration = duration
+        self.should_stop = should_stop or (lambda: False)
+        self.process = None
+
+    @staticmethod
+    def cache_path(file_path, with_frames=False):
+        """プロファイルの保存先（パス・サイズ・更新日時から決まる）"""
+        stat = os.stat(file_path)
+        key = f"{MediaInfoCache.normalize_path(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{int(with_frames)}"
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(get_app_data_dir('cache', 'complexity'), f"{digest}.npz")
+
+    def iter_packets(self, read_intervals=None, with_dts=False):
+        """
+        動画ストリームのパケットを (秒, バイト数, キーフレームか) で順に返すジェネレーター
+
+        with_dts=Trueの場合は末尾にデコード時刻（秒）を加えて返す。
+        """
+        cmd = [
+            get_ffmpeg_executable_path('ffprobe.exe'),
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,dts_time,size,flags',
+            '-of', 'csv=p=0',
+        ]
+        if read_intervals:
+            cmd += ['-read_intervals', read_intervals]
+        cmd.append(self.file_path)
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            env=get_ffmpeg_env(),
+            **get_hidden_window_kwargs()
+        )
+        try:
+            for line in self.process.stdout:
+                if self.should_stop():
+                    break
+                fields = line.strip().split(',')
+                if len(fields) < 4:
+                    continue
+                pts_time, dts_time, size, flags = fields[:4]
+                try:
+                    timestamp = float(pts_time if pts_time not in ('', 'N/A') else dts_time)
+                    if with_dts:
+                        decode_time = float(dts_time) if dts_time not in ('', 'N/A') else timestamp
+                        yield timestamp, int(size), 'K' in flags, decode_time
+                    else:
+                        yield timestamp, int(size), 'K' in flags
+                except ValueError:
+                    continue
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+
+    def analyze(self, sample_frames=False):
+        """複雑度プロファイルを作成（停止要求時はNone）"""
+        seconds = max(1, int(math.ceil(self.duration)))
+        bytes_per_second = np.zeros(seconds, dtype=np.float64)
+        keyframes_per_second = np.zeros(seconds, dtype=np.int64)
+        counters = {'key_bytes': 0.0, 'key_count': 0, 'inter_bytes': 0.0, 'inter_count': 0, 'last_index': -1}
+
+        times = np.empty(self.BATCH_SIZE, dtype=np.float64)
+        sizes = np.empty(self.BATCH_SIZE, dtype=np.float64)
+        keys = np.empty(self.BATCH_SIZE, dtype=bool)
+
+        def flush(count):
+            nonlocal bytes_per_second, keyframes_per_second
+            if count == 0:
+                return
+            index = np.clip(times[:count], 0, None).astype(np.int64)
+            needed = int(index.max()) + 1
+            if needed > len(bytes_per_second):
+                # 実際の長さがコンテナの長さより長い場合は配列を伸ばす
+                bytes_per_second = np.pad(bytes_per_second, (0, needed - len(bytes_per_second)))
+                keyframes_per_second = np.pad(keyframes_per_second, (0, needed - len(keyframes_per_second)))
+            bytes_per_second += np.bincount(index, weights=sizes[:count], minlength=len(bytes_per_second))
+            keyframes_per_second += np.bincount(index[keys[:count]], minlength=len(keyframes_per_second))
+            counters['key_bytes'] += float(sizes[:count][keys[:count]].sum())
+            counters['key_count'] += int(keys[:count].sum())
+            counters['inter_bytes'] += float(sizes[:count][~keys[:count]].sum())
+            counters['inter_count'] += int((~keys[:count]).sum())
+            counters['last_index'] = max(counters['last_index'], needed - 1)
+
+        count = 0
+        for timestamp, size, is_key in self.iter_packets():
+            times[count] = timestamp
+            sizes[count] = size
+            keys[count] = is_key
+            count += 1
+            if count == self.BATCH_SIZE:
+                flush(count)
+                count = 0
+        flush(count)
+
+        if self.should_stop() or counters['last_index'] < 0:
+            return None
+
+        # コンテナの長さより実際のパケットが短い場合は末尾の空の秒を除く
+        length = counters['last_index'] + 1
+        profile = ComplexityProfile(
+            bytes_per_second[:length], keyframes_per_second[:length],
+            counters['key_bytes'], counters['key_count'],
+            counters['inter_bytes'], counters['inter_count']
+        )
+
+        if sample_frames:
+            si, ti = self.sample_spatial_temporal()
+            if si is not None:
+                profile.si, profile.ti = si, ti
+
+        return profile
+
+    def keyframe_times(self, start=None, end=None, with_dts=False):
+        """
+        キーフレームの時刻一覧（先頭パケットを0秒とした相対秒）
+
+        start/endを指定した場合はその範囲付近のパケットだけを読み込む。
+        with_dts=Trueの場合は (表示時刻, デコード時刻) の組で返す。
+        """
+        first_time = None
+        read_intervals = None
+        if start is not None:
+            # 範囲指定時はファイル先頭のパケット時刻を基準にする
+            for timestamp, size, is_key in self.iter_packets('%+#1'):
+                first_time = timestamp
+            if first_time is None:
+                return []
+            end_text = f"{first_time + end:.6f}" if end is not None else ''
+            read_intervals = f"{first_time + start:.6f}%{end_text}"
+
+        times = []
+        for timestamp, size, is_key, decode_time in self.iter_packets(read_intervals, with_dts=True):
+            if read_intervals is None and (first_time is None or timestamp < first_time):
+                first_time = timestamp
+            if is_key:
+                times.append((timestamp, decode_time))
+        if self.should_stop() or first_time is None:
+            return []
+        times = sorted((t - first_time, d - first_time) for t, d in times)
+        return times if with_dts else [t for t, d in times]
+
+    def sample_spatial_temporal(self):
+        """
+        縮小したグレースケールフレームをデコードしてSI/TI（ITU-T P.910）を計算
+
+        Returns:
+            tuple: (SIの配列, TIの配列)。失敗時は (None, None)
+        """
+        cmd = [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-v', 'error',
+            '-i', self.file_path,
+            '-map', '0:v:0',
+            '-vf', f'fps={self.SAMPLE_FPS},scale={self.SAMPLE_WIDTH}:-2:flags=area,format=gray',
+            '-f', 'rawvideo',
+            'pipe:1'
+        ]
+        info_height = None
+        try:
+            record = NativeMediaParser.parse(self.file_path) or MediaProbe.probe(self.file_path)
+            video_stream = record.video_stream()
+            if video_stream and video_stream.width and video_stream.height:
+                info_height = int(round(video_stream.height * self.SAMPLE_WIDTH / video_stream.width / 2)) * 2
+        except MediaProbeError:
+            pass
+        if not info_height:
+            return None, None
+
+        frame_bytes = self.SAMPLE_WIDTH * info_height
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=get_ffmpeg_env(),
+            **get_hidden_window_kwargs()
+        )
+
+        si_values = []
+        ti_values = []
+        previous = None
+        try:
+            while not self.should_stop():
+                buffer = self.process.stdout.read(frame_bytes)
+                if not buffer or len(buffer) < frame_bytes:
+                    break
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(info_height, self.SAMPLE_WIDTH).astype(np.float32)
+
+                # Sobelフィルタの勾配強度の標準偏差（空間情報）
+                gx = (frame[1:-1, 2:] - frame[1:-1, :-2]) * 2 + (frame[:-2, 2:] - frame[:-2, :-2]) + (frame[2:, 2:] - frame[2:, :-2])
+                gy = (frame[2:, 1:-1] - frame[:-2, 1:-1]) * 2 + (frame[2:, :-2] - frame[:-2, :-2]) + (frame[2:, 2:] - frame[:-2, 2:])
+                si_values.append(float(np.hypot(gx, gy).std()))
+
+                # 前フレームとの差分の標準偏差（時間情報）
+                if previous is not None:
+                    ti_values.append(float((frame - previous).std()))
+                previous = frame
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+
+        if not si_values:
+            return None, None
+        return np.array(si_values, dtype=np.float32), np.array(ti_values, dtype=np.float32)
+
+class FrameTiming:
+    """
+    パケットのタイムスタンプから実際のフレームレートと可変フレームレート（VFR）かどうかを求める
+
+    ゲームの録画などのVFR素材はヘッダーのフレームレートが実際と一致しないことがあるため、
+    数か所の区間のパケットだけを読み込んでフレーム間隔を調べる（全体は読まない）。
+    """
+
+    RATE_TOLERANCE = 0.01  # avg_frame_rateとr_frame_rateの差がこれを超えたらVFRとみなす
+    DELTA_TOLERANCE = 0.1  # フレーム間隔が中央値からこれ以上ずれたものを不規則とみなす
+    TIMEBASE_SLACK = 0.0015  # タイムベースの丸め（MKVの1ms等）による間隔の揺れ（秒）
+    IRREGULAR_SHARE = 0.02  # 不規則な間隔がこの割合を超えたらVFRとみなす
+    SAMPLE_SECONDS = 5  # 1区間の長さ（秒）
+    SAMPLE_POSITIONS = (0.0, 0.25, 0.5, 0.75)  # 抽出する区間の開始位置（長さに対する割合）
+
+    @staticmethod
+    def sample(file_path, duration, should_stop=None):
+        """
+        数か所の区間のタイムスタンプを抽出して集計（失敗時None）
+
+        Returns:
+            dict: {'fps': 平均フレームレート, 'vfr': VFRかどうか, 'irregular': 不規則な間隔の割合, 'frames': 抽出数}
+        """
+        analyzer = PacketComplexityAnalyzer(file_path, duration, should_stop)
+        first_time = None
+        for timestamp, size, is_key in analyzer.iter_packets('%+#1'):
+            first_time = timestamp
+        if first_time is None:
+            return None
+
+        intervals = []
+        for position in FrameTiming.SAMPLE_POSITIONS:
+            start = first_time + duration * position
+            if intervals and start < intervals[-1] + FrameTiming.SAMPLE_SECONDS:
+                continue  # 短い動画では区間が重なるので重なる区間は省く
+            intervals.append(start)
+        groups = []
+        for start in intervals:
+            read_interval = f"{start:.6f}%+{FrameTiming.SAMPLE_SECONDS}"
+            groups.append([timestamp for timestamp, size, is_key in analyzer.iter_packets(read_interval)])
+        if analyzer.should_stop():
+            return None
+        return FrameTiming.summarize(groups)
+
+    @staticmethod
+    def summarize(groups):
+        """区間ごとのタイムスタンプの一覧から平均フレームレートとVFRかどうかを求める（フレームが足りない場合はNone）"""
+        deltas = [np.diff(np.sort(np.asarray(timestamps, dtype=np.float64))) for timestamps in groups if len(timestamps) > 2]
+        if not deltas:
+            return None
+        deltas = np.concatenate(deltas)
+        deltas = deltas[deltas > 0]  # 同じ時刻のパケット（フィールド等）は間隔に含めない
+        if len(deltas) < 2:
+            return None
+        median = float(np.median(deltas))
+        slack = max(median * FrameTiming.DELTA_TOLERANCE, FrameTiming.TIMEBASE_SLACK)
+        irregular = float(np.mean(np.abs(deltas - median) > slack))
+        return {
+            'fps': round(len(deltas) / float(deltas.sum()), 3),
+            'vfr': irregular > FrameTiming.IRREGULAR_SHARE,
+            'irregular': round(irregular, 4),
+            'frames': sum(len(timestamps) for timestamps in groups),
+        }
+
+class SmartTrimError(Exception):
+    pass
+
+class SmartTrimmer:
+    """
+    キーフレームを考慮したトリミング（変換前の切り出し）
+
+    範囲内の最初と最後のキーフレームの間はストリームコピーし、その前後の
+    不完全なGOPだけを元と同じコーデックで高画質に再エンコードする。
+    各区間はMKVで作成してconcat demuxerで結合する。concat demuxerは最初の区間のextradataしか
+    引き継がないため、どの区間もSPS/PPS（HEVCはVPSも）をキーフレームごとにストリーム内へ書き、
+    区間ごとにパラメータセットが異なっても正しくデコードできるようにする。出力は変換の入力用（MKV）。
+    """
+
+    # ストリームコピー区間と結合できる再エンコード用エンコーダー
+    ENCODERS = {
+        'h264': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '12', '-x264-params', 'repeat-headers=1'],
+        'hevc': ['-c:v', 'libx265', '-preset', 'veryfast', '-crf', '14',
+                 '-x265-params', 'log-level=error:repeat-headers=1'],
+    }
+    FALLBACK_ENCODER = ENCODERS['h264']
+    AUDIO_PREROLL = 5.0  # 音声切り出し時の粗いシーク幅（秒）
+    MIN_SEGMENT = 0.001
+
+    def __init__(self, file_path, start, end, should_stop=None, on_progress=None):
+        self.file_path = file_path
+        self.start = start
+        self.end = end
+        self.should_stop = should_stop or (lambda: False)
+        self.on_progress = on_progress or (lambda percent: None)
+        self.process = None
+        self._done_seconds = 0.0
+
+    def plan(self, keyframes, codec_name):
+        """
+        区間の分割計画を作成
+
+        Args:
+            keyframes: [(表示時刻, デコード時刻), ...]
+
+        Returns:
+            list: [(種類 'encode' / 'copy', 開始秒, 終了秒, 終了キーフレームのデコード時刻), ...]
+        """
+        interior = [(t, d) for t, d in keyframes if self.start <= t <= self.end]
+        if codec_name not in self.ENCODERS or len(interior) < 2:
+            # 結合できない場合は範囲全体を再エンコード（それでも範囲の長さだけで済む）
+            return [('encode', self.start, self.end, None)]
+
+        (first_key, _), (last_key, last_key_dts) = interior[0], interior[-1]
+        segments = []
+        if first_key - self.start > self.MIN_SEGMENT:
+            segments.append(('encode', self.start, first_key, None))
+        segments.append(('copy', first_key, last_key, last_key_dts))
+        if self.end - last_key > self.MIN_SEGMENT:
+            segments.append(('encode', last_key, self.end, None))
+        return segments
+
+    def run(self, output_path, work_dir):
+        """トリミングを実行して分割計画を返す（失敗時はSmartTrimError）"""
+        record, _ = MediaProbe.probe_cached(self.file_path)
+        video_stream = record.video_stream()
+        if video_stream is None:
+            raise SmartTrimError("動画ストリームが見つかりません")
+
+        # 範囲付近のパケットだけを読んでキーフレーム位置を取得
+        analyzer = PacketComplexityAnalyzer(self.file_path, record.duration, self.should_stop)
+        keyframes = analyzer.keyframe_times(self.start, self.end, with_dts=True)
+        self.check_stop()
+        # 区間の境界は隣り合うフレームの中間に置き、丸め誤差で1フレームずれないようにする
+        fps = parse_frame_rate(video_stream.avg_frame_rate) or parse_frame_rate(video_stream.r_frame_rate) or 30
+        half_frame = 0.5 / fps
+
+        segments = self.plan(keyframes, video_stream.codec_name)
+        encoder = self.ENCODERS.get(video_stream.codec_name, self.FALLBACK_ENCODER)
+        segment_paths = []
+        for i, (kind, start, end, end_key_dts) in enumerate(segments):
+            segment_path = os.path.join(work_dir, f'trim_{i:02d}.mkv')
+            cmd = [get_ffmpeg_executable_path('ffmpeg.exe'), '-y']
+            if kind == 'copy':
+                # 入力シークはシーク位置以前のキーフレームから始まるため、丸め誤差分だけ後ろを指定。
+                # コピー時の長さはデコード時刻で判定されるため、終了キーフレームのデコード時刻の直前で切る
+                seek = start + self.MIN_SEGMENT
+                # MP4/MKVの元動画はパラメータセットがextradataにしかない場合があるため、Annex B形式にして各キーフレームの前に書き出す
+                cmd += ['-ss', f'{seek:.6f}', '-i', self.file_path, '-t', f'{end_key_dts - seek - half_frame:.6f}',
+                        '-map', '0:v:0', '-c', 'copy', '-bsf:v', f'{video_stream.codec_name}_mp4toannexb']
+            else:
+                seek = start if i == 0 else start - half_frame
+                length = (end if i == len(segments) - 1 else end - half_frame) - seek
+                cmd += ['-ss', f'{seek:.6f}', '-i', self.file_path, '-t', f'{length:.6f}',
+                        '-map', '0:v:0'] + encoder
+            cmd += ['-an', '-sn', '-dn', '-f', 'matroska', segment_path]
+            self.run_ffmpeg(cmd, end - start)
+            segment_paths.append(segment_path)
+
+        list_path = os.path.join(work_dir, 'trim_concat.txt')
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in segment_paths:
+                escaped = path.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        cmd = [get_ffmpeg_executable_path('ffmpeg.exe'), '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if record.audio_streams():
+            # 音声はパケット単位で切り出せるため、粗い入力シーク+正確な出力シークでコピー
+            audio_path = os.path.join(work_dir, 'trim_audio.mka')
+            coarse = max(0.0, self.start - self.AUDIO_PREROLL)
+            self.run_ffmpeg([
+                get_ffmpeg_executable_path('ffmpeg.exe'), '-y',
+                '-ss', f'{coarse:.6f}', '-i', self.file_path,
+                '-ss', f'{self.start - coarse:.6f}', '-t', f'{self.end - self.start:.6f}',
+                '-map', '0:a', '-vn', '-sn', '-dn', '-c', 'copy', audio_path
+            ], 0)
+            cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        else:
+            cmd += ['-map', '0:v']
+        cmd += ['-c', 'copy', output_path]
+        self.run_ffmpeg(cmd, 0)
+        self.on_progress(100)
+        return segments
+
+    def check_stop(self):
+        if self.should_stop():
+            raise SmartTrimError("トリミングが停止されました")
+
+    def run_ffmpeg(self, cmd, segment_seconds):
+        """FFmpegを実行して進行状況を通知（失敗時はSmartTrimError）"""
+        import re
+
+        self.check_stop()
+        total = max(self.end - self.start, 0.001)
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=get_ffmpeg_env(),
+            encoding='utf-8',
+            errors='replace',
+            universal_newlines=True,
+            **get_hidden_window_kwargs()
+        )
+        tail = []
+        for output in self.process.stdout:
+            time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})', output)
+            if time_match and segment_seconds > 0:
+                hours, minutes, seconds, centiseconds = (int(g) for g in time_match.groups())
+                current = min(segment_seconds, hours * 3600 + minutes * 60 + seconds + centiseconds / 100)
+                self.on_progress(min(99, (self._done_seconds + current) / total * 100))
+            elif output.strip():
+                tail = (tail + [output.strip()])[-3:]
+        return_code = self.process.wait()
+        self.check_stop()
+        if return_code != 0:
+            raise SmartTrimError(f"終了コード {return_code}: {' / '.join(tail)}")
+        self._done_seconds += segment_seconds
+
+class DragDropTextEdit(QTextEdit):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAcceptDrops(True)
+        self.setReadOnly(True)
+        self.video_file_path = None  # ドロップされた動画ファイルのパスを保存
+        self.original_style = ""  # 元のスタイルを保存
+        self.log_messages = []  # ログメッセージを保存
+        self.video_info = None  # 動画情報を保存
+        self.parent_window = parent  # 親ウィンドウへの参照を保存
+        self.first_pass_completed = False  # 1pass目完了フラグ
+        self.first_pass_data = None  # 1pass目で生成されたデータ
+        self.first_pass_range = None  # 1pass目を解析したトリミング範囲（Noneは全体）
+        self.first_pass_workspace = None  # 1pass目の統計を保存した作業ディレクトリ
+        self.first_pass_output_fps = None  # 1pass目の固定フレームレート（2pass目と一致させる）
+        self._probing = False  # 動画情報取得中フラグ
+        self.media_batch = None  # 複数ファイルドロップ時のバッチ
+        self.complexity_profile = None  # サイズ推定用の複雑度プロファイル
+        self.complexity_thread = None
+        self.rate_curve = None  # サンプルエンコードで校正したCRF方式のビットレート曲線
+        self.calibration_thread = None
+        
+        # 動画情報取得用のワーカープール（GUIスレッドをブロックしない）
+        self.probe_service = ProbeService(parent=self)
+        self.probe_service.probe_finished.connect(self.on_probe_finished)
+        if QApplication.instance():
+            QApplication.instance().aboutToQuit.connect(self.probe_service.shutdown)
+            QApplication.instance().aboutToQuit.connect(self.discard_first_pass_workspace)
+            QApplication.instance().aboutToQuit.connect(self.stop_size_calibration)
+
+    def discard_first_pass_workspace(self):
+        """1pass目の統計を保存した作業ディレクトリを削除"""
+        if self.first_pass_workspace:
+            self.first_pass_workspace.cleanup()
+            self.first_pass_workspace = None
+
+    def contextMenuEvent(self, event):
+        """右クリックコンテキストメニューを表示"""
+        context_menu = QMenu(self)
+        
+        # Aboutアクション
+        about_action = QAction('ClipItBro について', self)
+        about_action.triggered.connect(self.show_about_from_context)
+        context_menu.addAction(about_action)
+        
+        # セパレーター
+        context_menu.addSeparator()
+        
+        # ログクリアアクション
+        clear_action = QAction('ログをクリア', self)
+        clear_action.triggered.connect(self.clear_logs)
+        context_menu.addAction(clear_action)
+        
+        # メディア情報キャッシュの統計表示アクション
+        cache_stats_action = QAction('メディア情報キャッシュの統計', self)
+        cache_stats_action.triggered.connect(self.show_media_cache_stats)
+        context_menu.addAction(cache_stats_action)
+        
+        # 1pass統計キャッシュの統計表示・削除アクション
+        pass_cache_stats_action = QAction('1pass統計キャッシュの統計', self)
+        pass_cache_stats_action.triggered.connect(self.show_pass_stats_cache_stats)
+        context_menu.addAction(pass_cache_stats_action)
+        
+        pass_cache_clear_action = QAction('1pass統計キャッシュを削除', self)
+        pass_cache_clear_action.triggered.connect(self.clear_pass_stats_cache)
+        context_menu.addAction(pass_cache_clear_action)
+        
+        # 音声キャッシュの統計表示・削除アクション
+        audio_cache_stats_action = QAction('音声キャッシュの統計', self)
+        audio_cache_stats_action.triggered.connect(self.show_audio_track_cache_stats)
+        context_menu.addAction(audio_cache_stats_action)
+        
+        audio_cache_clear_action = QAction('音声キャッシュを削除', self)
+        audio_cache_clear_action.triggered.connect(self.clear_audio_track_cache)
+        context_menu.addAction(audio_cache_clear_action)
+        
+        # 変換履歴（サイズ推定の学習データ）の統計表示・削除アクション
+        history_stats_action = QAction('変換履歴の統計', self)
+        history_stats_action.triggered.connect(self.show_conversion_history_stats)
+        context_menu.addAction(history_stats_action)
+        
+        history_clear_action = QAction('変換履歴を削除', self)
+        history_clear_action.triggered.connect(self.clear_conversion_history)
+        context_menu.addAction(history_clear_action)
+        
+        # コンテキストメニューを表示
+        context_menu.exec_(event.globalPos())
+    
+    def show_about_from_context(self):
+        """コンテキストメニューからAboutダイアログを表示"""
+        if self.parent_window and hasattr(self.parent_window, 'show_about_dialog'):
+            self.parent_window.show_about_dialog()
+        else:
+            # 直接Aboutダイアログを作成
+            about_dialog = AboutDialog(self)
+            about_dialog.exec_()
+    
+    def clear_logs(self):
+        """ログをクリア"""
+        self.log_messages.clear()
+        self.update_display()
+
+    def show_media_cache_stats(self):
+        """メディア情報キャッシュのヒット/ミス数をログに表示"""
+        cache = get_media_info_cache()
+        if not cache:
+            self.add_log("メディア情報キャッシュは利用できません")
+            return
+        stats = cache.stats()
+        self.add_log(f"📦 メディア情報キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} | "
+                     f"{stats['entries']}件 ({stats['bytes'] / 1024:.1f} / {stats['max_bytes'] / 1024:.0f} KB)")
+
+    def show_pass_stats_cache_stats(self):
+        """1pass統計キャッシュのヒット/ミス数をログに表示"""
+        cache = get_pass_stats_cache()
+        if not cache:
+            self.add_log("1pass統計キャッシュは利用できません")
+            return
+        stats = cache.stats()
+        self.add_log(f"📦 1pass統計キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} | "
+                     f"{stats['entries']}件 ({stats['bytes'] / (1024 * 1024):.1f} / {stats['max_bytes'] / (1024 * 1024):.0f} MB)")
+
+    def clear_pass_stats_cache(self):
+        """1pass統計キャッシュを全削除"""
+        cache = get_pass_stats_cache()
+        if cache:
+            cache.clear()
+            self.add_log("🗑️ 1pass統計キャッシュを削除しました")
+
+    def show_audio_track_cache_stats(self):
+        """音声キャッシュのヒット/ミス数をログに表示"""
+        cache = get_audio_track_cache()
+        if not cache:
+            self.add_log("音声キャッシュは利用できません")
+            return
+        stats = cache.stats()
+        self.add_log(f"📦 音声キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} | "
+                     f"{stats['entries']}件 ({stats['bytes'] / (1024 * 1024):.1f} / {stats['max_bytes'] / (1024 * 1024):.0f} MB)")
+
+    def clear_audio_track_cache(self):
+        """音声キャッシュを全削除"""
+        cache = get_audio_track_cache()
+        if cache:
+            cache.clear()
+            self.add_log("🗑️ 音声キャッシュを削除しました")
+
+    def show_conversion_history_stats(self):
+        """変換履歴の件数とサイズ推定モデルの学習状況をログに表示"""
+        history = get_conversion_history()
+        if not history:
+            self.add_log("変換履歴は利用できません")
+            return
+        stats = history.stats()
+        status = "使用中" if stats['model_samples'] >= SizeModel.MIN_SAMPLES else f"{SizeModel.MIN_SAMPLES}件から使用"
+        self.add_log(f"🧠 変換履歴: {stats['entries']}件 | サイズ推定モデル: CRF方式 {stats['model_samples']}件で学習 ({status})")
+        if stats['guarded']:
+            self.add_log(f"📏 上限保証: 2pass {stats['guarded']}件中 {stats['retried']}件で2pass目をやり直し "
+                         f"(やり直し分の所要 合計{stats['attempt_seconds']:.1f}秒)")
+
+    def clear_conversion_history(self):
+        """変換履歴を全削除（サイズ推定は従来の推定式に戻る）"""
+        history = get_conversion_history()
+        if history:
+            history.clear()
+            self.add_log("🗑️ 変換履歴を削除しました")
+
+    def add_log(self, message):
+        """ログメッセージを追加してテキストエリアに表示"""
+        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        log_entry = f"[{timestamp}] {message}"
+        self.log_messages.append(log_entry)
+        print(log_entry)  # コンソールにも出力
+        
+        # ログが多くなりすぎないよう、最新の15件のみ保持
+        if len(self.log_messages) > 15:
+            self.log_messages = self.log_messages[-15:]
+        
+        self.update_display()
+
+    def update_display(self):
+        """現在の状態に応じてテキストエリアの内容を更新"""
+        if self.video_file_path:
+            content = f"動画ファイルが選択されました:\n{self.video_file_path}\n\n"
+            
+            # 動画情報を表示
+            if self._probing:
+                content += "🔍 動画情報を解析中...\n\n"
+            elif self.video_info:
+                content += "=== 動画情報 ===\n"
+                content += f"解像度: {self.video_info.get('width', 'N/A')}x{self.video_info.get('height', 'N/A')}\n"
+                content += f"フレームレート: {self.video_info.get('fps', 'N/A')} fps\n"
+                content += f"長さ: {self.video_info.get('duration', 'N/A')} 秒\n"
+                content += f"ビットレート: {self.video_info.get('bitrate', 'N/A')} kbps\n"
+                content += f"ファイルサイズ: {self.video_info.get('file_size', 'N/A')} MB\n"
+                
+                # 親ウィンドウからエンコード方式を取得
+                parent = self.parent()
+                while parent and not hasattr(parent, 'encoding_mode'):
+                    parent = parent.parent()
+                
+                # エンコード方式に応じた1pass状態表示
+                if parent and parent.encoding_mode == 'twopass':
+                    if self.first_pass_completed:
+                        content += f"✓ 1pass解析完了: 最適化準備完了\n"
+                    elif hasattr(self, '_first_pass_running') and self._first_pass_running:
+                        content += f"🔄 1pass解析中...\n"
+                    else:
+                        content += f"⏳ 1pass解析待機中\n"
+                else:
+                    content += f"📊 CRF方式選択中 (1pass解析不要)\n"
+                content += "\n"
+        else:
+            content = f"{APP_NAME} v{APP_VERSION} powered by {APP_DEVELOPER}\n"
+            content += "動画ファイル（mp4, avi, mov等）をここにドラッグ&ドロップしてください\n"
+            content += "2pass方式では、ドロップ時に自動的に1pass解析を実行します\n\n"
+
+        if self.media_batch:
+            content += self.media_batch.summary_text() + "\n"
+
+        content += "=== ログ ===\n"
+        content += "\n".join(self.log_messages)
+        
+        self.setText(content)
+
+    def get_video_info(self, file_path):
+        """FFprobeを使って動画情報を同期的に取得（キャッシュヒット時はFFprobeを実行しない）"""
+        normalized_path = os.path.normpath(file_path)
+        try:
+            record, from_cache = MediaProbe.probe_cached(normalized_path)
+        except MediaProbeError as e:
+            self.add_log(str(e))
+            return None
+        except Exception as e:
+            self.add_log(f"動画情報取得エラー: {e}")
+            return None
+        return self.video_info_from_record(normalized_path, record, from_cache)
+
+    def video_info_from_record(self, file_path, record, from_cache):
+        """MediaRecordからvideo_info辞書を作成してログを出力"""
+        info = record.to_video_info() if record else None
+        if not info:
+            self.add_log("動画ストリームが見つかりませんでした")
+            return None
+
+        cache = get_media_info_cache()
+        cache_stats = f" (キャッシュ ヒット {cache.hits} / ミス {cache.misses})" if cache else ""
+        if from_cache:
+            self.add_log(f"動画情報キャッシュヒット: {os.path.basename(file_path)}{cache_stats}")
+        elif record.probe_method == 'native':
+            self.add_log(f"ヘッダー直接解析: {os.path.basename(file_path)}{cache_stats}")
+        else:
+            self.add_log(f"FFprobe実行 ({record.probe_method}): {os.path.basename(file_path)}{cache_stats}")
+
+        self.add_log(f"動画情報を取得: {info['width']}x{info['height']}, {info['fps']}fps, {info['duration']}秒")
+        timing_source = "タイムスタンプ" if record.frame_timing else "ヘッダー"
+        if info['vfr']:
+            self.add_log(f"🎞 可変フレームレート（VFR）: 平均 {info['fps']}fps / 基準 {info['nominal_fps']}fps "
+                         f"（{timing_source}で判定）。複製フレームを足さずにタイムスタンプを維持して変換します"
+                         f"（設定メニューの「VFR（可変フレームレート）素材」で固定フレームレートも選べます）")
+        elif record.frame_timing:
+            self.add_log(f"🎞 タイムスタンプ抽出: 平均 {info['fps']}fps（固定フレームレート）")
+        audio_streams = record.audio_streams()
+        for number, stream in enumerate(audio_streams):
+            self.add_log(f"🔊 音声トラック{number + 1}: {describe_audio_stream(stream)}")
+        if len(audio_streams) > 1:
+            default = audio_streams.index(default_audio_stream(record)) + 1
+            self.add_log(f"🔊 音声トラックが{len(audio_streams)}本あります（既定はトラック{default}のみ使用。"
+                         f"設定メニューの「音声トラックを選択...」で変更・ミックスできます）")
+        return info
+
+    def request_video_info(self, file_path):
+        """動画情報の取得をバックグラウンドで開始（結果はon_probe_finishedで受け取る）"""
+        self.video_info = None
+        self._probing = True
+        
+        # 解析が終わるまでは変換できないようにする
+        parent = self.parent()
+        while parent and not hasattr(parent, 'convert_button'):
+            parent = parent.parent()
+        if parent:
+            parent.convert_button.setEnabled(False)
+        
+        self.update_display()
+        self.probe_service.submit(file_path)
+
+    def on_probe_finished(self, file_path, record, from_cache, error_message):
+        """バックグラウンドの動画情報取得が完了した時の処理（GUIスレッドで実行）"""
+        # 解析中に別のファイルがドロップされた場合は古い結果を無視
+        if file_path != self.video_file_path:
+            return
+        
+        self._probing = False
+        if error_message:
+            self.add_log(error_message)
+            self.video_info = None
+        else:
+            self.video_info = self.video_info_from_record(file_path, record, from_cache)
+        
+        if self.video_info:
+            self.add_log("動画情報取得成功")
+            self.trigger_size_estimation()
+            # サイズ推定の精度向上のため、バックグラウンドで複雑度を解析
+            self.start_complexity_analysis()
+            self.start_size_calibration()
+        else:
+            self.add_log("動画情報取得失敗")
+            self.update_display()
+
+    def start_complexity_analysis(self):
+        """パケットサイズの複雑度解析をバックグラウンドで開始"""
+        self.stop_complexity_analysis()
+        if not self.video_file_path or not self.video_info:
+            return
+        
+        sample_frames = bool(getattr(self.parent_window, 'complexity_frame_sampling', False))
+        self.complexity_thread = ComplexityAnalysisThread(
+            self.video_file_path, self.video_info.get('duration', 0), sample_frames
+        )
+        self.complexity_thread.log_signal.connect(self.add_log)
+        self.complexity_thread.finished_signal.connect(self.on_complexity_analysis_finished)
+        self.complexity_thread.start(QThread.LowPriority)
+
+    def stop_complexity_analysis(self):
+        """実行中の複雑度解析を停止"""
+        if self.complexity_thread and self.complexity_thread.isRunning():
+            self.complexity_thread.stop()
+            self.complexity_thread.wait(3000)
+        self.complexity_thread = None
+
+    def on_complexity_analysis_finished(self, file_path, profile):
+        """複雑度解析の完了時に推定を更新"""
+        if file_path != self.video_file_path or profile is None:
+            return
+        self.complexity_profile = profile
+        
+        parent = self.parent()
+        while parent and not hasattr(parent, 'encoding_mode'):
+            parent = parent.parent()
+        if parent:
+            if parent.encoding_mode == 'twopass':
+                parent.update_bitrate_estimation()
+            else:
+                parent.update_size_estimation()
+
+    def get_complexity_profile(self):
+        """現在のファイルの複雑度プロファイル（未解析ならNone）"""
+        return self.complexity_profile
+
+    def start_size_calibration(self):
+        """CRF方式のサイズ推定の校正（サンプルエンコード）をバックグラウンドで開始"""
+        self.stop_size_calibration()
+        self.rate_curve = None
+        parent = self.parent_window
+        if not self.video_file_path or not self.video_info or not getattr(parent, 'size_calibration', False):
+            return
+        
+        self.calibration_thread = SizeCalibrationThread(
+            self.video_file_path, self.video_info.get('duration', 0), parent.speed_preset, parent.encoder_tune
+        )
+        self.calibration_thread.log_signal.connect(self.add_log)
+        self.calibration_thread.finished_signal.connect(self.on_size_calibration_finished)
+        self.calibration_thread.start(QThread.LowPriority)
+
+    def stop_size_calibration(self):
+        """実行中のサイズ推定の校正を停止"""
+        if self.calibration_thread and self.calibration_thread.isRunning():
+            self.calibration_thread.finished_signal.disconnect()
+            self.calibration_thread.stop()
+            self.calibration_thread.wait(3000)
+        self.calibration_thread = None
+
+    def on_size_calibration_finished(self, file_path, curve):
+        """校正の完了時にCRF方式の推定を更新"""
+        if file_path != self.video_file_path or curve is None:
+            return
+        self.rate_curve = curve
+        parent = self.parent_window
+        if parent and getattr(parent, 'encoding_mode', None) == 'crf':
+            parent.update_size_estimation()
+
+    def get_rate_curve(self):
+        """現在のファイルの校正済みビットレート曲線（未校正ならNone）"""
+        return self.rate_curve
+
+    def dragEnterEvent(self, event):
+        self.add_log("ドラッグが開始されました")
+        
+        # FFmpegが利用できない場合はドラッグを拒否
+        if hasattr(self, 'parent_window') and self.parent_window and hasattr(self.parent_window, 'ffmpeg_available'):
+            if not self.parent_window.ffmpeg_available:
+                self.add_log("FFmpegが利用できないため、ドラッグを拒否しました")
+                event.ignore()
+                return
+                
+        if event.mimeData().hasUrls():
+            urls = [url.toLocalFile() for url in event.mimeData().urls()]
+            self.add_log(f"ファイルを検出: {', '.join([os.path.basename(url) for url in urls])}")
+            # 元のスタイルを保存
+            self.original_style = self.styleSheet()
+            # ドラッグ中のスタイルを設定（境界線を追加）
+            self.setStyleSheet(self.original_style + "border: 2px dashed #007acc;")
+            # 全てのドロップアクションを受け入れ
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            self.add_log("ドラッグイベント受け入れ完了")
+            return
+        event.ignore()
+        self.add_log("ドラッグイベント無視")
+
+    def dragMoveEvent(self, event):
+        # dragMoveEventも追加してみる
+        if event.mimeData().hasUrls():
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            return
+        event.ignore()
+
+    def dragOverEvent(self, event):
+        # FFmpegが利用できない場合はドラッグを拒否
+        if hasattr(self, 'parent_window') and self.parent_window and hasattr(self.parent_window, 'ffmpeg_available'):
+            if not self.parent_window.ffmpeg_available:
+                event.ignore()
+                return
+                
+        if event.mimeData().hasUrls():
+            # ドラッグ中のカーソル表示を適切に設定
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            return
+        event.ignore()
+
+    def dragLeaveEvent(self, event):
+        # ドラッグが離れた時に元のスタイルに戻す
+        self.add_log("ドラッグが離脱しました")
+        self.setStyleSheet(self.original_style)
+        super().dragLeaveEvent(event)
 
     def dropEvent(self, event):
         self.add_log("=== ドロップイベント開始 ===")
@@ -1228,6 +3391,7 @@ class DragDropTextEdit(QTextEdit):
         urls = event.mimeData().urls()
         self.add_log(f"URL数: {len(urls)}")
         
+        dropped_paths = []
         for i, url in enumerate(urls):
             file_path = url.toLocalFile()
             self.add_log(f"URL[{i}]: {file_path}")
@@ -1245,74 +3409,37 @@ class DragDropTextEdit(QTextEdit):
                     continue
                     
                 self.add_log(f"ファイル存在確認OK: {os.path.basename(normalized_path)}")
-                
-                if self.is_video_file(normalized_path):
-                    self.add_log(f"動画ファイル判定OK: {os.path.basename(normalized_path)}")
-                    
-                    # 新しい動画ファイルの場合、1pass解析状態をリセット
-                    if self.video_file_path != normalized_path:
-                        self.add_log("新しい動画ファイルを検出 - 1pass解析をリセット")
-                        self.first_pass_completed = False
-                        self.first_pass_data = None
-                        if hasattr(self, 'first_pass_codec'):
-                            self.first_pass_codec = None
-                        if hasattr(self, '_first_pass_running'):
-                            self._first_pass_running = False
-                        
-                        # 親ウィンドウのプログレスバーをリセット
-                        parent = self.parent()
-                        while parent and not hasattr(parent, 'pass1_progress_bar'):
-                            parent = parent.parent()
-                        if parent:
-                            parent.pass1_progress_bar.setValue(0)
-                            parent.pass2_progress_bar.setValue(0)
-                    
-                    # 動画ファイルとして処理（正規化されたパスを使用）
-                    self.video_file_path = normalized_path
-                    
-                    # 親ウィンドウのテーマを取得して青い背景を適用
-                    if self.parent_window and hasattr(self.parent_window, 'current_theme'):
-                        self.parent_window.current_status = 'active'
-                        ThemeManager.apply_status_background(self, self.parent_window.current_theme, 'active')
-                    else:
-                        self.setStyleSheet('background-color: #e6f3ff;')  # フォールバック
-                    
-                    self.add_log(f"動画ファイルとして設定完了: {os.path.basename(normalized_path)}")
-                    
-                    # 動画情報を取得
-                    self.add_log("動画情報取得を開始...")
-                    self.video_info = self.get_video_info(normalized_path)
-                    
-                    if self.video_info:
-                        self.add_log("動画情報取得成功")
-                        self.trigger_size_estimation()
-                    else:
-                        self.add_log("動画情報取得失敗")
-                    
-                    # イベントを受け入れ
-                    event.setDropAction(Qt.CopyAction)
-                    event.accept()
-                    self.add_log("=== ドロップイベント正常終了 ===")
-                    return
-                    
-                else:
-                    self.add_log(f"動画ファイルではありません: {os.path.basename(normalized_path)}")
-                    # 親ウィンドウのテーマを取得して黄色い背景を適用
-                    if self.parent_window and hasattr(self.parent_window, 'current_theme'):
-                        ThemeManager.apply_status_background(self, self.parent_window.current_theme, 'warning')
-                    else:
-                        self.setStyleSheet('background-color: #fff3cd;')  # フォールバック
-                    event.setDropAction(Qt.CopyAction)
-                    event.accept()
-                    self.add_log("=== ドロップイベント終了（非動画ファイル） ===")
-                    return
+                dropped_paths.append(normalized_path)
                     
             except Exception as e:
                 self.add_log(f"ファイルパス処理エラー: {e}")
                 continue
         
-        self.add_log("=== ドロップイベント無視 ===")
-        event.ignore()
+        if not dropped_paths:
+            self.add_log("=== ドロップイベント無視 ===")
+            event.ignore()
+            return
+        
+        # フォルダは再帰的に走査して動画ファイルを収集
+        video_files = scan_video_files(dropped_paths)
+        
+        if video_files:
+            self.load_video_files(video_files)
+            
+            # イベントを受け入れ
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            self.add_log("=== ドロップイベント正常終了 ===")
+        else:
+            self.add_log(f"動画ファイルではありません: {', '.join(os.path.basename(path) for path in dropped_paths)}")
+            # 親ウィンドウのテーマを取得して黄色い背景を適用
+            if self.parent_window and hasattr(self.parent_window, 'current_theme'):
+                ThemeManager.apply_status_background(self, self.parent_window.current_theme, 'warning')
+            else:
+                self.setStyleSheet('background-color: #fff3cd;')  # フォールバック
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            self.add_log("=== ドロップイベント終了（非動画ファイル） ===")
 
     def insertFromMimeData(self, source):
         """QTextEditの標準的なドロップ処理もオーバーライド"""
@@ -1320,6 +3447,7 @@ class DragDropTextEdit(QTextEdit):
         if source.hasUrls():
             urls = source.urls()
             self.add_log(f"insertFromMimeData でURL検出: {len(urls)}件")
+            dropped_paths = []
             for url in urls:
                 file_path = url.toLocalFile()
                 self.add_log(f"insertFromMimeData: {file_path}")
@@ -1327,35 +3455,94 @@ class DragDropTextEdit(QTextEdit):
                     try:
                         # ファイルパスを正規化
                         normalized_path = os.path.normpath(file_path)
-                        if os.path.exists(normalized_path) and self.is_video_file(normalized_path):
-                            # 新しい動画ファイルの場合、1pass解析状態をリセット
-                            if self.video_file_path != normalized_path:
-                                self.add_log("新しい動画ファイルを検出 - 1pass解析をリセット")
-                                self.first_pass_completed = False
-                                self.first_pass_data = None
-                                if hasattr(self, 'first_pass_codec'):
-                                    self.first_pass_codec = None
-                                if hasattr(self, '_first_pass_running'):
-                                    self._first_pass_running = False
-                                
-                                # 親ウィンドウのプログレスバーをリセット
-                                parent = self.parent()
-                                while parent and not hasattr(parent, 'pass1_progress_bar'):
-                                    parent = parent.parent()
-                                if parent:
-                                    parent.pass1_progress_bar.setValue(0)
-                                    parent.pass2_progress_bar.setValue(0)
-                            
-                            self.video_file_path = normalized_path
-                            self.video_info = self.get_video_info(normalized_path)
-                            if self.video_info:
-                                self.trigger_size_estimation()
+                        if os.path.exists(normalized_path):
+                            dropped_paths.append(normalized_path)
                     except Exception as e:
                         self.add_log(f"insertFromMimeData パス処理エラー: {e}")
+            
+            video_files = scan_video_files(dropped_paths)
+            if video_files:
+                self.load_video_files(video_files)
             return
         # 通常のテキストドロップは無視
         pass
 
+    def load_video_files(self, video_files):
+        """ドロップされた動画ファイル群を読み込む（先頭のファイルを選択し、複数ならバッチとして全件解析）"""
+        if self.media_batch:
+            self.media_batch.release()
+        
+        if len(video_files) > 1:
+            parallelism = self.probe_service.max_workers
+            self.add_log(f"📂 {len(video_files)}件の動画ファイルを検出 - 一括解析を開始 (同時実行数: {parallelism})")
+            self.media_batch = MediaBatch(video_files, self.probe_service, self)
+            self.media_batch.item_updated.connect(lambda index: self.update_display())
+            self.media_batch.batch_finished.connect(self.on_batch_probe_finished)
+        else:
+            self.media_batch = None
+        
+        self.select_video_file(video_files[0])
+        
+        # 先頭ファイル以外の解析を投入（先頭ファイルは実行中の解析を共有する）
+        if self.media_batch:
+            self.media_batch.start()
+
+    def select_video_file(self, normalized_path):
+        """動画ファイルを選択状態にして動画情報の取得を開始"""
+        self.add_log(f"動画ファイル判定OK: {os.path.basename(normalized_path)}")
+        
+        # 新しい動画ファイルの場合、1pass解析状態をリセット
+        if self.video_file_path != normalized_path:
+            self.add_log("新しい動画ファイルを検出 - 1pass解析をリセット")
+            self.stop_complexity_analysis()
+            self.complexity_profile = None
+            self.stop_size_calibration()
+            self.rate_curve = None
+            self.first_pass_completed = False
+            self.first_pass_data = None
+            self.discard_first_pass_workspace()
+            if hasattr(self, 'first_pass_codec'):
+                self.first_pass_codec = None
+            if hasattr(self, '_first_pass_running'):
+                self._first_pass_running = False
+            # 1pass状態のリセット後にクリアする（前のファイルの再解析を起こさないため）
+            if self.parent_window and hasattr(self.parent_window, 'clear_trim_range'):
+                self.parent_window.clear_trim_range()
+            
+            # 親ウィンドウのプログレスバーをリセット
+            parent = self.parent()
+            while parent and not hasattr(parent, 'pass1_progress_bar'):
+                parent = parent.parent()
+            if parent:
+                parent.pass1_progress_bar.setValue(0)
+                parent.pass2_progress_bar.setValue(0)
+        
+        # 動画ファイルとして処理（正規化されたパスを使用）
+        self.video_file_path = normalized_path
+        
+        # 親ウィンドウのテーマを取得して青い背景を適用
+        if self.parent_window and hasattr(self.parent_window, 'current_theme'):
+            self.parent_window.current_status = 'active'
+            ThemeManager.apply_status_background(self, self.parent_window.current_theme, 'active')
+        else:
+            self.setStyleSheet('background-color: #e6f3ff;')  # フォールバック
+        
+        self.add_log(f"動画ファイルとして設定完了: {os.path.basename(normalized_path)}")
+        
+        # 動画情報をバックグラウンドで取得（完了後にサイズ推定を実行）
+        self.add_log("動画情報取得を開始...")
+        self.request_video_info(normalized_path)
+
+    def on_batch_probe_finished(self):
+        """バッチ内の全ファイルの解析が完了した時の処理"""
+        if not self.media_batch:
+            return
+        ready_count = len(self.media_batch.ready_items())
+        failed_count = len(self.media_batch.items) - ready_count
+        self.add_log(f"📂 一括解析完了: 成功 {ready_count}件 / 失敗 {failed_count}件 "
+                     f"({self.media_batch.elapsed_seconds():.1f}秒)")
+        self.update_display()
+
     def trigger_size_estimation(self):
         """親ウィンドウのファイルサイズ推定を実行"""
         try:
@@ -1448,6 +3635,13 @@ class DragDropTextEdit(QTextEdit):
                 self._first_pass_running = False
                 return
                 
+            # CRF探索で目標サイズを狙う場合は1pass目を使わない
+            if parent.encoding_mode == 'twopass' and getattr(parent, 'crf_size_search', False):
+                self.add_log("CRF探索が選択されているため、1pass解析をスキップします")
+                self._first_pass_running = False
+                self.update_display()
+                return
+            
             # 2pass方式の場合のみ1pass目を実行
             if parent.encoding_mode == 'twopass':
                 # 実行ボタンを無効化し、2passプログレスバーを表示
@@ -1460,15 +3654,23 @@ class DragDropTextEdit(QTextEdit):
                 # デフォルトのビットレートで1pass目を実行（後で調整される）
                 temp_bitrate = 1000  # 仮のビットレート
                 
-                # 動画の総時間を取得
-                total_duration = 0
-                if self.video_info:
-                    total_duration = self.video_info.get('duration', 0)
+                # 変換対象の長さを取得（トリミング時は範囲の長さ）
+                trim_range = parent.get_trim_range_or_none()
+                total_duration = parent.get_target_duration()
+                if trim_range:
+                    start, end = trim_range
+                    self.add_log(f"✂ トリミング範囲 {format_timecode(start)} 〜 {format_timecode(end)} を解析します")
                 
                 # 1pass目用のスレッドを作成
                 from PyQt5.QtCore import QThread, pyqtSignal
                 use_h265 = parent.use_h265_encoding if hasattr(parent, 'use_h265_encoding') else False
-                self.first_pass_thread = FirstPassThread(self.video_file_path, temp_bitrate, total_duration, use_h265)
+                self.discard_first_pass_workspace()
+                self.first_pass_thread = FirstPassThread(self.video_file_path, temp_bitrate, total_duration, use_h265,
+                                                         trim_range=trim_range, speed_preset=parent.speed_preset,
+                                                         tune=parent.encoder_tune,
+                                                         output_fps=parent.output_fps_for(self.video_file_path))
+                self.first_pass_workspace = self.first_pass_thread.workspace
+                self.first_pass_output_fps = self.first_pass_thread.output_fps
                 self.first_pass_thread.log_signal.connect(self.add_log)
                 self.first_pass_thread.progress_signal.connect(parent.update_first_pass_progress)
                 self.first_pass_thread.finished_signal.connect(self.first_pass_finished)
@@ -1495,9 +3697,10 @@ class DragDropTextEdit(QTextEdit):
             self.first_pass_completed = True
             self.first_pass_data = log_file_path
             
-            # 1passで使用したコーデック情報を記録
+            # 1passで使用したコーデック情報と解析範囲を記録
             use_h265 = parent.use_h265_encoding if hasattr(parent, 'use_h265_encoding') else False
             self.first_pass_codec = 'H.265' if use_h265 else 'H.264'
+            self.first_pass_range = self.first_pass_thread.trim_range if self.first_pass_thread else None
             
             self.add_log("=== 1pass解析完了 ===")
             self.add_log(f"📹 解析時のコーデック: {self.first_pass_codec}")
@@ -1520,6 +3723,7 @@ class DragDropTextEdit(QTextEdit):
             self.add_log("=== 1pass解析失敗 ===")
             if error_message:
                 self.add_log(f"1passエラー: {error_message}")
+            self.discard_first_pass_workspace()
             
             # 警告背景を適用
             if self.parent_window and hasattr(self.parent_window, 'current_theme'):
@@ -1536,8 +3740,7 @@ class DragDropTextEdit(QTextEdit):
 
     def is_video_file(self, file_path):
         """ファイルが動画ファイルかどうかを拡張子で判定"""
-        video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v', '.3gp']
-        return any(file_path.lower().endswith(ext) for ext in video_extensions)
+        return is_video_file(file_path)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -1567,6 +3770,56 @@ class MainWindow(QMainWindow):
         # H.265エンコード設定を読み込み（試験的機能）
         self.use_h265_encoding = self.settings.value('use_h265_encoding', False, type=bool)
         
+        # 複数ファイルの同時解析数を読み込み（0は自動）
+        self.probe_parallelism = self.settings.value('probe_parallelism', 0, type=int)
+        
+        # サイズ推定用の詳細な複雑度解析（フレームサンプリング）設定を読み込み
+        self.complexity_frame_sampling = self.settings.value('complexity_frame_sampling', False, type=bool)
+        
+        # CRF方式のサイズ推定をサンプルエンコードで校正する設定を読み込み
+        self.size_calibration = self.settings.value('size_calibration', True, type=bool)
+        
+        # 分割並列エンコード（2pass）設定を読み込み
+        self.chunked_encoding = self.settings.value('chunked_encoding', False, type=bool)
+        
+        # 目標サイズをCRF探索で狙う設定を読み込み（2pass方式の代わりに使う）
+        self.crf_size_search = self.settings.value('crf_size_search', False, type=bool)
+        
+        # 目標サイズの上限保証（2pass目の監視・超過時の再エンコード・超過実績による補正）設定を読み込み
+        self.size_guard = self.settings.value('size_guard', True, type=bool)
+        
+        # VFR（可変フレームレート）素材の出力フレームレートとタイムスタンプ抽出の設定を読み込み
+        self.vfr_output_fps = self.settings.value('vfr_output_fps', 0, type=int)
+        if self.vfr_output_fps not in VFR_OUTPUT_RATES:
+            self.vfr_output_fps = 0
+        self.vfr_timestamp_sampling = self.settings.value('vfr_timestamp_sampling', False, type=bool)
+        
+        # 音声トラックの選択（ファイルごと、正規化したパス -> 音声ストリームの番号のリスト）とミックス設定を読み込み
+        self.audio_track_selection = {}
+        self.audio_mix = self.settings.value('audio_mix', False, type=bool)
+        
+        # エンコードのCPU固定（アフィニティ）設定を読み込み
+        self.cpu_pinning = self.settings.value('cpu_pinning', False, type=bool)
+        get_thread_allocator().pinning = self.cpu_pinning
+        
+        # エンコード速度/画質とチューニングの設定を読み込み
+        self.speed_preset = self.settings.value('speed_preset', DEFAULT_SPEED_PRESET, type=str)
+        if self.speed_preset not in ENCODER_SPEED_PRESETS:
+            self.speed_preset = DEFAULT_SPEED_PRESET
+        self.encoder_tune = self.settings.value('encoder_tune', '', type=str)
+        if self.encoder_tune not in ENCODER_TUNES:
+            self.encoder_tune = ''
+        
+        # 変換キューの同時実行数を読み込み
+        self.queue_max_concurrent = self.settings.value('queue_max_concurrent', 1, type=int)
+        self.job_queue_dialog = None
+        
+        # サイズ/ビットレート推定サービス（スライダー操作をまとめ、結果をメモ化）とサイズ推定マップ
+        self.estimation_service = EstimationService(self)
+        self.estimation_service.estimation_ready.connect(self.on_estimation_ready)
+        QApplication.instance().aboutToQuit.connect(self.estimation_service.shutdown)
+        self.size_map_dialog = None
+        
         # 状態管理（テーマ変更時の背景色復元用）
         self.current_status = 'default'  # default, success, error, warning, active
         self.ffmpeg_available = False  # FFmpeg利用可能フラグ
@@ -1596,7 +3849,19 @@ class MainWindow(QMainWindow):
 
         # ffmpeg情報表示エリア（ドラッグ＆ドロップ対応）
         self.text_edit = DragDropTextEdit(self)
+        if self.probe_parallelism > 0:
+            self.text_edit.probe_service.set_max_workers(self.probe_parallelism)
+        self.text_edit.probe_service.sample_frame_timing = self.vfr_timestamp_sampling
         text_container_layout.addWidget(self.text_edit)
+        
+        # 変換キュー（前回の未完了ジョブを復元）
+        self.job_queue = JobQueue(self.queue_max_concurrent, parent=self)
+        self.job_queue.log_signal.connect(self.text_edit.add_log)
+        self.job_queue.queue_finished.connect(self.on_queue_finished)
+        QApplication.instance().aboutToQuit.connect(self.job_queue.shutdown)
+        if self.job_queue.pending_count() > 0:
+            QTimer.singleShot(0, lambda: self.text_edit.add_log(
+                f"📋 前回の変換キューを復元しました（待機中 {self.job_queue.pending_count()}件）- キュー > キューを表示 から再開できます"))
 
         # H.265警告バー（初期は非表示）
         self.h265_warning_bar = QLabel()
@@ -1696,6 +3961,27 @@ class MainWindow(QMainWindow):
 
         param_layout.addLayout(param_input_layout)
 
+        # トリミング範囲入力（空欄の場合は全体を変換）
+        trim_layout = QHBoxLayout()
+        trim_layout.addWidget(QLabel('トリミング:', self))
+        self.trim_start_edit = QLineEdit(self)
+        self.trim_start_edit.setPlaceholderText('開始 (例 1:23.5)')
+        self.trim_end_edit = QLineEdit(self)
+        self.trim_end_edit.setPlaceholderText('終了')
+        for edit in (self.trim_start_edit, self.trim_end_edit):
+            edit.setFixedWidth(120)
+            edit.editingFinished.connect(self.on_trim_range_changed)
+        self.trim_clear_button = QPushButton('クリア', self)
+        self.trim_clear_button.setFixedWidth(60)
+        self.trim_clear_button.clicked.connect(self.clear_trim_range)
+        trim_layout.addWidget(self.trim_start_edit)
+        trim_layout.addWidget(QLabel('〜', self))
+        trim_layout.addWidget(self.trim_end_edit)
+        trim_layout.addWidget(self.trim_clear_button)
+        trim_layout.addStretch()
+        param_layout.addLayout(trim_layout)
+        self.trim_workspace = None
+
         # 情報表示ラベル
         self.info_label = QLabel('目標ファイルサイズ: 9 MB | 推定ビットレート: 動画を選択してください', self)
         self.info_label.setObjectName("size_estimation")
@@ -1959,6 +4245,7 @@ class MainWindow(QMainWindow):
             if hasattr(self.text_edit, 'first_pass_completed'):
                 self.text_edit.first_pass_completed = False
                 self.text_edit.first_pass_data = None
+                self.text_edit.discard_first_pass_workspace()
                 if hasattr(self.text_edit, 'first_pass_codec'):
                     self.text_edit.first_pass_codec = None
                 if hasattr(self.text_edit, '_first_pass_running'):
@@ -1999,6 +4286,7 @@ class MainWindow(QMainWindow):
             if hasattr(self.text_edit, 'first_pass_completed'):
                 self.text_edit.first_pass_completed = False
                 self.text_edit.first_pass_data = None
+                self.text_edit.discard_first_pass_workspace()
                 if hasattr(self.text_edit, 'first_pass_codec'):
                     self.text_edit.first_pass_codec = None
                 if hasattr(self.text_edit, '_first_pass_running'):
@@ -2022,23 +4310,43 @@ class MainWindow(QMainWindow):
 
     def calculate_target_bitrate(self, target_size_mb, duration_seconds, audio_bitrate_kbps=128):
         """目標ファイルサイズから必要なビットレートを計算"""
-        if duration_seconds <= 0:
-            return None
-            
-        # ビット単位でのファイルサイズ
-        target_size_bits = target_size_mb * 8 * 1024 * 1024
-        
-        # 全体のビットレート（kbps）
-        total_bitrate = (target_size_bits / duration_seconds) / 1000
-        
-        # 音声ビットレートを差し引いて動画ビットレートを計算
-        video_bitrate = total_bitrate - audio_bitrate_kbps
-        
-        # 最小値を保証（100kbps）
-        return max(100, int(video_bitrate))
+        return calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps)
+
+    def estimation_context(self):
+        """推定サービスに渡す現在のファイルと推定器"""
+        history = get_conversion_history()
+        file_path = self.text_edit.video_file_path
+        audio_tracks = self.audio_tracks_for(file_path)
+        audio_selection = (tuple(audio_tracks) if audio_tracks is not None else None, self.audio_mix)
+        video_info = self.text_edit.video_info
+        record = cached_media_record(file_path)
+        output_fps = resolve_output_fps(record, self.vfr_output_fps)
+        if video_info and record:
+            # CRF方式の推定は選択したトラック（ミックス）で出力する音声のビットレートと出力のフレームレートを使う
+            video_info = dict(video_info, audio_kbps=plan_crf_audio(record, audio_tracks, self.audio_mix).bitrate_kbps,
+                              fps=output_fps or video_info.get('fps'))
+        return {
+            'file_path': file_path,
+            'video_info': video_info,
+            'audio_selection': audio_selection,
+            'output_fps': output_fps,
+            'complexity_profile': self.text_edit.get_complexity_profile(),
+            'rate_curve': self.text_edit.get_rate_curve(),
+            'size_model': history.model if history else None,
+            'speed_preset': self.speed_preset,
+        }
+
+    def on_estimation_ready(self, mode, result):
+        """推定サービスの結果を表示（方式が切り替わった後の結果は無視）"""
+        if mode != self.encoding_mode:
+            return
+        if mode == 'twopass':
+            self.show_bitrate_estimation(result)
+        else:
+            self.show_size_estimation(result)
 
     def update_bitrate_estimation(self):
-        """2pass方式でのビットレート推定を更新"""
+        """2pass方式でのビットレート推定を要求（スライダーの連続した変更はまとめて計算）"""
         if self.encoding_mode != 'twopass':
             return
             
@@ -2046,22 +4354,35 @@ class MainWindow(QMainWindow):
         target_size = self.size_slider.value()
         
         if not video_info:
+            self.estimation_service.cancel()
             self.info_label.setText(f'目標ファイルサイズ: {target_size} MB | 推定ビットレート: 動画を選択してください')
             return
         
-        duration = video_info.get('duration', 0)
+        duration = self.get_target_duration()
         if duration <= 0:
+            self.estimation_service.cancel()
             self.info_label.setText(f'目標ファイルサイズ: {target_size} MB | 推定ビットレート: 動画長不明')
             return
         
-        target_bitrate = self.calculate_target_bitrate(target_size, duration)
+        self.estimation_service.request('twopass', (target_size, round(duration, 3)), self.estimation_context())
+
+    def show_bitrate_estimation(self, result):
+        """2pass方式のビットレート推定を表示"""
+        video_info = self.text_edit.video_info
+        target_size = self.size_slider.value()
         
-        if target_bitrate:
+        if result and video_info:
+            target_bitrate = result['target_bitrate']
+            duration = result['duration']
             # 元ファイルサイズとの比較
             original_size = video_info.get('file_size', 0)
             original_bitrate = video_info.get('bitrate', 0)
             
             text = f'目標ファイルサイズ: {target_size} MB | 推定ビットレート: {target_bitrate} kbps'
+            if result.get('audio'):
+                text += f" | 音声: {result['audio']}"
+            if self.get_trim_range_or_none():
+                text += f' | トリミング後 {duration:.1f}秒'
             
             if original_size > 0:
                 size_ratio = target_size / original_size
@@ -2081,32 +4402,33 @@ class MainWindow(QMainWindow):
             self.info_label.setText(f'目標ファイルサイズ: {target_size} MB | ビットレート計算エラー')
 
     def update_size_estimation(self):
-        """CRF方式でのファイルサイズ推定を更新"""
+        """CRF方式でのファイルサイズ推定を要求（スライダーの連続した変更はまとめて計算）"""
         if self.encoding_mode != 'crf':
             return
-            
-        print("update_size_estimation called")  # デバッグ用
         
-        video_info = self.text_edit.video_info
-        if not video_info:
+        if not self.text_edit.video_info:
+            self.estimation_service.cancel()
             self.info_label.setText('ファイルサイズ推定: 動画ファイルを選択してください')
-            print("No video info available")  # デバッグ用
             return
         
-        crf = self.crf_slider.value()
-        scale_factor = self.vf_slider.value() / 10.0
-        
-        print(f"Calculating with CRF={crf}, scale={scale_factor}")  # デバッグ用
-        
-        estimation = self.estimate_file_size(video_info, crf, scale_factor)
-        
-        if estimation:
+        params = (self.crf_slider.value(), self.vf_slider.value() / 10.0)
+        self.estimation_service.request('crf', params, self.estimation_context())
+
+    def show_size_estimation(self, estimation):
+        """CRF方式のファイルサイズ推定を表示"""
+        video_info = self.text_edit.video_info
+        if estimation and video_info:
             original_size = video_info.get('file_size', 0)
             
             text = f"ファイルサイズ推定: {estimation['size_mb']} MB "
+            if estimation.get('size_range_mb'):
+                low, high = estimation['size_range_mb']
+                text += f"(95%区間 {low}〜{high} MB, 履歴{estimation['model_samples']}件から学習) "
             text += f"(元: {original_size} MB) "
             text += f"解像度: {estimation['new_resolution']} "
             text += f"推定ビットレート: {estimation['bitrate']} kbps"
+            if estimation.get('calibrated'):
+                text += " (サンプル実測で校正済み)"
             
             if original_size > 0:
                 size_ratio = estimation['size_mb'] / original_size
@@ -2121,186 +4443,22 @@ class MainWindow(QMainWindow):
                     text += f" サイズ変化なし"
             
             self.info_label.setText(text)
-            print(f"Estimation result: {text}")  # デバッグ用
         else:
             self.info_label.setText('ファイルサイズ推定: 計算できませんでした')
-            print("Estimation failed")  # デバッグ用
-
-    def estimate_file_size(self, video_info, crf, scale_factor):
-        """改良されたファイルサイズ推定アルゴリズム"""
-        print(f"estimate_file_size called with CRF={crf}, scale={scale_factor}")  # デバッグ用
         
-        if not video_info:
-            print("No video info provided")  # デバッグ用
+        if self.size_map_dialog is not None and self.size_map_dialog.isVisible():
+            self.size_map_dialog.refresh()
+
+    def get_size_grid(self):
+        """現在のファイルのCRF×スケールの推定表（SizeEstimateGrid、推定サービスでキャッシュ）"""
+        if not self.text_edit.video_info:
             return None
-        
         try:
-            # 基本パラメータ
-            width = video_info.get('width', 0)
-            height = video_info.get('height', 0)
-            fps = video_info.get('fps', 0)
-            duration = video_info.get('duration', 0)
-            original_bitrate = video_info.get('bitrate', 0)
-            original_file_size = video_info.get('file_size', 0)
-            
-            print(f"Video params: {width}x{height}, {fps}fps, {duration}s, {original_bitrate}kbps")  # デバッグ用
-            
-            if not all([width, height, fps, duration]):
-                print("Missing required video parameters")  # デバッグ用
-                return None
-            
-            # スケール後の解像度
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            
-            # ピクセル数の比率
-            pixel_ratio = (new_width * new_height) / (width * height)
-            
-            # === 実測データ基準の高精度推定アルゴリズム ===
-            
-            # 1. CRF値に基づく品質係数（実測データに基づく大幅調整）
-            # 実測: CRF28で元ビットレートの約21.6%（1316/6088）になることを考慮
-            if crf <= 18:
-                quality_factor = 0.65 - (crf - 15) * 0.03  # CRF15-18で0.74-0.65
-            elif crf <= 23:
-                quality_factor = 0.65 - (crf - 18) * 0.05  # 0.65 → 0.40
-            elif crf <= 28:
-                quality_factor = 0.40 - (crf - 23) * 0.035  # 0.40 → 0.225
-            elif crf <= 35:
-                quality_factor = 0.225 - (crf - 28) * 0.02  # 0.225 → 0.085
-            else:
-                quality_factor = 0.085 - (crf - 35) * 0.008   # 0.085 → 0.005
-            
-            quality_factor = max(0.05, quality_factor)  # 最低値を保証
-            
-            # 2. 元動画の複雑度を考慮した基準ビットレート計算
-            # 元のビットレートがある場合はそれを基準にする
-            if original_bitrate and original_bitrate > 0:
-                # 元ビットレートを基準にした推定（実測データ反映）
-                base_bitrate = original_bitrate * quality_factor * pixel_ratio
-            else:
-                # 解像度とフレームレートから基準ビットレート推定
-                # 実測データに基づき大幅に下方修正
-                pixels_per_second = new_width * new_height * fps
-                
-                # 解像度別基準値（kbps per million pixels per second）- 実測基準に修正
-                if new_width * new_height <= 720 * 480:    # SD
-                    bitrate_per_mpps = 0.8  # 1.8 → 0.8
-                elif new_width * new_height <= 1280 * 720: # HD
-                    bitrate_per_mpps = 0.6  # 1.5 → 0.6
-                elif new_width * new_height <= 1920 * 1080: # FHD
-                    bitrate_per_mpps = 0.5  # 1.2 → 0.5
-                else:  # 4K以上
-                    bitrate_per_mpps = 0.4  # 1.0 → 0.4
-                
-                base_bitrate = (pixels_per_second / 1000000) * bitrate_per_mpps * 1000 * quality_factor
-            
-            # 3. フレームレート補正
-            # 30fps基準で調整
-            fps_factor = min(1.5, max(0.7, fps / 30.0))
-            base_bitrate *= fps_factor
-            
-            # 4. 動画長による補正（短い動画は効率が悪い）
-            if duration < 30:
-                duration_factor = 1.15  # 短い動画は15%増し（30%→15%に減少）
-            elif duration < 120:
-                duration_factor = 1.08  # 2分未満は8%増し（15%→8%に減少）
-            else:
-                duration_factor = 1.0
-            
-            base_bitrate *= duration_factor
-            
-            # 5. スケールファクターによる微調整
-            # スケールアップ時は効率が落ちる
-            if scale_factor > 1.0:
-                scale_penalty = 1.0 + (scale_factor - 1.0) * 0.1  # 0.2 → 0.1に減少
-                base_bitrate *= scale_penalty
-            
-            # 最終ビットレート（最小値を保証）
-            estimated_bitrate = max(100, base_bitrate)  # 150→100に戻す
-            
-            # 6. ファイルサイズ計算（オーバーヘッド考慮）
-            # 音声ビットレート推定（実測に近い値）
-            audio_bitrate = 128
-            total_bitrate = estimated_bitrate + audio_bitrate
-            
-            # コンテナオーバーヘッド（実測データに基づき調整）
-            container_overhead = 1.02  # 1.05 → 1.02（2%に減少）
-            
-            estimated_size = (total_bitrate * duration * container_overhead) / (8 * 1024)  # MB
-            
-            # 7. 結果の妥当性チェック
-            # 元ファイルサイズと比較して極端な値を補正（範囲を緩和）
-            if original_file_size > 0:
-                size_ratio = estimated_size / original_file_size
-                
-                # 15倍以上または1/15以下の場合は補正（10倍→15倍に緩和）
-                if size_ratio > 15:
-                    estimated_size = original_file_size * 8  # 最大8倍に制限（5倍→8倍）
-                    estimated_bitrate = (estimated_size * 8 * 1024) / duration - audio_bitrate
-                elif size_ratio < 0.067:  # 1/15
-                    estimated_size = original_file_size * 0.15  # 最小15%に制限（20%→15%）
-                    estimated_bitrate = (estimated_size * 8 * 1024) / duration - audio_bitrate
-            
-            result = {
-                'bitrate': round(max(150, estimated_bitrate)),  # 100→150
-                'size_mb': round(max(0.1, estimated_size), 1),
-                'new_resolution': f"{new_width}x{new_height}",
-                'pixel_ratio': round(pixel_ratio, 2),
-                'quality_factor': round(quality_factor, 2),
-                'fps_factor': round(fps_factor, 2)
-            }
-            
-            print(f"Realistic estimation result: {result}")  # デバッグ用
-            return result
-            
+            return self.estimation_service.get_grid(self.estimation_context())
         except Exception as e:
-            print(f"ファイルサイズ推定エラー: {e}")
+            estimation_logger.warning("ファイルサイズ推定エラー: %s", e)
             return None
 
-    def update_size_estimation(self):
-        """ファイルサイズ推定を更新"""
-        print("update_size_estimation called")  # デバッグ用
-        
-        video_info = self.text_edit.video_info
-        if not video_info:
-            self.info_label.setText('ファイルサイズ推定: 動画ファイルを選択してください')
-            print("No video info available")  # デバッグ用
-            return
-        
-        crf = self.crf_slider.value()
-        scale_factor = self.vf_slider.value() / 10.0
-        
-        print(f"Calculating with CRF={crf}, scale={scale_factor}")  # デバッグ用
-        
-        estimation = self.estimate_file_size(video_info, crf, scale_factor)
-        
-        if estimation:
-            original_size = video_info.get('file_size', 0)
-            
-            text = f"ファイルサイズ推定: {estimation['size_mb']} MB "
-            text += f"(元: {original_size} MB) "
-            text += f"解像度: {estimation['new_resolution']} "
-            text += f"推定ビットレート: {estimation['bitrate']} kbps"
-            
-            if original_size > 0:
-                size_ratio = estimation['size_mb'] / original_size
-                compression_rate = (1 - size_ratio) * 100  # 圧縮率 = 削減された割合
-                
-                if compression_rate > 0:
-                    text += f" 圧縮率: {compression_rate:.1f}% 削減"
-                elif compression_rate < 0:
-                    increase_rate = abs(compression_rate)
-                    text += f" サイズ増加: {increase_rate:.1f}%"
-                else:
-                    text += f" サイズ変化なし"
-            
-            self.info_label.setText(text)
-            print(f"Estimation result: {text}")  # デバッグ用
-        else:
-            self.info_label.setText('ファイルサイズ推定: 計算できませんでした')
-            print("Estimation failed")  # デバッグ用
-
     def show_ffmpeg_version(self):
         # 最初にウォーターマークを表示
         
@@ -2322,6 +4480,8 @@ class MainWindow(QMainWindow):
             first_line = result.stdout.splitlines()[0] if result.stdout else ''
             self.text_edit.add_log("FFmpegが正常に検出されました")
             self.text_edit.add_log(f"FFmpeg: {first_line}")
+            if not ffmpeg_supports_fps_mode():
+                self.text_edit.add_log("FFmpegが5.1より前のため、フレームレートの指定に-vsyncを使用します")
         except Exception as e:
             self.text_edit.add_log("FFmpegのセットアップエラー")
             self.text_edit.add_log(f"FFmpegエラー: {str(e)}")
@@ -2400,39 +4560,92 @@ class MainWindow(QMainWindow):
         
         # 出力ファイル名生成
         input_filename = os.path.basename(video_file)
-        name_without_ext = os.path.splitext(input_filename)[0]
-        timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-        
-        # コーデック識別子
-        codec_suffix = "_H265" if self.use_h265_encoding else ""
-        
-        if self.encoding_mode == 'twopass':
-            output_filename = f"ClipItBro_{timestamp}_2pass{codec_suffix}_{name_without_ext}.mp4"
-        else:
-            output_filename = f"ClipItBro_{timestamp}_CRF{codec_suffix}_{name_without_ext}.mp4"
-            
-        output_path = os.path.join(os.path.dirname(video_file), output_filename)
+        output_path = build_output_path(video_file, self.encoding_mode, self.use_h265_encoding)
+        output_filename = os.path.basename(output_path)
         
         # ログ出力
         codec_name = "H.265 (HEVC)" if self.use_h265_encoding else "H.264 (x264)"
         self.text_edit.add_log(f"=== {self.encoding_mode.upper()}変換開始 ===")
         self.text_edit.add_log(f"🎥 コーデック: {codec_name}")
+        self.text_edit.add_log(f"⚙ エンコード速度/画質: {ENCODER_SPEED_PRESETS[self.speed_preset][0]}"
+                               f" (-preset {ENCODER_SPEED_PRESETS[self.speed_preset][1]})")
         self.text_edit.add_log(f"入力ファイル: {input_filename}")
         self.text_edit.add_log(f"出力ファイル: {output_filename}")
         
+        try:
+            trim_range = self.get_trim_range()
+        except ValueError as e:
+            self.text_edit.add_log(f"エラー: {e}")
+            return
+        
+        # 完了時に変換履歴へ記録するため、開始時の設定を保持
+        self.active_conversion = {
+            'input_path': video_file,
+            'settings': self.current_job_settings(),
+            'duration': self.get_target_duration(),
+            'started_at': time.time(),
+        }
+        
         # エンコード方式に応じて処理分岐
+        # 2passは両passで同じ範囲を入力シークし、CRFは範囲を切り出してから変換
         if self.encoding_mode == 'twopass':
-            self.start_twopass_conversion(video_file, output_path)
+            self.start_twopass_conversion(video_file, output_path, trim_range)
+        elif trim_range:
+            self.start_trimmed_conversion(video_file, output_path, trim_range)
         else:
             self.start_crf_conversion(video_file, output_path)
 
-    def start_twopass_conversion(self, video_file, output_path):
-        """2pass変換を開始"""
+    def start_trimmed_conversion(self, video_file, output_path, trim_range):
+        """トリミング範囲を切り出し（キーフレーム間はストリームコピー）、完了後に変換を開始"""
+        start, end = trim_range
+        self.trim_workspace = JobWorkspace('clipitbro_trim_',
+                                           JobWorkspace.estimate_trim_bytes(cached_media_record(video_file), start, end))
+        
+        self.convert_button.setEnabled(False)
+        self.convert_button.setText('トリミング中...')
+        self.single_progress_bar.setVisible(True)
+        self.single_progress_bar.setValue(0)
+        
+        self.trim_thread = SmartTrimThread(video_file, start, end, self.trim_workspace.path)
+        self.trim_thread.log_signal.connect(self.text_edit.add_log)
+        self.trim_thread.progress_signal.connect(lambda p: self.single_progress_bar.setValue(int(p)))
+        self.trim_thread.finished_signal.connect(
+            lambda success, trimmed_path, error: self.on_smart_trim_finished(success, trimmed_path, error, output_path, end - start)
+        )
+        self.trim_thread.start()
+
+    def on_smart_trim_finished(self, success, trimmed_path, error_message, output_path, duration):
+        """トリミング完了後に切り出したファイルを変換"""
+        self.single_progress_bar.setVisible(False)
+        if not success:
+            self.conversion_finished(False, output_path, error_message)
+            return
+        
+        self.convert_button.setEnabled(True)
+        self.convert_button.setText('変換実行 (CRF)')
+        self.start_crf_conversion(trimmed_path, output_path, duration)
+        
+        # 開始できなかった場合は作業ファイルを削除（変換開始時はボタンが無効化される）
+        if self.convert_button.isEnabled():
+            self.cleanup_trim_work_dir()
+
+    def cleanup_trim_work_dir(self):
+        """トリミング用の作業ディレクトリを削除"""
+        if self.trim_workspace:
+            self.trim_workspace.cleanup()
+            self.trim_workspace = None
+
+    def start_twopass_conversion(self, video_file, output_path, trim_range=None):
+        """2pass変換を開始（trim_rangeは両passで入力シークする範囲）"""
         video_info = self.text_edit.video_info
         if not video_info:
             self.text_edit.add_log("エラー: 動画情報が取得されていません")
             return
         
+        if self.crf_size_search:
+            self.start_crf_search_conversion(video_file, output_path, trim_range)
+            return
+        
         # 1passデータとコーデック設定の整合性チェック
         if hasattr(self.text_edit, 'first_pass_completed') and self.text_edit.first_pass_completed:
             if hasattr(self.text_edit, 'first_pass_codec'):
@@ -2445,40 +4658,107 @@ class MainWindow(QMainWindow):
                     # 1passデータをリセット
                     self.text_edit.first_pass_completed = False
                     self.text_edit.first_pass_data = None
+                    self.text_edit.discard_first_pass_workspace()
                     if hasattr(self.text_edit, '_first_pass_running'):
                         self.text_edit._first_pass_running = False
+            # 1passの統計は解析した範囲にしか対応しない
+            if self.text_edit.first_pass_completed and getattr(self.text_edit, 'first_pass_range', None) != trim_range:
+                self.text_edit.add_log("⚠️ 1passデータの解析範囲がトリミング範囲と一致しません")
+                self.text_edit.add_log("1passデータを破棄して再解析を実行します...")
+                self.text_edit.first_pass_completed = False
+                self.text_edit.first_pass_data = None
+                self.text_edit.discard_first_pass_workspace()
         
-        # パラメータ取得
+        # パラメータ取得（トリミング時は範囲の長さで計算）
         target_size = self.size_slider.value()
-        duration = video_info.get('duration', 0)
+        if trim_range:
+            duration = trim_range[1] - trim_range[0]
+            self.text_edit.add_log(f"✂ トリミング範囲: {format_timecode(trim_range[0])} 〜 {format_timecode(trim_range[1])} ({duration:.2f}秒)")
+        else:
+            duration = video_info.get('duration', 0)
         
         if duration <= 0:
             self.text_edit.add_log("エラー: 動画の長さが不明です")
             return
         
-        # ビットレート計算
-        target_bitrate = self.calculate_target_bitrate(target_size, duration)
-        if not target_bitrate:
+        # ビットレート計算（実際の音声ストリームとコンテナのオーバーヘッドを差し引いて配分）
+        budget = BitBudget.allocate(target_size, duration, cached_media_record(self.text_edit.video_file_path),
+                                    self.audio_tracks_for(self.text_edit.video_file_path), self.audio_mix,
+                                    self.output_fps_for(self.text_edit.video_file_path))
+        if not budget:
             self.text_edit.add_log("エラー: ビットレート計算に失敗しました")
             return
+        target_bitrate, audio_plan = budget.video_kbps, budget.audio_plan
         
         self.text_edit.add_log(f"目標サイズ: {target_size} MB")
         self.text_edit.add_log(f"推定ビットレート: {target_bitrate} kbps")
-        
+        self.text_edit.add_log(f"📊 配分: {budget.describe()}")
+        if self.size_guard:
+            target_bitrate, factor, samples = apply_bitrate_feedback(target_bitrate, self.use_h265_encoding,
+                                                                     video_info.get('height'))
+            if factor < 1.0:
+                self.text_edit.add_log(f"📉 過去の超過実績（{samples}件）から動画ビットレートを ×{factor:.3f} "
+                                       f"に補正: {target_bitrate} kbps")
+        
+        # 分割並列エンコードは区間ごとに1pass目を実行するため、事前解析の結果は使わない
+        if self.chunked_encoding:
+            self.text_edit.add_log("✂ 分割並列エンコードで1pass目から実行します...")
+            self.execute_full_twopass(video_file, output_path, target_bitrate, duration, trim_range, audio_plan)
         # 1pass目が完了しているかチェック
-        if not getattr(self.text_edit, 'first_pass_completed', False):
+        elif not getattr(self.text_edit, 'first_pass_completed', False) or not self.text_edit.first_pass_workspace:
             self.text_edit.add_log("警告: 1pass解析が完了していません。1pass目から開始します...")
             # 1pass目を実行してから2pass目を実行
-            self.execute_full_twopass(video_file, output_path, target_bitrate)
+            self.execute_full_twopass(video_file, output_path, target_bitrate, duration, trim_range, audio_plan)
         else:
             self.text_edit.add_log("1pass解析済み。2pass目を実行します...")
             # 2pass目のみ実行
-            self.execute_second_pass_only(video_file, output_path, target_bitrate)
+            self.execute_second_pass_only(video_file, output_path, target_bitrate, duration, trim_range, audio_plan)
+
+    def start_crf_search_conversion(self, video_file, output_path, trim_range=None):
+        """CRF探索で目標サイズを狙う変換を開始"""
+        target_size = self.size_slider.value()
+        if trim_range:
+            duration = trim_range[1] - trim_range[0]
+            self.text_edit.add_log(f"✂ トリミング範囲: {format_timecode(trim_range[0])} 〜 {format_timecode(trim_range[1])} ({duration:.2f}秒)")
+        else:
+            duration = self.text_edit.video_info.get('duration', 0)
+        if duration <= 0:
+            self.text_edit.add_log("エラー: 動画の長さが不明です")
+            return
+        
+        self.text_edit.add_log(f"目標サイズ: {target_size} MB")
+        
+        # 探索を1pass目、本番エンコードを2pass目のプログレスバーに表示
+        self.convert_button.setEnabled(False)
+        self.convert_button.setText('変換中... (CRF探索)')
+        self.twopass_progress_widget.setVisible(True)
+        self.pass1_progress_bar.setValue(0)
+        self.pass2_progress_bar.setValue(0)
+        
+        try:
+            self.conversion_thread = CrfSearchConversionThread(
+                video_file, output_path, target_size, duration, use_h265=self.use_h265_encoding,
+                trim_range=trim_range, speed_preset=self.speed_preset, tune=self.encoder_tune,
+                audio_tracks=self.audio_tracks_for(self.text_edit.video_file_path), audio_mix=self.audio_mix,
+                output_fps=self.output_fps_for(self.text_edit.video_file_path)
+            )
+            self.conversion_thread.log_signal.connect(self.text_edit.add_log)
+            self.conversion_thread.progress_signal.connect(self.update_twopass_progress)
+            self.conversion_thread.phase_signal.connect(self.update_conversion_phase)
+            self.conversion_thread.finished_signal.connect(self.conversion_finished)
+            self.conversion_thread.start()
+            
+        except Exception as e:
+            self.text_edit.add_log(f"CRF探索変換開始エラー: {e}")
+            self.convert_button.setEnabled(True)
+            self.convert_button.setText('変換実行 (2pass)')
 
-    def execute_full_twopass(self, video_file, output_path, target_bitrate):
-        """1pass目と2pass目を連続実行"""
+    def execute_full_twopass(self, video_file, output_path, target_bitrate, total_duration=None, trim_range=None,
+                             audio_plan=None):
+        """1pass目と2pass目を連続実行（total_durationはトリミング後の長さ、audio_planはBitBudgetが選んだ音声）"""
         # 動画の総時間を取得（プログレス計算用）
-        total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
+        if total_duration is None:
+            total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
         
         # ボタンを無効化と2passプログレスバー表示
         self.convert_button.setEnabled(False)
@@ -2495,9 +4775,20 @@ class MainWindow(QMainWindow):
         
         try:
             # 2pass変換用のスレッドを作成
-            self.conversion_thread = TwoPassConversionThread(
-                video_file, output_path, target_bitrate, total_duration, use_h265=self.use_h265_encoding
-            )
+            if self.chunked_encoding:
+                self.conversion_thread = ChunkedTwoPassConversionThread(
+                    video_file, output_path, target_bitrate, total_duration, use_h265=self.use_h265_encoding,
+                    complexity_profile=self.text_edit.get_complexity_profile(), trim_range=trim_range,
+                    speed_preset=self.speed_preset, tune=self.encoder_tune, audio_plan=audio_plan,
+                    output_fps=self.output_fps_for(self.text_edit.video_file_path)
+                )
+            else:
+                self.conversion_thread = TwoPassConversionThread(
+                    video_file, output_path, target_bitrate, total_duration, use_h265=self.use_h265_encoding,
+                    trim_range=trim_range, speed_preset=self.speed_preset, tune=self.encoder_tune,
+                    size_cap_bytes=self.size_cap_bytes(), complexity_profile=self.text_edit.get_complexity_profile(),
+                    audio_plan=audio_plan, output_fps=self.output_fps_for(self.text_edit.video_file_path)
+                )
             self.conversion_thread.log_signal.connect(self.text_edit.add_log)
             self.conversion_thread.progress_signal.connect(self.update_twopass_progress)
             self.conversion_thread.phase_signal.connect(self.update_conversion_phase)
@@ -2509,28 +4800,16 @@ class MainWindow(QMainWindow):
             self.convert_button.setEnabled(True)
             self.convert_button.setText('変換実行 (2pass)')
 
-    def execute_second_pass_only(self, video_file, output_path, target_bitrate):
-        """2pass目のみ実行（1pass目は完了済み）"""
-        # FFmpegコマンド構築（2pass目）
-        ffmpeg_path = get_ffmpeg_executable_path('ffmpeg.exe')
-        
-        # コーデック選択
-        video_codec = 'libx265' if self.use_h265_encoding else 'libx264'
+    def size_cap_bytes(self):
+        """2pass目の出力サイズの上限（目標ファイルサイズ、監視しない設定ではNone）"""
+        return self.size_slider.value() * 1024 * 1024 if self.size_guard else None
+
+    def execute_second_pass_only(self, video_file, output_path, target_bitrate, total_duration=None, trim_range=None,
+                                 audio_plan=None):
+        """2pass目のみ実行（1pass目は同じ範囲で完了済み、コマンドはTwoPassConversionThreadが作成する）"""
         codec_name = 'H.265 (HEVC)' if self.use_h265_encoding else 'H.264 (x264)'
         self.text_edit.add_log(f"📹 使用コーデック: {codec_name}")
         
-        cmd = [
-            ffmpeg_path,
-            '-y',  # ファイル上書き許可
-            '-i', video_file,
-            '-c:v', video_codec,
-            '-b:v', f'{target_bitrate}k',
-            '-pass', '2',
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            output_path
-        ]
-        
         # ボタンを無効化（2pass目のみ実行）
         self.convert_button.setEnabled(False)
         self.convert_button.setText('変換中... (2pass)')
@@ -2538,20 +4817,18 @@ class MainWindow(QMainWindow):
         self.pass2_progress_bar.setValue(0)
         
         # 動画の総時間を取得（プログレス計算用）
-        total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
-        
-        # 環境変数設定
-        env = os.environ.copy()
-        env['PYTHONIOENCODING'] = 'utf-8'
-        if os.name == 'nt':
-            env['LANG'] = 'ja_JP.UTF-8'
+        if total_duration is None:
+            total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
         
         try:
             self.text_edit.add_log("2pass目実行開始...")
             # 2pass目のプログレスバー更新のためTwoPassConversionThreadを使用
             self.twopass_thread = TwoPassConversionThread(
                 video_file, output_path, target_bitrate, total_duration, 
-                second_pass_only=True, use_h265=self.use_h265_encoding
+                second_pass_only=True, use_h265=self.use_h265_encoding, trim_range=trim_range,
+                workspace=self.text_edit.first_pass_workspace, speed_preset=self.speed_preset, tune=self.encoder_tune,
+                size_cap_bytes=self.size_cap_bytes(), complexity_profile=self.text_edit.get_complexity_profile(),
+                audio_plan=audio_plan, output_fps=self.text_edit.first_pass_output_fps
             )
             self.twopass_thread.log_signal.connect(self.text_edit.add_log)
             self.twopass_thread.progress_signal.connect(self.update_twopass_progress)
@@ -2563,8 +4840,8 @@ class MainWindow(QMainWindow):
             self.convert_button.setEnabled(True)
             self.convert_button.setText('変換実行 (2pass)')
 
-    def start_crf_conversion(self, video_file, output_path):
-        """CRF変換を開始（従来の方式）"""
+    def start_crf_conversion(self, video_file, output_path, total_duration=None):
+        """CRF変換を開始（従来の方式、total_durationはトリミング後の長さ）"""
         # パラメータ取得
         crf = self.crf_slider.value()
         vf = self.vf_slider.value() / 10.0
@@ -2572,16 +4849,11 @@ class MainWindow(QMainWindow):
         self.text_edit.add_log(f"CRF: {crf}, スケール: {vf}")
         
         # FFmpegコマンド構築
-        ffmpeg_path = get_ffmpeg_executable_path('ffmpeg.exe')
-        cmd = [
-            ffmpeg_path,
-            '-i', video_file,
-            '-c:v', 'libx264',
-            '-crf', str(crf),
-            '-vf', f'scale=trunc(iw*{vf}/2)*2:trunc(ih*{vf}/2)*2',
-            '-c:a', 'copy',
-            output_path
-        ]
+        audio_plan = plan_crf_audio(cached_media_record(self.text_edit.video_file_path),
+                                    self.audio_tracks_for(self.text_edit.video_file_path), self.audio_mix)
+        self.text_edit.add_log(f"🔊 音声: {audio_plan.describe()}")
+        cmd = build_crf_command(video_file, output_path, crf, vf, self.speed_preset, self.encoder_tune, audio_plan,
+                                self.output_fps_for(self.text_edit.video_file_path))
         
         # ボタンを無効化と単一プログレスバー表示
         self.convert_button.setEnabled(False)
@@ -2590,7 +4862,8 @@ class MainWindow(QMainWindow):
         self.single_progress_bar.setValue(0)
         
         # 動画の総時間を取得（プログレス計算用）
-        total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
+        if total_duration is None:
+            total_duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
         
         # 環境変数設定
         env = os.environ.copy()
@@ -2614,7 +4887,9 @@ class MainWindow(QMainWindow):
 
     def update_conversion_phase(self, phase):
         """変換フェーズの更新"""
-        if phase == 1:
+        if isinstance(self.sender(), CrfSearchConversionThread):
+            self.convert_button.setText('変換中... (CRF探索)' if phase == 1 else '変換中... (本番エンコード)')
+        elif phase == 1:
             self.convert_button.setText('変換中... (1pass)')
         elif phase == 2:
             self.convert_button.setText('変換中... (2pass)')
@@ -2667,6 +4942,7 @@ class MainWindow(QMainWindow):
 
     def conversion_finished(self, success, output_path, error_message):
         """変換完了時の処理"""
+        self.cleanup_trim_work_dir()
         self.convert_button.setEnabled(True)
         if self.encoding_mode == 'twopass':
             self.convert_button.setText('変換実行 (2pass)')
@@ -2694,6 +4970,7 @@ class MainWindow(QMainWindow):
             try:
                 file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
                 self.text_edit.add_log(f"出力ファイルサイズ: {file_size:.2f} MB")
+                self.record_conversion_history(output_path, self.sender())
                 
                 # 2pass方式の場合、目標サイズとの比較を表示
                 if self.encoding_mode == 'twopass':
@@ -2701,6 +4978,10 @@ class MainWindow(QMainWindow):
                     size_diff = abs(file_size - target_size)
                     accuracy = ((target_size - size_diff) / target_size) * 100
                     self.text_edit.add_log(f"目標サイズ: {target_size} MB | 誤差: {size_diff:.2f} MB | 精度: {accuracy:.1f}%")
+                    predicted_size = getattr(self.sender(), 'predicted_size', 0)
+                    if predicted_size:
+                        predicted_mb = predicted_size / (1024 * 1024)
+                        self.text_edit.add_log(f"CRF探索の予測: {predicted_mb:.2f} MB | 予測との誤差: {(file_size / predicted_mb - 1) * 100:+.1f}%")
             except:
                 pass
             
@@ -2720,6 +5001,23 @@ class MainWindow(QMainWindow):
             # エラーポップアップを表示
             self.show_error_dialog(error_message)
 
+    def record_conversion_history(self, output_path, thread=None):
+        """完了した変換を履歴に保存（CRF方式の実績はサイズ推定、2pass方式の超過実績はビットレートの補正に使う）"""
+        conversion = getattr(self, 'active_conversion', None)
+        history = get_conversion_history()
+        self.active_conversion = None
+        if not conversion or not history:
+            return
+        elapsed = time.time() - conversion['started_at']
+        size_attempts = thread.attempt_summary() if hasattr(thread, 'attempt_summary') else None
+        if history.record(conversion['input_path'], conversion['settings'], conversion['duration'], output_path, elapsed,
+                          size_attempts):
+            model = history.model
+            if conversion['settings'].get('mode') == 'crf' and model.count >= SizeModel.MIN_SAMPLES:
+                self.text_edit.add_log(f"🧠 サイズ推定モデルを更新しました (学習 {model.count}件)")
+                if self.encoding_mode == 'crf':
+                    self.update_size_estimation()
+
     def show_completion_dialog(self, output_path):
         """変換完了ダイアログを表示"""
         
@@ -3256,6 +5554,105 @@ class MainWindow(QMainWindow):
         """現在選択されている動画ファイルのパスを取得"""
         return self.text_edit.video_file_path
 
+    def get_trim_range(self):
+        """
+        入力されたトリミング範囲を取得
+
+        Returns:
+            tuple: (開始秒, 終了秒)。未指定の場合はNone
+        Raises:
+            ValueError: 範囲が不正な場合（メッセージは表示用）
+        """
+        try:
+            start = parse_timecode(self.trim_start_edit.text())
+            end = parse_timecode(self.trim_end_edit.text())
+        except ValueError:
+            raise ValueError("トリミング範囲の形式が正しくありません（例: 1:23.5）")
+        if start is None and end is None:
+            return None
+        
+        duration = self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
+        start = start or 0.0
+        end = duration if end is None else end
+        if duration > 0:
+            end = min(end, duration)
+        if end - start <= 0:
+            raise ValueError("トリミングの終了位置は開始位置より後にしてください")
+        if start == 0 and duration > 0 and end >= duration:
+            return None  # 全体が指定された場合はトリミングしない
+        return start, end
+
+    def get_trim_range_or_none(self):
+        """トリミング範囲を取得（不正な入力はトリミングなしとして扱う）"""
+        try:
+            return self.get_trim_range()
+        except ValueError:
+            return None
+
+    def get_target_duration(self):
+        """変換対象の長さ（秒）を取得（トリミング時は範囲の長さ）"""
+        trim_range = self.get_trim_range_or_none()
+        if trim_range:
+            return trim_range[1] - trim_range[0]
+        return self.text_edit.video_info.get('duration', 0) if self.text_edit.video_info else 0
+
+    def on_trim_range_changed(self):
+        """トリミング範囲の入力が確定した時の処理"""
+        try:
+            trim_range = self.get_trim_range()
+        except ValueError as e:
+            self.text_edit.add_log(f"⚠️ {e}")
+            return
+        if trim_range:
+            start, end = trim_range
+            self.text_edit.add_log(f"✂ トリミング範囲: {format_timecode(start)} 〜 {format_timecode(end)} ({end - start:.2f}秒)")
+        self.restart_first_pass_for_range(trim_range)
+        self.update_bitrate_estimation()
+
+    def restart_first_pass_for_range(self, trim_range):
+        """1pass解析の範囲がトリミング範囲と異なる場合は破棄して解析し直す"""
+        text_edit = self.text_edit
+        running = getattr(text_edit, '_first_pass_running', False)
+        if self.encoding_mode != 'twopass' or not (text_edit.first_pass_completed or running):
+            return
+        thread = getattr(text_edit, 'first_pass_thread', None)
+        analysed_range = thread.trim_range if running and thread else getattr(text_edit, 'first_pass_range', None)
+        if analysed_range == trim_range:
+            return
+        self.restart_first_pass("✂ トリミング範囲の変更により1pass解析をやり直します")
+
+    def restart_first_pass(self, message):
+        """実行中・完了済みの1pass解析を破棄して解析し直す（2pass方式のみ）"""
+        text_edit = self.text_edit
+        running = getattr(text_edit, '_first_pass_running', False)
+        if self.encoding_mode != 'twopass' or not (text_edit.first_pass_completed or running):
+            return
+        thread = getattr(text_edit, 'first_pass_thread', None)
+        
+        text_edit.add_log(message)
+        if running and thread and thread.isRunning():
+            # 停止による失敗通知は不要なので切断してから止める
+            thread.finished_signal.disconnect()
+            thread.stop()
+            if not thread.wait(3000):
+                thread.terminate()
+                thread.wait(1000)
+        text_edit._first_pass_running = False
+        text_edit.first_pass_completed = False
+        text_edit.first_pass_data = None
+        text_edit.first_pass_range = None
+        text_edit.discard_first_pass_workspace()
+        self.pass1_progress_bar.setValue(0)
+        self.pass2_progress_bar.setValue(0)
+        QTimer.singleShot(200, text_edit.start_first_pass)
+
+    def clear_trim_range(self):
+        """トリミング範囲をクリア"""
+        if self.trim_start_edit.text() or self.trim_end_edit.text():
+            self.trim_start_edit.clear()
+            self.trim_end_edit.clear()
+            self.on_trim_range_changed()
+
     def activate_window_on_completion(self):
         """変換完了時にアプリをアクティブにしてタスクバーを点滅"""
         try:
@@ -3384,6 +5781,62 @@ class MainWindow(QMainWindow):
             else:
                 action.setIcon(QIcon())  # アイコンをクリア
         
+        # 詳細な複雑度解析アクションの更新
+        if hasattr(self, 'vfr_sampling_action'):
+            if self.vfr_sampling_action.isChecked():
+                self.vfr_sampling_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.vfr_sampling_action.setIcon(QIcon())
+        
+        if hasattr(self, 'complexity_sampling_action'):
+            if self.complexity_sampling_action.isChecked():
+                self.complexity_sampling_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.complexity_sampling_action.setIcon(QIcon())
+        
+        if hasattr(self, 'size_calibration_action'):
+            if self.size_calibration_action.isChecked():
+                self.size_calibration_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.size_calibration_action.setIcon(QIcon())
+        
+        # 分割並列エンコードアクションの更新
+        if hasattr(self, 'chunked_encoding_action'):
+            if self.chunked_encoding_action.isChecked():
+                self.chunked_encoding_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.chunked_encoding_action.setIcon(QIcon())
+        
+        if hasattr(self, 'crf_size_search_action'):
+            if self.crf_size_search_action.isChecked():
+                self.crf_size_search_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.crf_size_search_action.setIcon(QIcon())
+        
+        if hasattr(self, 'size_guard_action'):
+            if self.size_guard_action.isChecked():
+                self.size_guard_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.size_guard_action.setIcon(QIcon())
+        
+        # CPU固定アクションの更新
+        if hasattr(self, 'cpu_pinning_action'):
+            if self.cpu_pinning_action.isChecked():
+                self.cpu_pinning_action.setIcon(self.create_checkmark_icon(True))
+            else:
+                self.cpu_pinning_action.setIcon(QIcon())
+        
+        # エンコード速度/チューニングメニューの更新
+        for group_name in ('speed_preset_group', 'encoder_tune_group', 'vfr_output_group'):
+            if hasattr(self, group_name):
+                for action in getattr(self, group_name).actions():
+                    action.setIcon(self.create_checkmark_icon(True) if action.isChecked() else QIcon())
+        
+        # 同時解析数メニューの更新
+        if hasattr(self, 'probe_parallelism_group'):
+            for action in self.probe_parallelism_group.actions():
+                action.setIcon(self.create_checkmark_icon(True) if action.isChecked() else QIcon())
+        
         # クリップボードアクションの更新
         if hasattr(self, 'auto_clipboard_action'):
             if self.auto_clipboard_action.isChecked():
@@ -3444,6 +5897,109 @@ class MainWindow(QMainWindow):
         self.h265_action.triggered.connect(self.toggle_h265_encoding)
         settings_menu.addAction(self.h265_action)
         
+        # 分割並列エンコード設定
+        self.chunked_encoding_action = QAction('2pass変換を分割して並列エンコード（マルチコア）', self)
+        self.chunked_encoding_action.setCheckable(True)
+        self.chunked_encoding_action.setChecked(self.chunked_encoding)
+        self.chunked_encoding_action.triggered.connect(self.toggle_chunked_encoding)
+        settings_menu.addAction(self.chunked_encoding_action)
+        
+        # CRF探索による目標サイズ変換設定
+        self.crf_size_search_action = QAction('目標サイズをCRF探索で狙う（短いクリップ向け）', self)
+        self.crf_size_search_action.setCheckable(True)
+        self.crf_size_search_action.setChecked(self.crf_size_search)
+        self.crf_size_search_action.triggered.connect(self.toggle_crf_size_search)
+        settings_menu.addAction(self.crf_size_search_action)
+        
+        # 目標サイズの上限保証設定
+        self.size_guard_action = QAction('目標サイズを上限として保証（2pass目を監視し、超過時は補正して再エンコード）', self)
+        self.size_guard_action.setCheckable(True)
+        self.size_guard_action.setChecked(self.size_guard)
+        self.size_guard_action.triggered.connect(self.toggle_size_guard)
+        settings_menu.addAction(self.size_guard_action)
+        
+        # 音声トラックの選択・ミックス
+        audio_track_action = QAction('音声トラックを選択...', self)
+        audio_track_action.triggered.connect(self.show_audio_track_dialog)
+        settings_menu.addAction(audio_track_action)
+        
+        # CPU固定（アフィニティ）設定
+        self.cpu_pinning_action = QAction('同時実行中のエンコードを別々のCPUコアに固定', self)
+        self.cpu_pinning_action.setCheckable(True)
+        self.cpu_pinning_action.setChecked(self.cpu_pinning)
+        self.cpu_pinning_action.triggered.connect(self.toggle_cpu_pinning)
+        settings_menu.addAction(self.cpu_pinning_action)
+        
+        # エンコード速度/画質サブメニュー
+        speed_menu = settings_menu.addMenu('エンコード速度/画質')
+        self.speed_preset_group = QActionGroup(self)
+        for key, (label, preset) in ENCODER_SPEED_PRESETS.items():
+            action = QAction(f'{label} ({preset})', self)
+            action.setCheckable(True)
+            action.setChecked(self.speed_preset == key)
+            action.triggered.connect(lambda checked, k=key: self.change_speed_preset(k))
+            self.speed_preset_group.addAction(action)
+            speed_menu.addAction(action)
+        
+        # チューニング（映像の種類）サブメニュー
+        tune_menu = settings_menu.addMenu('チューニング（映像の種類）')
+        self.encoder_tune_group = QActionGroup(self)
+        for key, (label, codecs) in ENCODER_TUNES.items():
+            action = QAction(label if key != 'film' else f'{label}（H.264のみ）', self)
+            action.setCheckable(True)
+            action.setChecked(self.encoder_tune == key)
+            action.triggered.connect(lambda checked, k=key: self.change_encoder_tune(k))
+            self.encoder_tune_group.addAction(action)
+            tune_menu.addAction(action)
+        
+        # VFR（可変フレームレート）素材サブメニュー
+        vfr_menu = settings_menu.addMenu('VFR（可変フレームレート）素材')
+        self.vfr_output_group = QActionGroup(self)
+        for fps, label in VFR_OUTPUT_RATES.items():
+            action = QAction(label, self)
+            action.setCheckable(True)
+            action.setChecked(self.vfr_output_fps == fps)
+            action.triggered.connect(lambda checked, f=fps: self.change_vfr_output_fps(f))
+            self.vfr_output_group.addAction(action)
+            vfr_menu.addAction(action)
+        vfr_menu.addSeparator()
+        self.vfr_sampling_action = QAction('タイムスタンプを抽出してVFRを判定（読み込みが少し遅くなります）', self)
+        self.vfr_sampling_action.setCheckable(True)
+        self.vfr_sampling_action.setChecked(self.vfr_timestamp_sampling)
+        self.vfr_sampling_action.triggered.connect(self.toggle_vfr_timestamp_sampling)
+        vfr_menu.addAction(self.vfr_sampling_action)
+        
+        # 詳細な複雑度解析（フレームサンプリング）設定
+        self.complexity_sampling_action = QAction('サイズ推定で映像の動きを詳細解析（低速）', self)
+        self.complexity_sampling_action.setCheckable(True)
+        self.complexity_sampling_action.setChecked(self.complexity_frame_sampling)
+        self.complexity_sampling_action.triggered.connect(self.toggle_complexity_frame_sampling)
+        settings_menu.addAction(self.complexity_sampling_action)
+        
+        # サンプルエンコードによるサイズ推定の校正設定
+        self.size_calibration_action = QAction('CRF方式のサイズ推定をサンプルエンコードで校正', self)
+        self.size_calibration_action.setCheckable(True)
+        self.size_calibration_action.setChecked(self.size_calibration)
+        self.size_calibration_action.triggered.connect(self.toggle_size_calibration)
+        settings_menu.addAction(self.size_calibration_action)
+        
+        # サイズ推定マップ（CRF×スケールのヒートマップ）
+        size_map_action = QAction('サイズ推定マップ（CRF×スケール）を表示', self)
+        size_map_action.triggered.connect(self.show_size_map_dialog)
+        settings_menu.addAction(size_map_action)
+        
+        # 複数ファイルの同時解析数サブメニュー
+        probe_menu = settings_menu.addMenu('同時解析数（複数ファイル）')
+        self.probe_parallelism_group = QActionGroup(self)
+        for workers in (0, 1, 2, 4, 8):
+            label = '自動' if workers == 0 else str(workers)
+            action = QAction(label, self)
+            action.setCheckable(True)
+            action.setChecked(self.probe_parallelism == workers)
+            action.triggered.connect(lambda checked, w=workers: self.change_probe_parallelism(w))
+            self.probe_parallelism_group.addAction(action)
+            probe_menu.addAction(action)
+        
         # セパレーター追加
         settings_menu.addSeparator()
         
@@ -3452,6 +6008,17 @@ class MainWindow(QMainWindow):
         test_notification_action.triggered.connect(self.test_notification)
         settings_menu.addAction(test_notification_action)
         
+        # キューメニュー
+        queue_menu = menubar.addMenu('キュー')
+        
+        add_queue_action = QAction('現在の設定でキューに追加', self)
+        add_queue_action.triggered.connect(self.add_to_queue)
+        queue_menu.addAction(add_queue_action)
+        
+        show_queue_action = QAction('キューを表示', self)
+        show_queue_action.triggered.connect(self.show_queue_dialog)
+        queue_menu.addAction(show_queue_action)
+        
         # ヘルプメニュー
         help_menu = menubar.addMenu('ヘルプ')
         
@@ -3475,6 +6042,87 @@ class MainWindow(QMainWindow):
         about_dialog = AboutDialog(self)
         about_dialog.exec_()
     
+    def current_job_settings(self):
+        """現在のUI設定から変換ジョブの設定を作成（音声トラックは選択中のファイルの選択）"""
+        return {
+            'mode': self.encoding_mode,
+            'target_size_mb': self.size_slider.value(),
+            'crf': self.crf_slider.value(),
+            'scale': self.vf_slider.value() / 10.0,
+            'use_h265': self.use_h265_encoding,
+            'chunked': self.chunked_encoding,
+            'crf_search': self.crf_size_search,
+            'size_guard': self.size_guard,
+            'speed_preset': self.speed_preset,
+            'tune': self.encoder_tune,
+            'audio_tracks': self.audio_tracks_for(self.text_edit.video_file_path),
+            'audio_mix': self.audio_mix,
+            'vfr_output_fps': self.vfr_output_fps,
+        }
+    
+    def add_to_queue(self):
+        """選択中のファイル（複数ドロップ時は解析済みの全ファイル）を現在の設定でキューに追加"""
+        settings = self.current_job_settings()
+        
+        batch = self.text_edit.media_batch
+        if batch and batch.ready_items():
+            entries = [(item.path, item.record.duration or 0) for item in batch.ready_items()]
+        else:
+            video_file = self.get_selected_video_file()
+            if not video_file:
+                self.text_edit.add_log("エラー: 動画ファイルが選択されていません")
+                return
+            video_info = self.text_edit.video_info or {}
+            entries = [(video_file, video_info.get('duration', 0))]
+            
+            # トリミング範囲は選択中の1ファイルにだけ適用する
+            try:
+                trim_range = self.get_trim_range()
+            except ValueError as e:
+                self.text_edit.add_log(f"エラー: {e}")
+                return
+            if trim_range:
+                settings['trim_start'], settings['trim_end'] = trim_range
+        
+        for path, duration in entries:
+            self.job_queue.enqueue(path, dict(settings, audio_tracks=self.audio_tracks_for(path)), duration)
+        estimated = self.job_queue.estimate_pending_sizes()
+        if estimated:
+            self.text_edit.add_log(f"📋 待機中のCRF方式ジョブ {estimated}件の出力サイズを推定しました")
+        self.job_queue.start()
+        self.show_queue_dialog()
+    
+    def show_queue_dialog(self):
+        """変換キューダイアログを表示"""
+        if self.job_queue_dialog is None:
+            self.job_queue_dialog = JobQueueDialog(self.job_queue, self)
+        self.job_queue_dialog.refresh()
+        self.job_queue_dialog.show()
+        self.job_queue_dialog.raise_()
+        self.job_queue_dialog.activateWindow()
+    
+    def show_size_map_dialog(self):
+        """CRF方式のサイズ推定マップを表示"""
+        if self.size_map_dialog is None:
+            self.size_map_dialog = SizeMapDialog(self)
+        self.size_map_dialog.refresh()
+        self.size_map_dialog.show()
+        self.size_map_dialog.raise_()
+        self.size_map_dialog.activateWindow()
+    
+    def change_queue_concurrency(self, count):
+        """変換キューの同時実行数を変更"""
+        self.queue_max_concurrent = count
+        self.settings.setValue('queue_max_concurrent', count)
+        self.job_queue.set_max_concurrent(count)
+        self.text_edit.add_log(f"📋 キューの同時実行数: {count}")
+    
+    def on_queue_finished(self):
+        """キュー内の全ジョブが終了した時の処理"""
+        done = sum(1 for job in self.job_queue.jobs if job.status == ConversionJob.STATUS_DONE)
+        failed = sum(1 for job in self.job_queue.jobs if job.status == ConversionJob.STATUS_FAILED)
+        self.text_edit.add_log(f"📋 キュー処理完了: 成功 {done}件 / 失敗 {failed}件")
+    
     def showEvent(self, event):
         """ウィンドウが表示された時の処理"""
         super().showEvent(event)
@@ -3511,6 +6159,183 @@ class MainWindow(QMainWindow):
         status = "有効" if self.auto_clipboard_copy else "無効"
         self.text_edit.add_log(f"📋 変換完了時の自動クリップボードコピー: {status}")
     
+    def toggle_complexity_frame_sampling(self):
+        """サイズ推定用の詳細な複雑度解析（フレームサンプリング）を切り替え"""
+        self.complexity_frame_sampling = self.complexity_sampling_action.isChecked()
+        self.settings.setValue('complexity_frame_sampling', self.complexity_frame_sampling)
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.complexity_frame_sampling else "無効"
+        self.text_edit.add_log(f"📈 映像の動きの詳細解析: {status}")
+        
+        # 読み込み済みの動画があれば解析し直す
+        if self.text_edit.video_info:
+            self.text_edit.complexity_profile = None
+            self.text_edit.start_complexity_analysis()
+    
+    def toggle_size_calibration(self):
+        """サンプルエンコードによるサイズ推定の校正を切り替え"""
+        self.size_calibration = self.size_calibration_action.isChecked()
+        self.settings.setValue('size_calibration', self.size_calibration)
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.size_calibration else "無効"
+        self.text_edit.add_log(f"📐 サイズ推定の校正: {status}")
+        
+        # 読み込み済みの動画があれば校正し直す（無効化時は停止して係数表の推定に戻す）
+        self.text_edit.start_size_calibration()
+        if self.encoding_mode == 'crf':
+            self.update_size_estimation()
+    
+    def toggle_chunked_encoding(self):
+        """2pass変換の分割並列エンコードを切り替え"""
+        self.chunked_encoding = self.chunked_encoding_action.isChecked()
+        self.settings.setValue('chunked_encoding', self.chunked_encoding)
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.chunked_encoding else "無効"
+        self.text_edit.add_log(f"✂ 分割並列エンコード: {status} (CPU {os.cpu_count() or 1}コア)")
+    
+    def toggle_crf_size_search(self):
+        """目標サイズの狙い方（2pass / CRF探索）を切り替え"""
+        self.crf_size_search = self.crf_size_search_action.isChecked()
+        self.settings.setValue('crf_size_search', self.crf_size_search)
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.crf_size_search else "無効"
+        self.text_edit.add_log(f"🎯 CRF探索による目標サイズ変換: {status}")
+        # CRF探索では事前の1pass解析を使わない
+        if self.crf_size_search:
+            self.restart_first_pass("🎯 CRF探索を使うため1pass解析を中止します")
+        elif self.encoding_mode == 'twopass' and self.text_edit.video_file_path:
+            QTimer.singleShot(200, self.text_edit.start_first_pass)
+    
+    def toggle_size_guard(self):
+        """目標サイズの上限保証を切り替え"""
+        self.size_guard = self.size_guard_action.isChecked()
+        self.settings.setValue('size_guard', self.size_guard)
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.size_guard else "無効"
+        self.text_edit.add_log(f"📏 目標サイズの上限保証: {status}")
+    
+    def audio_tracks_for(self, file_path):
+        """ファイルに選択された音声ストリームの番号（未選択の場合はNone＝既定の1本）"""
+        if not file_path:
+            return None
+        return self.audio_track_selection.get(MediaInfoCache.normalize_path(file_path))
+    
+    def show_audio_track_dialog(self):
+        """選択中のファイルの音声トラックの選択・ミックス設定ダイアログを表示"""
+        file_path = self.text_edit.video_file_path
+        record = cached_media_record(file_path)
+        if not record or not record.audio_streams():
+            self.text_edit.add_log("🔊 選択中のファイルに音声トラックがありません")
+            return
+        selected = [track for track, _ in select_audio_streams(record, self.audio_tracks_for(file_path))]
+        dialog = AudioTrackDialog(record, selected, self.audio_mix, self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        
+        key = MediaInfoCache.normalize_path(file_path)
+        if dialog.use_default:
+            self.audio_track_selection.pop(key, None)
+        else:
+            self.audio_track_selection[key] = dialog.selected_tracks()
+        self.audio_mix = dialog.mix_check.isChecked()
+        self.settings.setValue('audio_mix', self.audio_mix)
+        
+        tracks = [track for track, _ in select_audio_streams(record, self.audio_tracks_for(file_path))]
+        if not tracks:
+            self.text_edit.add_log("🔊 音声トラック: なし（音声を出力しません）")
+        else:
+            names = ', '.join(f'トラック{track + 1}' for track in tracks)
+            mix = "（1つにミックス）" if self.audio_mix and len(tracks) > 1 else ""
+            self.text_edit.add_log(f"🔊 音声トラック: {names}{mix}")
+        if self.encoding_mode == 'crf':
+            self.update_size_estimation()
+        else:
+            self.update_bitrate_estimation()
+    
+    def toggle_cpu_pinning(self):
+        """同時実行中のエンコードのCPU固定を切り替え"""
+        self.cpu_pinning = self.cpu_pinning_action.isChecked()
+        self.settings.setValue('cpu_pinning', self.cpu_pinning)
+        allocator = get_thread_allocator()
+        allocator.pinning = self.cpu_pinning
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.cpu_pinning else "無効"
+        self.text_edit.add_log(f"🧵 CPUコアへの固定: {status} ({allocator.topology.describe()})")
+    
+    def change_speed_preset(self, speed_preset):
+        """エンコード速度/画質の段階を変更（1passの統計はpresetに依存するため再解析する）"""
+        if speed_preset == self.speed_preset:
+            return
+        self.speed_preset = speed_preset
+        self.settings.setValue('speed_preset', speed_preset)
+        self.update_menu_checkmarks()
+        
+        label, preset = ENCODER_SPEED_PRESETS[speed_preset]
+        self.text_edit.add_log(f"⚙ エンコード速度/画質: {label} (-preset {preset})")
+        self.restart_first_pass("⚙ エンコード設定の変更により1pass解析をやり直します")
+        self.text_edit.start_size_calibration()
+    
+    def change_encoder_tune(self, tune):
+        """チューニング（映像の種類）を変更"""
+        if tune == self.encoder_tune:
+            return
+        self.encoder_tune = tune
+        self.settings.setValue('encoder_tune', tune)
+        self.update_menu_checkmarks()
+        
+        self.text_edit.add_log(f"⚙ チューニング: {ENCODER_TUNES[tune][0]}")
+        self.restart_first_pass("⚙ エンコード設定の変更により1pass解析をやり直します")
+        # サイズ推定の校正結果もエンコーダー設定ごとに異なる
+        self.text_edit.start_size_calibration()
+    
+    def change_vfr_output_fps(self, fps):
+        """VFR素材の出力フレームレートを変更（1passの統計はフレーム数に依存するため再解析する）"""
+        if fps == self.vfr_output_fps:
+            return
+        self.vfr_output_fps = fps
+        self.settings.setValue('vfr_output_fps', fps)
+        self.update_menu_checkmarks()
+        
+        self.text_edit.add_log(f"🎞 VFR素材の出力: {VFR_OUTPUT_RATES[fps]}")
+        if self.output_fps_for(self.text_edit.video_file_path) != self.text_edit.first_pass_output_fps:
+            self.restart_first_pass("🎞 フレームレートの変更により1pass解析をやり直します")
+        if self.encoding_mode == 'crf':
+            self.update_size_estimation()
+        else:
+            self.update_bitrate_estimation()
+    
+    def toggle_vfr_timestamp_sampling(self):
+        """パケットのタイムスタンプによるVFRの判定を切り替え（次に読み込むファイルから反映）"""
+        self.vfr_timestamp_sampling = self.vfr_sampling_action.isChecked()
+        self.settings.setValue('vfr_timestamp_sampling', self.vfr_timestamp_sampling)
+        self.text_edit.probe_service.sample_frame_timing = self.vfr_timestamp_sampling
+        self.update_menu_checkmarks()
+        
+        status = "有効" if self.vfr_timestamp_sampling else "無効"
+        self.text_edit.add_log(f"🎞 タイムスタンプの抽出によるVFRの判定: {status}（次に読み込むファイルから反映）")
+    
+    def output_fps_for(self, file_path):
+        """ファイルを固定フレームレートで出力する場合のfps（VFRでない・タイムスタンプを維持する場合はNone）"""
+        return resolve_output_fps(cached_media_record(file_path), self.vfr_output_fps)
+    
+    def change_probe_parallelism(self, workers):
+        """複数ファイル解析の同時実行数を変更"""
+        self.probe_parallelism = workers
+        self.settings.setValue('probe_parallelism', workers)
+        
+        max_workers = workers if workers > 0 else min(4, os.cpu_count() or 1)
+        self.text_edit.probe_service.set_max_workers(max_workers)
+        
+        self.update_menu_checkmarks()
+        label = '自動' if workers == 0 else str(workers)
+        self.text_edit.add_log(f"📂 同時解析数: {label} (ワーカー数 {max_workers})")
+    
     def toggle_h265_encoding(self):
         """H.265エンコード設定を切り替え（試験的機能）"""
         self.use_h265_encoding = self.h265_action.isChecked()
@@ -3539,19 +6364,15 @@ class MainWindow(QMainWindow):
                     self.text_edit.first_pass_thread.wait(1000)
             
             # 1passの一時ファイルをクリーンアップ
-            try:
-                temp_files = ['ffmpeg2pass-0.log', 'ffmpeg2pass-0.log.mbtree']
-                for temp_file in temp_files:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                        self.text_edit.add_log(f"🗑️ 一時ファイルを削除: {temp_file}")
-            except Exception as e:
-                self.text_edit.add_log(f"⚠️ 一時ファイル削除エラー: {e}")
+            if self.text_edit.first_pass_workspace:
+                self.text_edit.discard_first_pass_workspace()
+                self.text_edit.add_log("🗑️ 1passの一時ファイルを削除しました")
         
         # コーデック変更時は1passデータを破棄（H.264とH.265で互換性がないため）
         if hasattr(self.text_edit, 'first_pass_completed') and self.text_edit.first_pass_completed:
             self.text_edit.first_pass_completed = False
             self.text_edit.first_pass_data = None
+            self.text_edit.discard_first_pass_workspace()
             if hasattr(self.text_edit, 'first_pass_codec'):
                 self.text_edit.first_pass_codec = None
             if hasattr(self.text_edit, '_first_pass_running'):
@@ -3981,6 +6802,8 @@ class MainWindow(QMainWindow):
         
         # テーマを適用
         self.apply_theme()
+        if self.job_queue_dialog:
+            self.job_queue_dialog.apply_theme()
         
         # メニューの選択状態を更新
         for action in self.theme_group.actions():
@@ -4390,45 +7213,910 @@ class MainWindow(QMainWindow):
             background-color: {self.current_theme['button_hover']} !important;
         }}
         """
-        msg_box.setStyleSheet(msg_box_style)
-        msg_box.exec_()
-        
-        if msg_box.clickedButton() == execute_button:
-            self.execute_update(new_exe_path)
+        msg_box.setStyleSheet(msg_box_style)
+        msg_box.exec_()
+        
+        if msg_box.clickedButton() == execute_button:
+            self.execute_update(new_exe_path)
+        else:
+            self.text_edit.add_log("アップデートを後回しにしました")
+            self.text_edit.add_log(f"ダウンロード済みファイル: {new_exe_path}")
+    
+    def execute_update(self, new_exe_path):
+        """アップデートを実行"""
+        try:
+            self.text_edit.add_log("🔄 アップデートを実行中...")
+            self.text_edit.add_log(f"新しいexe: {new_exe_path}")
+            
+            # updater.batの利用可能性をチェック
+            if not UpdateManager.check_updater_availability():
+                self.text_edit.add_log("✗ updater.batが見つかりません")
+                # フォールバック：レガシーな方法を使用
+                current_exe_path = sys.executable
+                if UpdateManager.execute_update(current_exe_path, new_exe_path, restart=True):
+                    self.text_edit.add_log("✓ レガシーアップデート方式を使用しました")
+                    QTimer.singleShot(1000, QApplication.quit)
+                else:
+                    self.text_edit.add_log("✗ アップデート実行に失敗しました")
+                return
+            
+            # updater.batを使用してアップデート実行
+            if UpdateManager.execute_update_with_batch(new_exe_path):
+                self.text_edit.add_log("✓ updater.batを実行しました")
+                self.text_edit.add_log("アプリケーションを終了します...")
+                
+                # アプリケーションを終了
+                QTimer.singleShot(1000, QApplication.quit)
+            else:
+                self.text_edit.add_log("✗ updater.bat実行に失敗しました")
+                
+        except Exception as e:
+            self.text_edit.add_log(f"アップデート実行エラー: {e}")
+
+class AudioPlan:
+    """
+    出力の音声の扱い（'none'=音声なし, 'copy'=そのままコピー, 'encode'=AACで再エンコード）
+
+    tracksは使う音声ストリームの番号（音声ストリームの中での0始まりの順番、-map 0:a:N）で、
+    空の場合はFFmpegの既定の選択に任せる。mixがTrueの場合は複数のトラックをamixで1本にまとめる。
+    bitrate_kbpsは出力する全トラックの合計。
+    channels・sample_rateがNoneの場合は元の音声のまま（ダウンミックス・リサンプルしない）。
+    """
+
+    SAMPLES_PER_FRAME = {'aac': 1024, 'mp3': 1152}
+
+    def __init__(self, mode, bitrate_kbps=0, channels=None, sample_rate=None, codec='aac', tracks=None, sources=None,
+                 mix=False):
+        self.mode = mode
+        self.bitrate_kbps = bitrate_kbps if mode != 'none' else 0
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.codec = codec  # 出力の音声コーデック（コピー時は元のコーデック）
+        self.tracks = list(tracks or [])
+        self.sources = list(sources or [])  # 元の音声ストリーム（StreamRecord、tracksと同じ順）
+        self.mix = mix and len(self.tracks) > 1
+
+    @classmethod
+    def default(cls):
+        """元の音声が分からない場合の従来の設定（AAC 128kbps）"""
+        return cls('encode', 128)
+
+    def track_count(self):
+        """出力する音声トラックの数"""
+        if self.mode == 'none':
+            return 0
+        return 1 if self.mix or not self.tracks else len(self.tracks)
+
+    def map_args(self, input_index=0):
+        """
+        使う音声トラックだけを選ぶ-map（ミックスする場合は-filter_complexのamix）
+
+        選ばなかったトラックはデコードされない。tracksが空の場合は空のリスト。
+        """
+        if self.mode == 'none' or not self.tracks:
+            return []
+        if self.mix:
+            inputs = ''.join(f'[{input_index}:a:{track}]' for track in self.tracks)
+            return ['-filter_complex', f'{inputs}amix=inputs={len(self.tracks)}:duration=longest:normalize=0[aout]',
+                    '-map', '[aout]']
+        args = []
+        for track in self.tracks:
+            args += ['-map', f'{input_index}:a:{track}']
+        return args
+
+    def output_map_args(self, audio_input=0, video_input=0):
+        """映像1本と使う音声トラックを明示的に選ぶ-map（tracksが空の場合はFFmpegの既定の選択に任せる）"""
+        if not self.tracks:
+            return []
+        return ['-map', f'{video_input}:v:0'] + self.map_args(audio_input)
+
+    def ffmpeg_args(self):
+        """出力側のFFmpeg引数（-b:aはトラックごとのビットレート）"""
+        if self.mode == 'none':
+            return ['-an']
+        if self.mode == 'copy':
+            return ['-c:a', 'copy']
+        args = ['-c:a', 'aac', '-b:a', f'{self.bitrate_kbps // self.track_count()}k']
+        if self.channels:
+            args += ['-ac', str(self.channels)]
+        if self.sample_rate:
+            args += ['-ar', str(self.sample_rate)]
+        return args
+
+    def frames_per_second(self):
+        """1秒あたりの音声フレーム数（全トラックのMP4のサンプル数、オーバーヘッドの見積もりに使う）"""
+        if self.mode == 'none':
+            return 0.0
+        source_rate = self.sources[0].sample_rate if self.sources else None
+        sample_rate = self.sample_rate or source_rate or 48000
+        return sample_rate / self.SAMPLES_PER_FRAME.get(self.codec, 1024) * self.track_count()
+
+    def bytes_for(self, duration):
+        return self.bitrate_kbps * 1000 / 8 * duration
+
+    def cache_text(self):
+        """AudioTrackCacheのキーに含める音声設定"""
+        tracks = ','.join(str(track) for track in self.tracks)
+        return (f"{self.mode}|{self.codec}|{self.bitrate_kbps}|{self.channels or ''}|{self.sample_rate or ''}|"
+                f"{tracks}|{'mix' if self.mix else ''}")
+
+    def describe(self):
+        if self.mode == 'none':
+            return "音声なし"
+        if self.mix:
+            tracks = f", {len(self.tracks)}トラックをミックス"
+        elif len(self.tracks) > 1:
+            tracks = f", {len(self.tracks)}トラック"
+        else:
+            tracks = ""
+        if self.mode == 'copy':
+            return f"{self.codec.upper()} {self.bitrate_kbps:.0f}kbps (コピー{tracks})"
+        details = []
+        if self.channels:
+            details.append('モノラル' if self.channels == 1 else f'{self.channels}ch')
+        if self.sample_rate:
+            details.append(f'{self.sample_rate / 1000:g}kHz')
+        text = f"AAC {self.bitrate_kbps}kbps"
+        if details or tracks:
+            text += f" ({', '.join(details)}{tracks})" if details else f" ({tracks[2:]})"
+        return text
+
+def default_audio_stream(record):
+    """FFmpegが既定で選ぶ音声ストリーム（チャンネル数が最も多いもの、同数なら先頭）"""
+    audio_streams = record.audio_streams() if record else []
+    if not audio_streams:
+        return None
+    return max(audio_streams, key=lambda stream: stream.channels or 0)
+
+def select_audio_streams(record, audio_tracks=None):
+    """
+    変換に使う音声ストリーム
+
+    Args:
+        audio_tracks: 音声ストリームの番号のリスト（Noneの場合はFFmpegの既定の1本、空の場合は音声なし）
+
+    Returns:
+        list: [(音声ストリームの番号, StreamRecord), ...]
+    """
+    audio_streams = record.audio_streams() if record else []
+    if audio_tracks is not None:
+        selected = [(track, audio_streams[track]) for track in audio_tracks if 0 <= track < len(audio_streams)]
+        # 別のファイル用の選択でどのトラックも存在しない場合は既定の選択に戻す
+        if selected or not audio_tracks:
+            return selected
+    stream = default_audio_stream(record)
+    return [(audio_streams.index(stream), stream)] if stream else []
+
+def describe_audio_stream(stream):
+    """音声ストリームの表示用の説明（コーデック・チャンネル・サンプリングレート・ビットレート・言語・名前）"""
+    parts = [stream.codec_name or '?']
+    if stream.channels:
+        parts.append('モノラル' if stream.channels == 1 else f'{stream.channels}ch')
+    if stream.sample_rate:
+        parts.append(f'{stream.sample_rate / 1000:g}kHz')
+    if stream.bit_rate:
+        parts.append(f'{stream.bit_rate / 1000:.0f}kbps')
+    if stream.language and stream.language != 'und':
+        parts.append(f'[{stream.language}]')
+    text = ' '.join(parts)
+    return f"{text} 「{stream.title}」" if stream.title else text
+
+# MP4のインデックス（moov）の大きさ。libx264 + AAC の実測（60秒/30fps/モノラル: 64.7KB、
+# 10秒/60fps/ステレオ: 17.2KB）から求めた、固定分・トラックごと・サンプル（フレーム）ごとのバイト数
+MP4_FIXED_BYTES = 1024
+MP4_TRACK_BYTES = 512
+MP4_VIDEO_SAMPLE_BYTES = 16
+MP4_AUDIO_SAMPLE_BYTES = 12
+
+def estimate_mp4_overhead(duration, fps, audio_plan=None):
+    """MP4のコンテナのオーバーヘッド（moov・ftyp・mdatのヘッダー等）のバイト数を見積もる"""
+    tracks = 1 + (audio_plan.track_count() if audio_plan is not None else 0)
+    audio_fps = audio_plan.frames_per_second() if audio_plan is not None else 0.0
+    samples_bytes = (fps or 30) * MP4_VIDEO_SAMPLE_BYTES + audio_fps * MP4_AUDIO_SAMPLE_BYTES
+    return int(MP4_FIXED_BYTES + tracks * MP4_TRACK_BYTES + duration * samples_bytes)
+
+class BitBudget:
+    """
+    目標ファイルサイズを動画・音声・コンテナのオーバーヘッドに配分
+
+    音声は全体のビットレートに対する割合（AUDIO_SHARE）に収まる最も高い段階を選び、
+    厳しい目標では低いビットレート・モノラル・低いサンプリングレートに落として動画に回す。
+    元の音声がMP4に入れられるコーデック（AAC/MP3）で、選んだ段階以下のビットレートならそのままコピーする。
+    複数のトラックを残す場合は音声の割合をトラック数で分け、ミックスする場合は1本分として扱う。
+    """
+
+    # (kbps, チャンネル数, サンプリングレート) 高い順
+    AUDIO_LADDER = (
+        (160, 2, 48000),
+        (128, 2, 48000),
+        (112, 2, 48000),
+        (96, 2, 48000),
+        (80, 2, 44100),
+        (64, 2, 44100),
+        (48, 1, 44100),
+        (32, 1, 22050),
+    )
+    AUDIO_SHARE = 0.1  # 音声に使う全体のビットレートの割合の上限
+    MONO_SCALE = 0.6  # 元がモノラルの場合のビットレート（ステレオの段階に対する比）
+    MIN_AUDIO_KBPS = 32
+    MIN_VIDEO_KBPS = 100
+    MP4_COPY_AUDIO = ('aac', 'mp3')  # MP4にそのままコピーできる音声コーデック
+    LOSSY_AUDIO = ('aac', 'mp3', 'opus', 'vorbis', 'ac3', 'eac3', 'dts', 'wmav2')
+    COPY_TOLERANCE = 1.1  # 選んだ段階をこの比率まで超える元の音声はコピーする
+
+    def __init__(self, target_size_mb, duration, video_kbps, audio_plan, overhead_bytes):
+        self.target_size_mb = target_size_mb
+        self.duration = duration
+        self.video_kbps = video_kbps
+        self.audio_plan = audio_plan
+        self.overhead_bytes = overhead_bytes
+
+    @classmethod
+    def allocate(cls, target_size_mb, duration, record=None, audio_tracks=None, audio_mix=False, output_fps=None):
+        """
+        目標サイズの配分を計算
+
+        Args:
+            record: 入力のMediaRecord（Noneの場合は音声をAAC 128kbpsとみなす）
+            audio_tracks: 使う音声ストリームの番号（select_audio_streamsを参照）
+            audio_mix: 複数のトラックを1本にミックスするかどうか
+            output_fps: 固定フレームレートで出力する場合のfps（resolve_output_fps、Noneは入力の実際の平均）
+
+        Returns:
+            BitBudget: 長さが不明な場合はNone
+        """
+        if not duration or duration <= 0:
+            return None
+        target_bytes = target_size_mb * 1024 * 1024
+        total_kbps = target_bytes * 8 / 1000 / duration
+        if record is None:
+            audio_plan = AudioPlan.default()
+        else:
+            selected = select_audio_streams(record, audio_tracks)
+            audio_plan = cls.choose_audio(selected, total_kbps, audio_mix) if selected else AudioPlan('none')
+
+        fps = output_fps or (record.frame_rate() if record else 0)
+        overhead_bytes = estimate_mp4_overhead(duration, fps, audio_plan)
+        video_kbps = (target_bytes - overhead_bytes) * 8 / 1000 / duration - audio_plan.bitrate_kbps
+        return cls(target_size_mb, duration, max(cls.MIN_VIDEO_KBPS, int(video_kbps)), audio_plan, overhead_bytes)
+
+    @classmethod
+    def choose_audio(cls, selected, total_kbps, mix=False):
+        """
+        全体のビットレートに応じて音声の段階を選ぶ（元の音声の品質を超える段階は選ばない）
+
+        Args:
+            selected: select_audio_streamsの結果
+        """
+        tracks = [track for track, _ in selected]
+        streams = [stream for _, stream in selected]
+        mix = mix and len(streams) > 1
+        outputs = 1 if mix else len(streams)
+        budget = total_kbps * cls.AUDIO_SHARE / outputs
+        kbps, channels, sample_rate = next(
+            (tier for tier in cls.AUDIO_LADDER if tier[0] <= budget), cls.AUDIO_LADDER[-1])
+
+        source_channels = max(stream.channels or 2 for stream in streams)
+        if source_channels < channels:
+            channels = source_channels
+            kbps = max(cls.MIN_AUDIO_KBPS, int(kbps * cls.MONO_SCALE) // 8 * 8)
+        source_rates = [stream.sample_rate for stream in streams if stream.sample_rate]
+        if source_rates:
+            sample_rate = min(sample_rate, max(source_rates))
+
+        source_kbps = [stream.bit_rate / 1000 if stream.bit_rate else None for stream in streams]
+        copyable = all(
+            rate and stream.codec_name in cls.MP4_COPY_AUDIO and rate <= kbps * cls.COPY_TOLERANCE
+            and (stream.channels or 2) <= 2
+            for stream, rate in zip(streams, source_kbps)
+        )
+        if copyable and not mix:
+            return AudioPlan('copy', sum(source_kbps), codec=streams[0].codec_name, tracks=tracks, sources=streams)
+        # 非可逆圧縮の元の音声より高いビットレートで再エンコードしても音質は上がらない
+        if all(rate and stream.codec_name in cls.LOSSY_AUDIO for stream, rate in zip(streams, source_kbps)):
+            if max(source_kbps) < kbps:
+                kbps = max(cls.MIN_AUDIO_KBPS, int(max(source_kbps)) // 8 * 8)
+        return AudioPlan('encode', kbps * outputs, channels, sample_rate, tracks=tracks, sources=streams, mix=mix)
+
+    def audio_bytes(self):
+        return self.audio_plan.bytes_for(self.duration)
+
+    def describe(self):
+        return (f"動画 {self.video_kbps} kbps / 音声 {self.audio_plan.describe()} / "
+                f"コンテナ {self.overhead_bytes / 1024:.0f}KB")
+
+# CRF方式の音声（目標サイズが無いため音質を優先する）
+CRF_AUDIO_KBPS = 192
+CRF_COPY_MAX_KBPS = 320
+
+def plan_crf_audio(record, audio_tracks=None, audio_mix=False):
+    """
+    CRF方式の音声の扱い
+
+    MP4に入れられる音声（AAC/MP3）で極端に高いビットレートでなければコピーし、
+    PCM・FLAC等や高ビットレートの音声、ミックスする場合はAACで再エンコードする
+    （多チャンネルはステレオにダウンミックス）。
+    """
+    if record is None:
+        return AudioPlan('encode', CRF_AUDIO_KBPS)
+    selected = select_audio_streams(record, audio_tracks)
+    if not selected:
+        return AudioPlan('none')
+    tracks = [track for track, _ in selected]
+    streams = [stream for _, stream in selected]
+    mix = audio_mix and len(streams) > 1
+    source_kbps = [stream.bit_rate / 1000 if stream.bit_rate else None for stream in streams]
+    if not mix and all(stream.codec_name in BitBudget.MP4_COPY_AUDIO and (rate or 0) <= CRF_COPY_MAX_KBPS
+                       for stream, rate in zip(streams, source_kbps)):
+        return AudioPlan('copy', sum(rate or 128 for rate in source_kbps), codec=streams[0].codec_name,
+                         tracks=tracks, sources=streams)
+    channels = min(max(stream.channels or 2 for stream in streams), 2)
+    kbps = CRF_AUDIO_KBPS if channels == 2 else CRF_AUDIO_KBPS // 2
+    if all(source_kbps):
+        kbps = min(kbps, max(BitBudget.MIN_AUDIO_KBPS, int(max(source_kbps))))
+    source_rates = [stream.sample_rate for stream in streams if stream.sample_rate]
+    sample_rate = min(max(source_rates), 48000) if source_rates else None
+    outputs = 1 if mix else len(streams)
+    return AudioPlan('encode', kbps * outputs, channels, sample_rate, tracks=tracks, sources=streams, mix=mix)
+
+def cached_media_record(file_path):
+    """メディア情報キャッシュからMediaRecordを取得（未解析・キャッシュ無効の場合はNone）"""
+    cache = get_media_info_cache()
+    return cache.get(file_path) if cache and file_path else None
+
+def calculate_target_bitrate(target_size_mb, duration_seconds, audio_bitrate_kbps=128):
+    """目標ファイルサイズから必要な動画ビットレート（kbps）を計算（音声は固定値、コンテナのオーバーヘッドは含めない）"""
+    if duration_seconds <= 0:
+        return None
+    
+    # ビット単位でのファイルサイズ
+    target_size_bits = target_size_mb * 8 * 1024 * 1024
+    
+    # 全体のビットレート（kbps）
+    total_bitrate = (target_size_bits / duration_seconds) / 1000
+    
+    # 音声ビットレートを差し引いて動画ビットレートを計算
+    video_bitrate = total_bitrate - audio_bitrate_kbps
+    
+    # 最小値を保証（100kbps）
+    return max(100, int(video_bitrate))
+
+def apply_bitrate_feedback(target_bitrate, use_h265, height):
+    """
+    過去の2pass変換の超過実績（同じコーデック・解像度区分）で目標ビットレートを補正
+
+    Returns:
+        tuple: (補正後のビットレート, 補正係数, 使った実績の件数)
+    """
+    history = get_conversion_history()
+    if not history or not target_bitrate:
+        return target_bitrate, 1.0, 0
+    factor, samples = history.bitrate_correction('libx265' if use_h265 else 'libx264', height)
+    return max(100, int(target_bitrate * factor)), factor, samples
+
+def build_output_path(video_file, mode, use_h265=False):
+    """入力ファイルと変換設定から出力ファイルパスを生成"""
+    input_filename = os.path.basename(video_file)
+    name_without_ext = os.path.splitext(input_filename)[0]
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    
+    # コーデック識別子
+    codec_suffix = "_H265" if use_h265 else ""
+    mode_label = "2pass" if mode == 'twopass' else "CRF"
+    
+    output_filename = f"ClipItBro_{timestamp}_{mode_label}{codec_suffix}_{name_without_ext}.mp4"
+    return os.path.join(os.path.dirname(video_file), output_filename)
+
+def build_input_args(video_file, trim_range=None):
+    """
+    入力ファイル指定の引数を作成
+
+    トリミング範囲がある場合は入力シーク（-iの前に-ss）と-tで範囲だけを読み込む。
+    出力のtime=はシーク位置からの経過時間になる。
+    """
+    if not trim_range:
+        return ['-i', video_file]
+    start, end = trim_range
+    return ['-ss', f'{start:.6f}', '-i', video_file, '-t', f'{end - start:.6f}']
+
+# 速度/画質の段階 -> (表示名, エンコーダーの-preset)
+ENCODER_SPEED_PRESETS = {
+    'fast': ('高速', 'veryfast'),
+    'balanced': ('標準', 'medium'),
+    'quality': ('高画質', 'slow'),
+}
+DEFAULT_SPEED_PRESET = 'balanced'
+
+# 映像の種類 -> (表示名, -tuneに対応しているエンコーダー)
+ENCODER_TUNES = {
+    '': ('なし', ()),
+    'film': ('実写', ('libx264',)),
+    'animation': ('アニメ', ('libx264', 'libx265')),
+    'grain': ('フィルムグレイン', ('libx264', 'libx265')),
+}
+
+def build_encoder_args(video_codec, speed_preset=DEFAULT_SPEED_PRESET, tune=''):
+    """速度/画質の段階とチューニングをエンコーダーの-preset/-tuneに変換"""
+    preset = ENCODER_SPEED_PRESETS.get(speed_preset, ENCODER_SPEED_PRESETS[DEFAULT_SPEED_PRESET])[1]
+    args = ['-preset', preset]
+    if tune and video_codec in ENCODER_TUNES.get(tune, ('', ()))[1]:
+        args += ['-tune', tune]
+    return args
+
+def build_first_pass_args(video_codec):
+    """
+    1pass目（解析のみ）を軽くする引数
+
+    音声・字幕・データは統計に関係しないため読み込まない。
+    GOP構造に関わる設定（-preset等）は2pass目と一致させる必要があるので変えない。
+    """
+    return ['-an', '-sn', '-dn']
+
+# VFR素材の出力フレームレート -> 表示名（0はタイムスタンプをそのまま使う）
+VFR_OUTPUT_RATES = {
+    0: 'タイムスタンプを維持（VFRのまま）',
+    30: '30fps固定（CFR）',
+    60: '60fps固定（CFR）',
+}
+
+def resolve_output_fps(record, vfr_output_fps=0):
+    """出力を固定フレームレートにする場合のfps（VFR素材で固定フレームレートが選ばれた場合のみ、それ以外はNone）"""
+    if not vfr_output_fps or record is None or not record.is_vfr():
+        return None
+    return vfr_output_fps
+
+_fps_mode_supported = None
+
+def ffmpeg_supports_fps_mode():
+    """
+    FFmpegが-fps_modeに対応しているか（初回のみ確認）
+
+    -fps_modeはFFmpeg 5.1以降のオプション。-vsyncは5.1で非推奨になりエンコードのたびに警告が出るが、
+    ユーザーが古いFFmpegに差し替えている場合は-vsyncでないと変換できない。
+    """
+    global _fps_mode_supported
+    if _fps_mode_supported is None:
+        try:
+            result = subprocess.run([get_ffmpeg_executable_path('ffmpeg.exe'), '-hide_banner', '-h', 'long'],
+                                    capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=10,
+                                    **get_hidden_window_kwargs())
+            _fps_mode_supported = '-fps_mode' in result.stdout
+        except (OSError, subprocess.SubprocessError):
+            _fps_mode_supported = False
+    return _fps_mode_supported
+
+def build_frame_rate_args(output_fps=None):
+    """
+    フレームレートの扱い（1pass目と2pass目、サンプルと本番で同じ値にする）
+
+    FFmpegの既定では出力形式で扱いが変わり、MP4ではVFR素材に複製フレームを足して
+    固定フレームレートにする（nullへの1pass目は足さないため2pass目とフレーム数も一致しない）。
+    既定ではタイムスタンプをそのまま使い、output_fpsを指定した場合はその固定フレームレートに変換する。
+    """
+    option = '-fps_mode' if ffmpeg_supports_fps_mode() else '-vsync'
+    if output_fps:
+        return [option, 'cfr', '-r', str(output_fps)]
+    return [option, 'passthrough']
+
+def first_pass_codec_params(video_codec):
+    """
+    1pass目用のエンコーダー詳細パラメータ
+
+    x264は既定で1pass目を高速な設定で行うが、x265は2pass目と同じ設定で解析するため明示的に無効化する。
+    """
+    return {'slow-firstpass': 0} if video_codec == 'libx265' else {}
+
+def build_codec_params_args(video_codec, params):
+    """x264/x265の詳細パラメータを1つの-x264-params/-x265-paramsにまとめる（後から指定すると上書きされるため）"""
+    if not params:
+        return []
+    option = '-x265-params' if video_codec == 'libx265' else '-x264-params'
+    return [option, ':'.join(f'{key}={value}' for key, value in params.items())]
+
+def encoder_profile_text(speed_preset=DEFAULT_SPEED_PRESET, tune=''):
+    """1pass統計キャッシュ・校正結果のキーに含めるエンコーダー設定"""
+    return f"{speed_preset}/{tune}"
+
+def build_crf_command(video_file, output_path, crf, scale, speed_preset=DEFAULT_SPEED_PRESET, tune='', audio_plan=None,
+                      output_fps=None):
+    """CRF変換用のFFmpegコマンドを構築（audio_planを省略した場合はキャッシュ済みの音声情報から決める）"""
+    ffmpeg_path = get_ffmpeg_executable_path('ffmpeg.exe')
+    if audio_plan is None:
+        audio_plan = plan_crf_audio(cached_media_record(video_file))
+    return [
+        ffmpeg_path,
+        '-i', video_file,
+        '-c:v', 'libx264',
+    ] + audio_plan.output_map_args() + build_encoder_args('libx264', speed_preset, tune) + [
+        '-crf', str(crf),
+        '-vf', f'scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2',
+    ] + build_frame_rate_args(output_fps) + audio_plan.ffmpeg_args() + [
+        output_path
+    ]
+
+def plan_keyframe_chunks(keyframe_times, duration, chunk_count, min_chunk_seconds=5.0):
+    """
+    キーフレーム位置で動画をchunk_count個程度の区間に分割
+
+    各分割点は理想的な等分位置に最も近いキーフレームを選ぶ。
+    短すぎる区間ができる場合は分割数を減らす。
+
+    Returns:
+        list: [(開始秒, 終了秒), ...]
+    """
+    if duration <= 0:
+        return []
+    keyframes = np.asarray(sorted(t for t in keyframe_times if 0 < t < duration), dtype=np.float64)
+    chunk_count = max(1, min(int(chunk_count), int(duration // min_chunk_seconds) or 1))
+
+    boundaries = [0.0]
+    for i in range(1, chunk_count):
+        if len(keyframes) == 0:
+            break
+        ideal = duration * i / chunk_count
+        candidate = float(keyframes[np.abs(keyframes - ideal).argmin()])
+        if candidate - boundaries[-1] >= min_chunk_seconds and duration - candidate >= min_chunk_seconds:
+            boundaries.append(candidate)
+    boundaries.append(float(duration))
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def allocate_chunk_bitrates(chunks, video_bitrate, complexity_profile=None):
+    """
+    動画全体のビットレート予算を各区間に配分（kbps）
+
+    複雑度プロファイルがあれば動きの多い区間に多めに割り当てるが、
+    区間ごとの「ビットレート×長さ」の合計は全体の予算と一致させる。
+    """
+    durations = np.array([end - start for start, end in chunks], dtype=np.float64)
+    weights = np.ones(len(chunks), dtype=np.float64)
+    if complexity_profile is not None and complexity_profile.mean_kbps() > 0:
+        chunk_kbps = np.array([complexity_profile.mean_kbps(start, end) for start, end in chunks], dtype=np.float64)
+        # 極端な配分を避けるため平方根で緩和し、0.5-2.0倍に制限
+        weights = np.clip(np.sqrt(np.maximum(chunk_kbps, 1.0) / complexity_profile.mean_kbps()), 0.5, 2.0)
+
+    total_bits = video_bitrate * durations.sum()
+    bitrates = weights * total_bits / float((weights * durations).sum())
+    return [max(100, int(round(b))) for b in bitrates]
+
+def plan_sample_segments(duration, count=4, fraction=0.2, min_seconds=1.0, max_seconds=3.0):
+    """
+    CRF探索用のサンプル区間を選ぶ
+
+    動画全体をcount等分し、各区間の中央からサンプルを1つずつ取る（場面の偏りを避ける）。
+    サンプルの合計が動画の大半になる短いクリップは、全体を1つのサンプルとして扱う。
+
+    Returns:
+        list: [(開始秒, 長さ秒), ...]（動画の先頭からの相対時刻）
+    """
+    if duration <= 0:
+        return []
+    length = min(max_seconds, max(min_seconds, duration * fraction / count))
+    if length * count >= duration * 0.6:
+        return [(0.0, float(duration))]
+    segments = []
+    for i in range(count):
+        center = duration * (i + 0.5) / count
+        start = min(max(0.0, center - length / 2), duration - length)
+        segments.append((start, length))
+    return segments
+
+def estimate_crf_for_bitrate(probes, target_kbps, crf_min=0, crf_max=51):
+    """
+    計測済みの {CRF: kbps} から目標ビットレートになるCRFを推定
+
+    ビットレートの対数がCRFに対してほぼ直線的に下がる性質を使い、目標を挟む2点
+    （挟めない場合は端の2点）で補間・外挿する。1点しかない場合はCRF+6で半分になるとみなす。
+
+    Returns:
+        tuple: (CRF（小数）, そのCRFでの予測kbps)
+    """
+    points = sorted((crf, kbps) for crf, kbps in probes.items() if kbps > 0)
+    if not points:
+        return None, 0
+    default_slope = -math.log(2) / 6
+    above = [p for p in points if p[1] >= target_kbps]  # 目標より大きい（CRFが低い側）
+    below = [p for p in points if p[1] < target_kbps]
+    if above and below:
+        (crf_a, kbps_a), (crf_b, kbps_b) = above[-1], below[0]
+    elif len(points) >= 2:
+        (crf_a, kbps_a), (crf_b, kbps_b) = points[:2] if below else points[-2:]
+    else:
+        (crf_a, kbps_a), (crf_b, kbps_b) = points[0], (None, None)
+
+    slope = default_slope
+    if crf_b is not None and crf_b != crf_a:
+        measured = (math.log(kbps_b) - math.log(kbps_a)) / (crf_b - crf_a)
+        if measured < 0:  # ノイズで単調減少にならない場合は既定の傾きを使う
+            slope = measured
+    crf = crf_a + (math.log(target_kbps) - math.log(kbps_a)) / slope
+    crf = min(crf_max, max(crf_min, crf))
+    return crf, math.exp(math.log(kbps_a) + slope * (crf - crf_a))
+
+class JobWorkspace:
+    """
+    1ジョブ専用の作業ディレクトリ
+
+    2passのログ（-passlogfile）や中間ファイルをジョブごとに分離する。
+    空き容量が十分あればtmpfs（/dev/shm）上に作成し、mbtreeの書き込みをディスクから外す。
+    """
+
+    TMPFS_DIRS = ('/dev/shm',)
+    TMPFS_RESERVE_BYTES = 64 * 1024 * 1024  # tmpfsに残しておく空き容量
+    PASSLOG_BYTES_PER_FRAME = 300  # 1pass統計（テキスト）の1フレームあたりの目安
+
+    def __init__(self, prefix='clipitbro_job_', required_bytes=0):
+        self.base_dir = self.choose_base_dir(required_bytes)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.base_dir)
+
+    @classmethod
+    def choose_base_dir(cls, required_bytes=0):
+        """必要な容量を確保できるtmpfsを返す（無ければNone＝通常の一時ディレクトリ）"""
+        for directory in cls.TMPFS_DIRS:
+            try:
+                if not (os.path.isdir(directory) and os.access(directory, os.W_OK)):
+                    continue
+                if shutil.disk_usage(directory).free >= required_bytes + cls.TMPFS_RESERVE_BYTES:
+                    return directory
+            except OSError:
+                continue
+        return None
+
+    @classmethod
+    def estimate_passlog_bytes(cls, record, duration=None):
+        """
+        2passのログとmbtree（16x16ブロックごとに2バイト/フレーム）の合計サイズを見積もる
+
+        recordは解析済みのMediaRecord（GUIスレッドからも呼ぶためここではFFprobeを実行しない）。
+        動画情報が無い場合は0を返す。
+        """
+        video_stream = record.video_stream() if record else None
+        if not video_stream or not video_stream.width or not video_stream.height:
+            return 0
+        fps = parse_frame_rate(video_stream.avg_frame_rate) or parse_frame_rate(video_stream.r_frame_rate)
+        frames = (duration or record.duration) * fps
+        blocks = ((video_stream.width + 15) // 16) * ((video_stream.height + 15) // 16)
+        return int(frames * (blocks * 2 + cls.PASSLOG_BYTES_PER_FRAME))
+
+    @classmethod
+    def estimate_trim_bytes(cls, record, start, end):
+        """切り出したファイルのサイズを元ファイルの平均ビットレートから見積もる（余裕として1.2倍、recordは解析済みのMediaRecord）"""
+        if not record or record.duration <= 0:
+            return 0
+        return int(record.size * min(1.0, (end - start) / record.duration) * 1.2)
+
+    @property
+    def on_tmpfs(self):
+        return self.base_dir is not None
+
+    @property
+    def passlog_prefix(self):
+        """-passlogfileに渡すパス（ffmpegが-0.logと.mbtreeを付け足す）"""
+        return os.path.join(self.path, 'ffmpeg2pass')
+
+    def file_path(self, name):
+        return os.path.join(self.path, name)
+
+    def describe(self):
+        return f"{'tmpfs' if self.on_tmpfs else 'ディスク'}: {self.path}"
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+class CpuTopology:
+    """
+    利用可能なCPUの構成
+
+    プロセスに許可された論理CPU（sched_getaffinity）を、/sys/devices/system/cpuの情報から
+    物理コア単位（SMTの兄弟スレッドをまとめたもの）に分類する。情報が無い環境では
+    論理CPU1つを1コアとして扱う。
+    """
+
+    SYSFS_CPU_DIR = '/sys/devices/system/cpu'
+
+    def __init__(self, logical_cpus, cores):
+        self.logical_cpus = logical_cpus  # [CPU番号, ...]
+        self.cores = cores  # [[同じ物理コアのCPU番号, ...], ...]（パッケージ・コア順）
+
+    @classmethod
+    def detect(cls):
+        if hasattr(os, 'sched_getaffinity'):
+            logical_cpus = sorted(os.sched_getaffinity(0))
         else:
-            self.text_edit.add_log("アップデートを後回しにしました")
-            self.text_edit.add_log(f"ダウンロード済みファイル: {new_exe_path}")
-    
-    def execute_update(self, new_exe_path):
-        """アップデートを実行"""
-        try:
-            self.text_edit.add_log("🔄 アップデートを実行中...")
-            self.text_edit.add_log(f"新しいexe: {new_exe_path}")
-            
-            # updater.batの利用可能性をチェック
-            if not UpdateManager.check_updater_availability():
-                self.text_edit.add_log("✗ updater.batが見つかりません")
-                # フォールバック：レガシーな方法を使用
-                current_exe_path = sys.executable
-                if UpdateManager.execute_update(current_exe_path, new_exe_path, restart=True):
-                    self.text_edit.add_log("✓ レガシーアップデート方式を使用しました")
-                    QTimer.singleShot(1000, QApplication.quit)
-                else:
-                    self.text_edit.add_log("✗ アップデート実行に失敗しました")
+            logical_cpus = list(range(os.cpu_count() or 1))
+
+        groups = {}
+        for cpu in logical_cpus:
+            topology_dir = os.path.join(cls.SYSFS_CPU_DIR, f'cpu{cpu}', 'topology')
+            try:
+                with open(os.path.join(topology_dir, 'physical_package_id')) as f:
+                    package_id = int(f.read().strip())
+                with open(os.path.join(topology_dir, 'core_id')) as f:
+                    core_id = int(f.read().strip())
+            except (OSError, ValueError):
+                package_id, core_id = 0, cpu
+            groups.setdefault((package_id, core_id), []).append(cpu)
+        cores = [sorted(groups[key]) for key in sorted(groups)]
+        return cls(logical_cpus, cores)
+
+    def describe(self):
+        return f"論理CPU {len(self.logical_cpus)} / 物理コア {len(self.cores)}"
+
+class ThreadAllocation:
+    """1ジョブに割り当てたCPUと、デコード・フィルタ・エンコードの各段階のスレッド数"""
+
+    def __init__(self, cpus):
+        self.cpus = list(cpus)  # 物理コア順（SMTの兄弟が隣り合う）
+        threads = max(1, len(self.cpus))
+        # エンコードが大半を占めるため全CPU分を割り当て、デコードとフィルタは補助的に少数だけ使う
+        self.encode_threads = threads
+        self.decode_threads = max(1, threads // 4)
+        self.filter_threads = max(1, threads // 8)
+
+    def input_args(self):
+        """-iより前に置く引数（デコーダーとフィルタグラフのスレッド数）"""
+        return ['-filter_threads', str(self.filter_threads), '-threads', str(self.decode_threads)]
+
+    def encoder_args(self):
+        """出力側に置く引数（エンコーダーのスレッド数）"""
+        return ['-threads', str(self.encode_threads)]
+
+    def codec_params(self, video_codec):
+        """x264/x265のスレッド関連パラメータ"""
+        threads = self.encode_threads
+        if video_codec == 'libx265':
+            # x265の既定値に合わせ、コア数に応じてフレーム並列数を決める
+            frame_threads = 6 if threads >= 32 else 5 if threads >= 16 else 3 if threads >= 8 else 2 if threads >= 4 else 1
+            return {'pools': threads, 'frame-threads': frame_threads}
+        return {'threads': threads, 'lookahead-threads': max(1, threads // 6)}
+
+    def apply_to_command(self, cmd, video_codec):
+        """出力パスが末尾にあるFFmpegコマンドへスレッド指定を挿入"""
+        return ([cmd[0]] + self.input_args() + cmd[1:-1] + self.encoder_args()
+                + build_codec_params_args(video_codec, self.codec_params(video_codec)) + [cmd[-1]])
+
+    def split(self, count):
+        """count個の並列プロセス用に分割（CPUが足りない場合は共有する）"""
+        count = max(1, count)
+        if len(self.cpus) < count:
+            return [ThreadAllocation([self.cpus[i % len(self.cpus)]]) for i in range(count)]
+        # 連続した範囲で分け、同じ物理コアのCPUがなるべく同じプロセスに入るようにする
+        base, extra = divmod(len(self.cpus), count)
+        allocations = []
+        index = 0
+        for i in range(count):
+            size = base + (1 if i < extra else 0)
+            allocations.append(ThreadAllocation(self.cpus[index:index + size]))
+            index += size
+        return allocations
+
+    def describe(self):
+        return (f"CPU {format_cpu_list(self.cpus)} (エンコード{self.encode_threads} / "
+                f"デコード{self.decode_threads} / フィルタ{self.filter_threads})")
+
+def format_cpu_list(cpus):
+    """CPU番号の一覧を 0-3,8 のような範囲表記にする"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+class ThreadAllocator:
+    """
+    同時に実行中のエンコードジョブへCPUを分配する
+
+    物理コアを単位に、ジョブごとに重ならないCPUの組を割り当てる（SMTの兄弟は同じジョブへ）。
+    スレッド数は各FFmpegプロセスの起動時に決まるため、ジョブの開始・終了による再配分は
+    次に起動するプロセス（次のpass・区間）から反映される。pinningが有効な場合は
+    実行中のプロセスのCPUアフィニティも再配分に合わせて更新する。
+    """
+
+    def __init__(self, topology=None, pinning=False):
+        self.topology = topology or CpuTopology.detect()
+        self.pinning = pinning
+        self._lock = threading.Lock()
+        self._jobs = []  # 登録順のトークン
+        self._processes = {}  # トークン -> 実行中のプロセス一覧
+        self._next_token = 0
+
+    def register(self):
+        """ジョブを登録してトークンを返す"""
+        with self._lock:
+            self._next_token += 1
+            token = self._next_token
+            self._jobs.append(token)
+            self._processes[token] = []
+        self._rebalance()
+        return token
+
+    def unregister(self, token):
+        with self._lock:
+            if token in self._jobs:
+                self._jobs.remove(token)
+            self._processes.pop(token, None)
+        self._rebalance()
+
+    def allocation(self, token):
+        """トークンのジョブに現在割り当てられているCPUとスレッド数"""
+        with self._lock:
+            return self._allocations_locked().get(token) or ThreadAllocation(self.topology.logical_cpus)
+
+    def _allocations_locked(self):
+        cores = self.topology.cores
+        jobs = self._jobs
+        if not jobs or not cores:
+            return {}
+        allocations = {}
+        if len(jobs) <= len(cores):
+            # 物理コアを連続したまとまりで均等に分ける（キャッシュを共有するコア同士を同じジョブに）
+            base, extra = divmod(len(cores), len(jobs))
+            index = 0
+            for i, token in enumerate(jobs):
+                size = base + (1 if i < extra else 0)
+                allocations[token] = ThreadAllocation([cpu for core in cores[index:index + size] for cpu in core])
+                index += size
+        else:
+            # ジョブ数がコア数より多い場合は1コアずつ共有する
+            for i, token in enumerate(jobs):
+                allocations[token] = ThreadAllocation(cores[i % len(cores)])
+        return allocations
+
+    def attach_process(self, token, process):
+        """ジョブのFFmpegプロセスを登録（pinning時は割り当てCPUに固定）"""
+        with self._lock:
+            if token not in self._processes:
                 return
-            
-            # updater.batを使用してアップデート実行
-            if UpdateManager.execute_update_with_batch(new_exe_path):
-                self.text_edit.add_log("✓ updater.batを実行しました")
-                self.text_edit.add_log("アプリケーションを終了します...")
-                
-                # アプリケーションを終了
-                QTimer.singleShot(1000, QApplication.quit)
-            else:
-                self.text_edit.add_log("✗ updater.bat実行に失敗しました")
-                
+            self._processes[token] = [p for p in self._processes[token] if p.poll() is None] + [process]
+            allocation = self._allocations_locked().get(token)
+        if self.pinning and allocation:
+            self.pin_process(process, allocation.cpus)
+
+    def _rebalance(self):
+        if not self.pinning:
+            return
+        with self._lock:
+            allocations = self._allocations_locked()
+            targets = [(process, allocations[token].cpus)
+                       for token, processes in self._processes.items() if token in allocations
+                       for process in processes if process.poll() is None]
+        for process, cpus in targets:
+            self.pin_process(process, cpus)
+
+    @staticmethod
+    def pin_process(process, cpus):
+        """プロセスの全スレッドを指定CPUに固定（失敗しても変換は続行する）"""
+        try:
+            if hasattr(os, 'sched_setaffinity'):
+                task_dir = f'/proc/{process.pid}/task'
+                thread_ids = [int(tid) for tid in os.listdir(task_dir)] if os.path.isdir(task_dir) else [process.pid]
+                for thread_id in thread_ids:
+                    try:
+                        os.sched_setaffinity(thread_id, cpus)
+                    except OSError:
+                        pass
+            elif os.name == 'nt':
+                import ctypes
+                mask = sum(1 << cpu for cpu in cpus)
+                ctypes.windll.kernel32.SetProcessAffinityMask(int(process._handle), ctypes.c_size_t(mask))
         except Exception as e:
-            self.text_edit.add_log(f"アップデート実行エラー: {e}")
+            print(f"CPUアフィニティ設定エラー: {e}")
+
+_thread_allocator = None
+
+def get_thread_allocator():
+    """共有のスレッドアロケーターを取得"""
+    global _thread_allocator
+    if _thread_allocator is None:
+        _thread_allocator = ThreadAllocator()
+    return _thread_allocator
 
 # 非同期変換処理用のスレッドクラス
 class ConversionThread(QThread):
@@ -4442,10 +8130,34 @@ class ConversionThread(QThread):
         self.env = env
         self.output_path = output_path
         self.total_duration = total_duration
+        self.process = None  # プロセス参照を保持
+        self._should_stop = False  # 停止フラグ
+    
+    def stop(self):
+        """スレッドを停止"""
+        self._should_stop = True
+        if self.process:
+            try:
+                self.process.terminate()
+            except:
+                pass
     
     def run(self):
+        # 同時実行中のジョブと重ならないCPUとスレッド数を割り当てる
+        allocator = get_thread_allocator()
+        token = allocator.register()
         try:
-            self.log_signal.emit(f"実行コマンド: {' '.join(self.cmd)}")
+            self.execute(allocator, token)
+        finally:
+            allocator.unregister(token)
+    
+    def execute(self, allocator, token):
+        try:
+            video_codec = self.cmd[self.cmd.index('-c:v') + 1] if '-c:v' in self.cmd else 'libx264'
+            allocation = allocator.allocation(token)
+            cmd = allocation.apply_to_command(self.cmd, video_codec)
+            self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()}")
+            self.log_signal.emit(f"実行コマンド: {' '.join(cmd)}")
             
             # FFmpegをリアルタイム監視で実行
             import re
@@ -4457,8 +8169,8 @@ class ConversionThread(QThread):
                 startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
                 startupinfo.wShowWindow = subprocess.SW_HIDE
             
-            process = subprocess.Popen(
-                self.cmd,
+            process = self.process = subprocess.Popen(
+                cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,  # stderrもstdoutにリダイレクト
                 text=True,
@@ -4469,6 +8181,7 @@ class ConversionThread(QThread):
                 startupinfo=startupinfo,  # ウィンドウ非表示設定を追加
                 creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0  # 追加の非表示フラグ
             )
+            allocator.attach_process(token, process)
             
             current_time = 0
             while True:
@@ -4495,7 +8208,10 @@ class ConversionThread(QThread):
             # プロセス終了を待機
             return_code = process.wait()
             
-            if return_code == 0:
+            if self._should_stop:
+                self.log_signal.emit("変換が停止されました")
+                self.finished_signal.emit(False, self.output_path, "変換が停止されました")
+            elif return_code == 0:
                 self.progress_signal.emit(100)  # 完了時は100%
                 self.log_signal.emit("FFmpeg実行成功")
                 self.finished_signal.emit(True, self.output_path, "")
@@ -4513,12 +8229,20 @@ class FirstPassThread(QThread):
     progress_signal = pyqtSignal(float)  # 進行状況シグナルを追加
     finished_signal = pyqtSignal(bool, str, str)  # success, log_file_path, error_message
     
-    def __init__(self, video_file_path, temp_bitrate, total_duration=0, use_h265=False):
+    def __init__(self, video_file_path, temp_bitrate, total_duration=0, use_h265=False, trim_range=None, workspace=None,
+                 speed_preset=DEFAULT_SPEED_PRESET, tune='', output_fps=None):
         super().__init__()
         self.video_file_path = video_file_path
         self.temp_bitrate = temp_bitrate
-        self.total_duration = total_duration  # 動画の総時間を追加
+        self.total_duration = total_duration  # 動画の総時間（トリミング時は範囲の長さ）
         self.use_h265 = use_h265
+        self.trim_range = trim_range  # 1passの統計はこの範囲に対応する
+        self.speed_preset = speed_preset  # 2pass目と同じ値にする
+        self.tune = tune
+        self.output_fps = output_fps  # 固定フレームレートにする場合のfps（Noneはタイムスタンプを維持、2pass目と同じ値にする）
+        # 1passの統計の保存先（2pass目で同じworkspaceを渡す。破棄は呼び出し側が行う）
+        self.workspace = workspace or JobWorkspace(
+            'clipitbro_pass1_', JobWorkspace.estimate_passlog_bytes(cached_media_record(video_file_path), total_duration))
         self.process = None  # プロセス参照を保持
         self._should_stop = False  # 停止フラグ
     
@@ -4532,21 +8256,42 @@ class FirstPassThread(QThread):
                 pass
     
     def run(self):
+        allocator = get_thread_allocator()
+        token = None
         try:
             ffmpeg_path = get_ffmpeg_executable_path('ffmpeg.exe')
             
-            # 1pass目用のログファイル名を生成
-            # 1pass目のコマンド構築
+            # 同じ内容・コーデック・範囲・フィルターの統計がキャッシュにあれば復元して終了
+            # （フレームレートの扱いでフレーム数が変わるため、1pass目のフィルター引数をキーに含める）
+            filter_args = build_frame_rate_args(self.output_fps)
+            cache = get_pass_stats_cache()
+            cache_key = PassStatsCache.make_key(
+                self.video_file_path, self.use_h265, self.trim_range, filter_chain=' '.join(filter_args),
+                encoder_profile=encoder_profile_text(self.speed_preset, self.tune)) if cache else None
+            if cache_key and cache.restore(cache_key, self.workspace.passlog_prefix):
+                self.progress_signal.emit(100)
+                self.log_signal.emit("⚡ 1pass統計をキャッシュから復元しました")
+                self.finished_signal.emit(True, self.workspace.passlog_prefix, "")
+                return
+            
+            # 1pass目のコマンド構築（ログはworkspace内に書き出す）
             # コーデック選択
             codec = 'libx265' if self.use_h265 else 'libx264'
+            token = allocator.register()
+            allocation = allocator.allocation(token)
+            codec_params = dict(first_pass_codec_params(codec), **allocation.codec_params(codec))
             
             cmd = [
                 ffmpeg_path,
                 '-y',  # ファイル上書き許可
-                '-i', self.video_file_path,
+            ] + allocation.input_args() + build_input_args(self.video_file_path, self.trim_range) + [
                 '-c:v', codec,
+            ] + build_encoder_args(codec, self.speed_preset, self.tune) + build_first_pass_args(codec) + (
+                allocation.encoder_args() + build_codec_params_args(codec, codec_params)
+            ) + filter_args + [
                 '-b:v', f'{self.temp_bitrate}k',
                 '-pass', '1',
+                '-passlogfile', self.workspace.passlog_prefix,
                 '-f', 'null'
             ]
             
@@ -4557,6 +8302,7 @@ class FirstPassThread(QThread):
                 cmd.append('/dev/null')
             
             self.log_signal.emit(f"1pass実行: {os.path.basename(self.video_file_path)}")
+            self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()}")
             
             # 環境変数設定
             env = os.environ.copy()
@@ -4586,6 +8332,7 @@ class FirstPassThread(QThread):
                 startupinfo=startupinfo,  # ウィンドウ非表示設定を追加
                 creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0  # 追加の非表示フラグ
             )
+            allocator.attach_process(token, self.process)
             
             # 出力を監視してプログレスを解析
             current_time = 0
@@ -4628,7 +8375,9 @@ class FirstPassThread(QThread):
             if return_code == 0:
                 self.progress_signal.emit(100)  # 完了時は100%
                 self.log_signal.emit("1pass解析完了")
-                self.finished_signal.emit(True, "1pass_analysis_completed", "")
+                if cache_key and cache.store(cache_key, self.workspace.passlog_prefix):
+                    self.log_signal.emit("📦 1pass統計をキャッシュに保存しました")
+                self.finished_signal.emit(True, self.workspace.passlog_prefix, "")
             else:
                 self.log_signal.emit(f"1pass解析失敗: 終了コード {return_code}")
                 self.finished_signal.emit(False, "", f"終了コード: {return_code}")
@@ -4636,6 +8385,435 @@ class FirstPassThread(QThread):
         except Exception as e:
             self.log_signal.emit(f"1pass解析エラー: {e}")
             self.finished_signal.emit(False, "", str(e))
+        finally:
+            if token is not None:
+                allocator.unregister(token)
+
+# 複雑度解析用のスレッドクラス（サイズ推定の精度向上用）
+class ComplexityAnalysisThread(QThread):
+    log_signal = pyqtSignal(str)
+    finished_signal = pyqtSignal(str, object)  # file_path, ComplexityProfile（失敗時None）
+    
+    def __init__(self, video_file_path, total_duration, sample_frames=False):
+        super().__init__()
+        self.video_file_path = video_file_path
+        self.total_duration = total_duration
+        self.sample_frames = sample_frames
+        self._should_stop = False
+        self.analyzer = None
+    
+    def stop(self):
+        """スレッドを停止"""
+        self._should_stop = True
+        if self.analyzer and self.analyzer.process:
+            try:
+                self.analyzer.process.kill()
+            except:
+                pass
+    
+    def run(self):
+        try:
+            # 保存済みのプロファイルがあれば再利用
+            cache_path = PacketComplexityAnalyzer.cache_path(self.video_file_path, self.sample_frames)
+            if os.path.exists(cache_path):
+                profile = ComplexityProfile.load(cache_path)
+                self.log_signal.emit("📈 複雑度プロファイルをキャッシュから読み込みました")
+                self.finished_signal.emit(self.video_file_path, profile)
+                return
+            
+            start_time = time.time()
+            self.analyzer = PacketComplexityAnalyzer(self.video_file_path, self.total_duration, lambda: self._should_stop)
+            profile = self.analyzer.analyze(sample_frames=self.sample_frames)
+            
+            if profile is None:
+                self.finished_signal.emit(self.video_file_path, None)
+                return
+            
+            profile.save(cache_path)
+            self.log_signal.emit(f"📈 複雑度解析完了 ({time.time() - start_time:.1f}秒): "
+                                 f"平均 {profile.mean_kbps():.0f} kbps / 90%点 {profile.percentile_kbps(90):.0f} kbps / "
+                                 f"複雑度係数 {profile.complexity_factor():.2f}")
+            self.finished_signal.emit(self.video_file_path, profile)
+            
+        except Exception as e:
+            self.log_signal.emit(f"複雑度解析エラー: {e}")
+            self.finished_signal.emit(self.video_file_path, None)
+
+class SizeCalibrationThread(QThread):
+    """
+    CRF方式のサイズ推定を校正するバックグラウンドのサンプルエンコード
+
+    数か所の短いサンプルを、いくつかのCRF/スケールで優先度を下げたFFmpegでエンコードし、
+    実測ビットレートからファイル専用のRateCurveを作る。結果はファイル内容ごとに保存する。
+    """
+    log_signal = pyqtSignal(str)
+    finished_signal = pyqtSignal(str, object)  # file_path, RateCurve（失敗時None）
+
+    CALIBRATION_POINTS = ((18, 1.0), (28, 1.0), (23, 0.5))  # (CRF, スケール)
+    SAMPLE_COUNT = 3
+    SAMPLE_SECONDS = 2.0
+
+    def __init__(self, video_file_path, total_duration, speed_preset=DEFAULT_SPEED_PRESET, tune=''):
+        super().__init__()
+        self.video_file_path = video_file_path
+        self.total_duration = total_duration
+        self.speed_preset = speed_preset
+        self.tune = tune
+        self._should_stop = False
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """スレッドを停止（実行中のサンプルエンコードを終了）"""
+        self._should_stop = True
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.kill()
+            except:
+                pass
+
+    def run(self):
+        try:
+            # 保存済みの校正結果があれば再利用
+            cache_path = RateCurve.cache_path(self.video_file_path, encoder_profile_text(self.speed_preset, self.tune))
+            if os.path.exists(cache_path):
+                curve = RateCurve.load(cache_path)
+                self.log_signal.emit("📐 サイズ推定の校正結果をキャッシュから読み込みました")
+                self.finished_signal.emit(self.video_file_path, curve)
+                return
+
+            start_time = time.time()
+            samples = plan_sample_segments(self.total_duration, self.SAMPLE_COUNT, 1.0,
+                                           self.SAMPLE_SECONDS, self.SAMPLE_SECONDS)
+            if not samples:
+                self.finished_signal.emit(self.video_file_path, None)
+                return
+            sample_seconds = sum(length for _, length in samples)
+
+            with JobWorkspace('clipitbro_calibration_') as workspace:
+                tasks = [(crf, scale, index, start, length)
+                         for crf, scale in self.CALIBRATION_POINTS
+                         for index, (start, length) in enumerate(samples)]
+                # 変換の邪魔をしないよう、1プロセス1スレッドでCPUの半分までに抑える
+                workers = max(1, min(len(tasks), (os.cpu_count() or 1) // 2))
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    sizes = list(executor.map(lambda task: self.encode_sample(workspace, *task), tasks))
+                if self._should_stop or None in sizes:
+                    self.finished_signal.emit(self.video_file_path, None)
+                    return
+
+            points = []
+            for crf, scale in self.CALIBRATION_POINTS:
+                total_bytes = sum(size for (c, s, *_), size in zip(tasks, sizes) if (c, s) == (crf, scale))
+                points.append((crf, scale, total_bytes * 8 / 1000 / sample_seconds))
+            curve = RateCurve.fit(points)
+            if curve is None:
+                self.finished_signal.emit(self.video_file_path, None)
+                return
+
+            curve.save(cache_path)
+            measured = ' / '.join(f"CRF{crf} x{scale}: {kbps:.0f} kbps" for crf, scale, kbps in points)
+            self.log_signal.emit(f"📐 サイズ推定の校正完了 ({time.time() - start_time:.1f}秒): {measured}")
+            self.finished_signal.emit(self.video_file_path, curve)
+
+        except Exception as e:
+            self.log_signal.emit(f"サイズ推定の校正エラー: {e}")
+            self.finished_signal.emit(self.video_file_path, None)
+
+    def encode_sample(self, workspace, crf, scale, index, start, length):
+        """1サンプルをCRF方式と同じ設定でエンコードしてバイト数を返す（失敗時None）"""
+        if self._should_stop:
+            return None
+        sample_path = workspace.file_path(f'calib_crf{crf}_x{scale}_{index:02d}.mkv')
+        cmd = [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y', '-v', 'error',
+            '-threads', '1',
+            '-ss', f'{start:.6f}',
+            '-i', self.video_file_path,
+            '-t', f'{length:.6f}',
+            '-map', '0:v:0',
+            '-an', '-sn', '-dn',
+            '-vf', f'scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2',
+            '-c:v', 'libx264',
+        ] + build_encoder_args('libx264', self.speed_preset, self.tune) + build_frame_rate_args() + [
+            '-threads', '1',
+            '-crf', str(crf),
+            '-f', 'matroska', sample_path,
+        ]
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   env=get_ffmpeg_env(), **get_low_priority_kwargs())
+        lower_process_priority(process)
+        with self._lock:
+            self._processes.add(process)
+        try:
+            if process.wait() != 0:
+                return None
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        return os.path.getsize(sample_path)
+
+# トリミング（変換前の切り出し）用のスレッドクラス
+class SmartTrimThread(QThread):
+    log_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(float)
+    finished_signal = pyqtSignal(bool, str, str)  # success, trimmed_path, error_message
+    
+    def __init__(self, video_file_path, start, end, work_dir):
+        super().__init__()
+        self.video_file_path = video_file_path
+        self.start_time = start
+        self.end_time = end
+        self.work_dir = work_dir
+        self.trimmed_path = os.path.join(work_dir, 'trimmed.mkv')
+        self._should_stop = False
+        self.trimmer = None
+    
+    def stop(self):
+        """スレッドを停止"""
+        self._should_stop = True
+        if self.trimmer and self.trimmer.process:
+            try:
+                self.trimmer.process.terminate()
+            except:
+                pass
+    
+    def run(self):
+        try:
+            started = time.time()
+            self.log_signal.emit(f"✂ トリミング開始: {format_timecode(self.start_time)} 〜 {format_timecode(self.end_time)}")
+            self.trimmer = SmartTrimmer(self.video_file_path, self.start_time, self.end_time,
+                                        lambda: self._should_stop, self.progress_signal.emit)
+            segments = self.trimmer.run(self.trimmed_path, self.work_dir)
+            
+            copied = sum(end - start for kind, start, end, _ in segments if kind == 'copy')
+            encoded = sum(end - start for kind, start, end, _ in segments if kind == 'encode')
+            self.log_signal.emit(f"✂ トリミング完了 ({time.time() - started:.1f}秒): "
+                                 f"コピー {copied:.2f}秒 / 再エンコード {encoded:.2f}秒")
+            self.finished_signal.emit(True, self.trimmed_path, "")
+            
+        except (SmartTrimError, MediaProbeError) as e:
+            self.log_signal.emit(f"トリミング失敗: {e}")
+            self.finished_signal.emit(False, "", str(e))
+        except Exception as e:
+            self.log_signal.emit(f"トリミングエラー: {e}")
+            self.finished_signal.emit(False, "", str(e))
+
+class AudioTrack:
+    """
+    変換の音声を映像とは別の工程で1回だけ作成（結合時にストリームコピーする）
+
+    再エンコードする音声はAudioTrackCacheから復元し、無ければエンコードしてキャッシュに保存する。
+    コピーの場合は取り出すだけなのでキャッシュしない。
+    """
+
+    def __init__(self, video_file, audio_plan, work_dir, trim_range=None):
+        self.video_file = video_file
+        self.audio_plan = audio_plan
+        self.trim_range = trim_range
+        self.prefix = os.path.join(work_dir, 'audio')
+        # PassStatsCacheの保存形式（プレフィックス-*）に合わせる。.m4a（iPod形式）はMP3をコピーできないためMP4で書き出す
+        self.path = self.prefix + '-track.mp4'
+        self.from_cache = False
+        self.elapsed = 0.0
+        self.process = None
+        self._stopped = False
+        self.cache = get_audio_track_cache() if audio_plan.mode == 'encode' else None
+        self.cache_key = AudioTrackCache.make_key(video_file, trim_range, audio_plan) if self.cache else None
+
+    def command(self):
+        """音声だけを取り出す（エンコードする）コマンド（使わないトラックはデコードしない）"""
+        return [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y',
+        ] + build_input_args(self.video_file, self.trim_range) + self.audio_plan.map_args() + [
+            '-vn', '-sn', '-dn',
+        ] + self.audio_plan.ffmpeg_args() + [
+            '-f', 'mp4', self.path
+        ]
+
+    def restore(self):
+        """キャッシュから復元（ヒットした場合True）"""
+        self.from_cache = bool(self.cache_key and self.cache.restore(self.cache_key, self.prefix))
+        return self.from_cache
+
+    def store(self):
+        if self.cache_key:
+            self.cache.store(self.cache_key, self.prefix)
+
+    def run(self):
+        """
+        キャッシュからの復元またはエンコードを実行（ワーカースレッドから呼ぶ）
+
+        Returns:
+            tuple: (成功したか, エラーメッセージ)
+        """
+        start = time.time()
+        if self.restore():
+            self.elapsed = time.time() - start
+            return True, ""
+        self.process = subprocess.Popen(
+            self.command(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            env=get_ffmpeg_env(),
+            **get_hidden_window_kwargs()
+        )
+        if self._stopped:
+            self.process.terminate()
+        _, stderr = self.process.communicate()
+        return_code = self.process.returncode
+        self.elapsed = time.time() - start
+        if self._stopped:
+            return False, "変換が停止されました"
+        if return_code != 0:
+            tail = stderr.decode('utf-8', 'replace').strip().splitlines()[-1:] if stderr else []
+            return False, f"音声: 終了コード {return_code} {' / '.join(tail)}"
+        self.store()
+        return True, ""
+
+    def stop(self):
+        self._stopped = True
+        if self.process:
+            try:
+                self.process.terminate()
+            except Exception:
+                pass
+
+    def size_bytes(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def kbps(self, duration):
+        """作成した音声の実際のビットレート（コンテナ分を含む）"""
+        return self.size_bytes() * 8 / 1000 / duration if duration > 0 else 0
+
+    def describe(self):
+        source = "キャッシュから復元" if self.from_cache else f"{self.elapsed:.1f}秒"
+        return f"{self.audio_plan.describe()}, {self.size_bytes() / 1024:.0f}KB ({source})"
+
+    @staticmethod
+    def mux_command(video_path, audio_path, output_path):
+        """映像と音声をストリームコピーで結合するコマンド"""
+        return [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y',
+            '-i', video_path,
+            '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a',
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            output_path
+        ]
+
+def correct_bitrate_for_size(video_kbps, output_bytes, size_cap_bytes, duration, audio_kbps=128, safety=0.97):
+    """
+    出力サイズ（実測または予測）の超過分から動画ビットレートを補正（kbps）
+
+    音声分は固定とみなし、動画分のバイト数が上限×safetyに収まるようにビットレートを比例縮小する。
+    """
+    audio_bytes = audio_kbps * 1000 / 8 * duration
+    output_video = max(1.0, output_bytes - audio_bytes)
+    budget_video = max(1.0, size_cap_bytes * safety - audio_bytes)
+    return max(100, int(video_kbps * budget_video / output_video))
+
+class OutputSizeMonitor:
+    """
+    エンコード中の出力サイズの監視と最終サイズの予測
+
+    FFmpegの進捗行のsize=（無ければ出力ファイルのサイズ）と変換済みのメディア時間を記録し、
+    これまでの平均で残りを外挿して最終サイズを予測する。複雑度プロファイル（元動画の秒ごとの
+    ビットレート）があれば、時間の代わりに元動画のビット量で残りの重みを付ける。
+    予測の95%区間は区間ごとのビットレートのばらつきから求め、下限が上限サイズを超えた
+    （ほぼ確実に超過する）場合にshould_abortがTrueになる。
+    """
+
+    Z = 1.96
+    MIN_FRACTION = 0.1  # 予測を使い始める進行度
+    MIN_SEGMENTS = 3  # 予測に必要な区間数
+    SEGMENT_SECONDS = 1.0  # 区間ビットレートを求める間隔（メディア時間）
+    CONTAINER_OVERHEAD = 0.005  # 変換終了時に書かれるインデックス（moov等）の割合
+    SAFETY = 0.97  # 補正ビットレートで上限サイズに対して残す余裕
+
+    def __init__(self, size_cap_bytes, total_duration, audio_kbps=128, weights=None):
+        self.size_cap_bytes = size_cap_bytes
+        self.total_duration = total_duration
+        self.audio_kbps = audio_kbps
+        self.times = [0.0]
+        self.written = [0]
+        # 秒ごとの重み（元動画のビットレート）の累積。無い場合は時間そのもの
+        self._weight_edges = None
+        if weights is not None and len(weights) and float(np.sum(weights)) > 0:
+            self._weight_edges = np.concatenate(([0.0], np.cumsum(np.maximum(weights, 1e-6))))
+
+    def _work(self, seconds):
+        """メディア時間までの累積の重み"""
+        if self._weight_edges is None:
+            return np.asarray(seconds, dtype=np.float64)
+        edges_t = np.arange(len(self._weight_edges), dtype=np.float64)
+        return np.interp(seconds, edges_t, self._weight_edges)
+
+    def add_sample(self, media_time, written_bytes):
+        """進捗（メディア時間, 出力済みバイト数）を記録"""
+        if media_time > self.times[-1] and written_bytes >= self.written[-1]:
+            self.times.append(float(media_time))
+            self.written.append(int(written_bytes))
+
+    def fraction(self):
+        return min(1.0, self.times[-1] / self.total_duration) if self.total_duration > 0 else 0.0
+
+    def projection(self):
+        """
+        最終サイズの予測
+
+        Returns:
+            tuple: (予測バイト数, 95%区間の下限, 上限)。データが足りない場合はNone
+        """
+        elapsed = self.times[-1]
+        if self.total_duration <= 0 or self.fraction() < self.MIN_FRACTION:
+            return None
+        boundaries = np.arange(0.0, elapsed + 1e-9, self.SEGMENT_SECONDS)
+        if len(boundaries) <= self.MIN_SEGMENTS:
+            return None
+        written_at = np.interp(boundaries, self.times, self.written)
+        work_at = self._work(boundaries)
+        rates = np.diff(written_at) / np.maximum(np.diff(work_at), 1e-9)  # 重み1単位あたりのバイト数
+
+        done_work = float(self._work(elapsed))
+        remaining_work = max(0.0, float(self._work(self.total_duration)) - done_work)
+        mean_rate = self.written[-1] / max(done_work, 1e-9)
+        segment_work = done_work / len(rates)
+        # 残りの区間ごとのばらつきと、平均自体の不確かさ
+        sigma = float(np.std(rates, ddof=1)) * math.sqrt(remaining_work * segment_work + remaining_work ** 2 / len(rates))
+        overhead = 1 + self.CONTAINER_OVERHEAD
+        projected = (self.written[-1] + mean_rate * remaining_work) * overhead
+        return projected, max(self.written[-1], projected - self.Z * sigma * overhead), projected + self.Z * sigma * overhead
+
+    def should_abort(self):
+        """予測の下限が上限サイズを超えたか"""
+        projection = self.projection()
+        return projection is not None and projection[1] > self.size_cap_bytes
+
+    def corrected_bitrate(self, video_kbps):
+        """予測サイズの超過分から補正した動画ビットレート（kbps）"""
+        projection = self.projection()
+        if projection is None:
+            return video_kbps
+        return correct_bitrate_for_size(video_kbps, projection[0], self.size_cap_bytes, self.total_duration,
+                                        self.audio_kbps, self.SAFETY)
+
+    def describe(self):
+        projection = self.projection()
+        if projection is None:
+            return "予測なし"
+        to_mb = lambda size: size / (1024 * 1024)
+        return (f"予測 {to_mb(projection[0]):.2f}MB (95%区間 {to_mb(projection[1]):.2f}〜{to_mb(projection[2]):.2f}MB)"
+                f" / 上限 {to_mb(self.size_cap_bytes):.2f}MB")
 
 # 2pass変換用のスレッドクラス（1pass+2passを連続実行）
 class TwoPassConversionThread(QThread):
@@ -4644,14 +8822,41 @@ class TwoPassConversionThread(QThread):
     phase_signal = pyqtSignal(int)  # 1=1pass目, 2=2pass目
     finished_signal = pyqtSignal(bool, str, str)  # success, output_path, error_message
     
-    def __init__(self, video_file_path, output_path, target_bitrate, total_duration, second_pass_only=False, use_h265=False):
+    MAX_SIZE_ATTEMPTS = 4  # 出力サイズの上限を守るために2pass目を実行する最大回数（初回を含む）
+    
+    def __init__(self, video_file_path, output_path, target_bitrate, total_duration, second_pass_only=False, use_h265=False,
+                 trim_range=None, workspace=None, speed_preset=DEFAULT_SPEED_PRESET, tune='', size_cap_bytes=None,
+                 complexity_profile=None, audio_plan=None, output_fps=None):
         super().__init__()
         self.video_file_path = video_file_path
         self.output_path = output_path
         self.target_bitrate = target_bitrate
-        self.total_duration = total_duration
+        self.total_duration = total_duration  # トリミング時は範囲の長さ
         self.second_pass_only = second_pass_only
         self.use_h265 = use_h265
+        self.trim_range = trim_range  # 両passで同じ範囲を入力シークする
+        self.speed_preset = speed_preset
+        self.tune = tune
+        self.output_fps = output_fps  # 固定フレームレートにする場合のfps（Noneはタイムスタンプを維持）
+        # passログの保存先。指定されない場合はジョブ専用に作成し、終了時に削除する
+        # （2pass目のみ実行する場合は1pass目と同じworkspaceが必要）
+        self.workspace = workspace
+        # 出力サイズの上限（バイト）。指定された場合は2pass目の出力を監視し、超過しそう・超過した場合は
+        # ビットレートを補正して2pass目だけやり直す（1pass目の統計はそのまま使う）
+        self.size_cap_bytes = size_cap_bytes
+        self.complexity_profile = complexity_profile  # 監視の予測で残りの重み付けに使う
+        self.audio_plan = audio_plan or AudioPlan.default()  # 音声（BitBudgetの配分）
+        # 音声は1pass目と並行して別工程で作成し、2pass目（映像のみ）の後にストリームコピーで結合する
+        self.audio_track = None
+        self.pass2_output = output_path  # 2pass目の出力（音声を結合する場合は作業ディレクトリ内）
+        self.audio_size_bytes = 0  # 結合した音声の実際のバイト数（作業ディレクトリの削除後も履歴に使う）
+        self.final_bitrate = target_bitrate  # 実際に出力した2pass目の動画ビットレート
+        # 2pass目の各回の記録（bitrate, elapsed, output_bytes, aborted_at, projected_bytes）
+        self.attempts = []
+        self._size_abort = None  # 監視による中断時のOutputSizeMonitor
+        self.process = None  # 実行中のプロセス参照
+        self._should_stop = False  # 停止フラグ
+        self._thread_token = None  # ThreadAllocatorのトークン
         
         # 環境変数設定
         self.env = os.environ.copy()
@@ -4659,9 +8864,48 @@ class TwoPassConversionThread(QThread):
         if os.name == 'nt':
             self.env['LANG'] = 'ja_JP.UTF-8'
     
+    def stop(self):
+        """スレッドを停止"""
+        self._should_stop = True
+        if self.audio_track:
+            self.audio_track.stop()
+        if self.process:
+            try:
+                self.process.terminate()
+            except:
+                pass
+    
     def run(self):
+        own_workspace = self.workspace is None
+        if own_workspace:
+            # passログに加えて2pass目の映像と音声も置くため、出力サイズ分の容量も見込む
+            try:
+                record, _ = MediaProbe.probe_cached(self.video_file_path)
+            except MediaProbeError:
+                record = None
+            required_bytes = JobWorkspace.estimate_passlog_bytes(record, self.total_duration)
+            required_bytes += int((self.target_bitrate + self.audio_plan.bitrate_kbps) * 1000 / 8 * self.total_duration)
+            self.workspace = JobWorkspace('clipitbro_2pass_', required_bytes)
+        # CPUの割り当ては各passの開始時に取り直す（他のジョブの開始・終了を反映するため）
+        allocator = get_thread_allocator()
+        self._thread_token = allocator.register()
+        audio_executor = None
+        audio_future = None
         try:
             ffmpeg_path = get_ffmpeg_executable_path('ffmpeg.exe')
+            self.log_signal.emit(f"📁 作業ディレクトリ ({self.workspace.describe()})")
+            
+            # === 音声（1pass目と並行して1回だけ作成） ===
+            # 配分が分からず既定の計画を渡された場合も、音声の無い入力では映像だけを出力する
+            record, _ = MediaProbe.probe_cached(self.video_file_path)
+            if not record.audio_streams():
+                self.audio_plan = AudioPlan('none')
+            if self.audio_plan.mode != 'none':
+                self.audio_track = AudioTrack(self.video_file_path, self.audio_plan, self.workspace.path, self.trim_range)
+                self.pass2_output = self.workspace.file_path('video_pass2.mp4')
+                audio_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                audio_future = audio_executor.submit(self.audio_track.run)
+                self.log_signal.emit(f"🔊 音声を並行して作成: {self.audio_plan.describe()}")
             
             if not self.second_pass_only:
                 # === 1pass目実行 ===
@@ -4672,14 +8916,22 @@ class TwoPassConversionThread(QThread):
                 video_codec = 'libx265' if self.use_h265 else 'libx264'
                 codec_name = 'H.265 (HEVC)' if self.use_h265 else 'H.264 (x264)'
                 self.log_signal.emit(f"📹 使用コーデック: {codec_name}")
+                allocation = allocator.allocation(self._thread_token)
+                self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()}")
+                codec_params = dict(first_pass_codec_params(video_codec), **allocation.codec_params(video_codec))
+                filter_args = build_frame_rate_args(self.output_fps)
                 
                 cmd1 = [
                     ffmpeg_path,
                     '-y',
-                    '-i', self.video_file_path,
+                ] + allocation.input_args() + build_input_args(self.video_file_path, self.trim_range) + [
                     '-c:v', video_codec,
+                ] + build_encoder_args(video_codec, self.speed_preset, self.tune) + build_first_pass_args(video_codec) + (
+                    allocation.encoder_args() + build_codec_params_args(video_codec, codec_params)
+                ) + filter_args + [
                     '-b:v', f'{self.target_bitrate}k',
                     '-pass', '1',
+                    '-passlogfile', self.workspace.passlog_prefix,
                     '-f', 'null'
                 ]
                 
@@ -4688,9 +8940,19 @@ class TwoPassConversionThread(QThread):
                 else:
                     cmd1.append('/dev/null')
                 
-                # 1pass目実行
-                if not self.execute_pass(cmd1, 1):
-                    return
+                # 1pass目実行（キャッシュに統計があれば省略）
+                cache = get_pass_stats_cache()
+                cache_key = PassStatsCache.make_key(
+                    self.video_file_path, self.use_h265, self.trim_range, filter_chain=' '.join(filter_args),
+                    encoder_profile=encoder_profile_text(self.speed_preset, self.tune)) if cache else None
+                if cache_key and cache.restore(cache_key, self.workspace.passlog_prefix):
+                    self.progress_signal.emit(50)
+                    self.log_signal.emit("⚡ 1pass統計をキャッシュから復元しました（1pass目を省略）")
+                else:
+                    if not self.execute_pass(cmd1, 1):
+                        return
+                    if cache_key and cache.store(cache_key, self.workspace.passlog_prefix):
+                        self.log_signal.emit("📦 1pass統計をキャッシュに保存しました")
             
             # === 2pass目実行 ===
             self.phase_signal.emit(2)
@@ -4698,32 +8960,163 @@ class TwoPassConversionThread(QThread):
             
             # コーデック選択（2pass目でも同じコーデックを使用）
             video_codec = 'libx265' if self.use_h265 else 'libx264'
+            allocation = allocator.allocation(self._thread_token)
+            self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()}")
             
-            cmd2 = [
-                ffmpeg_path,
-                '-y',
-                '-i', self.video_file_path,
-                '-c:v', video_codec,
-                '-b:v', f'{self.target_bitrate}k',
-                '-pass', '2',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                self.output_path
-            ]
-            
-            # 2pass目実行
-            if not self.execute_pass(cmd2, 2):
-                return
-            
+            # 2pass目実行（上限を超えそう・超えた場合はビットレートを補正して2pass目だけやり直す）
+            bitrate = self.target_bitrate
+            while True:
+                last_attempt = len(self.attempts) + 1 >= self.MAX_SIZE_ATTEMPTS
+                monitor = None
+                if self.size_cap_bytes and not last_attempt:
+                    # 2pass目の出力は映像のみのため、上限から音声分を除いて監視する
+                    monitor = OutputSizeMonitor(self.size_cap_bytes - self.audio_bytes(audio_future), self.total_duration,
+                                                0, weights=self.monitor_weights())
+                cmd2 = self.build_second_pass_command(ffmpeg_path, video_codec, allocation, bitrate)
+                started = time.time()
+                attempt = {'bitrate': bitrate, 'output_bytes': None, 'aborted_at': None, 'projected_bytes': None}
+                self.attempts.append(attempt)
+                completed = self.execute_pass(cmd2, 2, monitor)
+                if completed and self.audio_track and not self.mux_audio(audio_future):
+                    return
+                attempt['elapsed'] = time.time() - started
+                
+                if completed:
+                    attempt['output_bytes'] = os.path.getsize(self.output_path)
+                    if not self.size_cap_bytes or attempt['output_bytes'] <= self.size_cap_bytes:
+                        break
+                    over_mb = (attempt['output_bytes'] - self.size_cap_bytes) / (1024 * 1024)
+                    if last_attempt:
+                        self.log_signal.emit(f"⚠️ {len(self.attempts)}回実行しても出力サイズが上限を {over_mb:.2f}MB 超えています")
+                        break
+                    audio_kbps = self.audio_track.kbps(self.total_duration) if self.audio_track else 0
+                    corrected = correct_bitrate_for_size(bitrate, attempt['output_bytes'], self.size_cap_bytes,
+                                                         self.total_duration, audio_kbps, OutputSizeMonitor.SAFETY)
+                    self.log_signal.emit(f"📏 出力サイズが上限を {over_mb:.2f}MB 超えました")
+                elif self._size_abort is not None:
+                    attempt['aborted_at'] = self._size_abort.fraction()
+                    attempt['projected_bytes'] = int(self._size_abort.projection()[0])
+                    corrected = self._size_abort.corrected_bitrate(bitrate)
+                else:
+                    return
+                
+                self.log_signal.emit(f"🔁 動画ビットレートを {bitrate} → {corrected} kbps に補正して2pass目をやり直します "
+                                     f"({len(self.attempts) + 1}/{self.MAX_SIZE_ATTEMPTS}回目)")
+                bitrate = self.final_bitrate = corrected
+                self.progress_signal.emit(50)
+            
+            if len(self.attempts) > 1:
+                extra = sum(attempt['elapsed'] for attempt in self.attempts[:-1])
+                self.log_signal.emit(f"📏 2pass目を{len(self.attempts)}回実行 "
+                                     f"(やり直し分の所要 合計{extra:.1f}秒, 最終 {bitrate} kbps)")
             self.log_signal.emit("2pass変換完了")
             self.finished_signal.emit(True, self.output_path, "")
             
         except Exception as e:
             self.log_signal.emit(f"2pass変換エラー: {e}")
             self.finished_signal.emit(False, self.output_path, str(e))
+        finally:
+            allocator.unregister(self._thread_token)
+            if audio_executor:
+                self.audio_track.stop()
+                audio_executor.shutdown(wait=True)
+            # 成功・失敗・停止のいずれでもジョブ専用のpassログを削除
+            if own_workspace:
+                self.workspace.cleanup()
+            elif self.audio_track:
+                # 1pass目と共有の作業ディレクトリには中間ファイルを残さない
+                for path in (self.audio_track.path, self.pass2_output):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+    
+    def audio_bytes(self, audio_future):
+        """出力に含まれる音声のバイト数（作成済みなら実際のサイズ、作成中は配分からの見込み）"""
+        if not self.audio_track:
+            return 0
+        if audio_future.done() and audio_future.result()[0]:
+            return self.audio_track.size_bytes()
+        return int(self.audio_plan.bytes_for(self.total_duration))
+    
+    def mux_audio(self, audio_future):
+        """2pass目の映像に作成済みの音声をストリームコピーで結合（失敗時はfinished_signalを出してFalse）"""
+        if not audio_future.done():
+            self.log_signal.emit("🔊 音声の作成を待っています...")
+        success, error = audio_future.result()
+        if self._should_stop:
+            self.finished_signal.emit(False, self.output_path, "変換が停止されました")
+            return False
+        if not success:
+            self.log_signal.emit(f"音声の作成に失敗しました: {error}")
+            self.finished_signal.emit(False, self.output_path, error)
+            return False
+        if not any(attempt['output_bytes'] for attempt in self.attempts):
+            self.log_signal.emit(f"🔊 音声: {self.audio_track.describe()}")
+        
+        result = subprocess.run(AudioTrack.mux_command(self.pass2_output, self.audio_track.path, self.output_path),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=self.env,
+                                **get_hidden_window_kwargs())
+        if result.returncode != 0:
+            tail = result.stderr.decode('utf-8', 'replace').strip().splitlines()[-1:]
+            self.log_signal.emit(f"音声の結合に失敗しました: {' / '.join(tail)}")
+            self.finished_signal.emit(False, self.output_path, f"結合失敗: 終了コード {result.returncode}")
+            return False
+        self.audio_size_bytes = self.audio_track.size_bytes()
+        self.log_signal.emit("🔗 映像と音声を結合しました（再エンコードなし）")
+        return True
+    
+    def attempt_summary(self):
+        """
+        変換履歴に保存する2pass目の実行記録（初回のビットレートと出力・予測サイズ、回数、やり直しの所要秒、音声のバイト数）
+
+        監視で中断した回の予測は映像のみのサイズなので、完了した回（結合後）と揃えて音声を含むサイズにする。
+        """
+        if not self.attempts:
+            return None
+        first = self.attempts[0]
+        first_output_bytes = first['output_bytes']
+        if not first_output_bytes and first['projected_bytes']:
+            first_output_bytes = first['projected_bytes'] + self.audio_size_bytes
+        return {
+            'video_kbps': first['bitrate'],
+            'first_output_bytes': first_output_bytes,
+            'audio_bytes': self.audio_size_bytes,
+            'attempts': len(self.attempts),
+            'attempt_seconds': sum(attempt.get('elapsed', 0) for attempt in self.attempts[:-1]),
+        }
+    
+    def build_second_pass_command(self, ffmpeg_path, video_codec, allocation, bitrate):
+        """2pass目のコマンドを作成"""
+        return [
+            ffmpeg_path,
+            '-y',
+        ] + allocation.input_args() + build_input_args(self.video_file_path, self.trim_range) + [
+            '-c:v', video_codec,
+        ] + build_encoder_args(video_codec, self.speed_preset, self.tune) + allocation.encoder_args() + (
+            build_codec_params_args(video_codec, allocation.codec_params(video_codec))
+        ) + build_frame_rate_args(self.output_fps) + [
+            '-b:v', f'{bitrate}k',
+            '-pass', '2',
+            '-passlogfile', self.workspace.passlog_prefix,
+            '-an',  # 音声は別工程で作成して結合する
+            self.pass2_output
+        ]
+    
+    def monitor_weights(self):
+        """出力サイズの予測に使う秒ごとの重み（変換範囲の元動画の動画ビットレート）"""
+        if self.complexity_profile is None:
+            return None
+        start, end = self.trim_range if self.trim_range else (0, None)
+        return self.complexity_profile.kbps_per_second(start, end)
     
-    def execute_pass(self, cmd, pass_number):
-        """指定されたpassを実行"""
+    def execute_pass(self, cmd, pass_number, monitor=None):
+        """
+        指定されたpassを実行
+        
+        monitorを指定した場合は出力サイズを記録し、上限の超過が確実になった時点でプロセスを停止する
+        （この場合はfinished_signalを出さずにFalseを返し、self._size_abortにmonitorを設定する）
+        """
         try:
             import re
             
@@ -4734,7 +9127,11 @@ class TwoPassConversionThread(QThread):
                 startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
                 startupinfo.wShowWindow = subprocess.SW_HIDE
             
-            process = subprocess.Popen(
+            if self._should_stop:
+                self.finished_signal.emit(False, self.output_path, "変換が停止されました")
+                return False
+            
+            process = self.process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
@@ -4746,8 +9143,10 @@ class TwoPassConversionThread(QThread):
                 startupinfo=startupinfo,  # ウィンドウ非表示設定を追加
                 creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0  # 追加の非表示フラグ
             )
+            get_thread_allocator().attach_process(self._thread_token, process)
             
             current_time = 0
+            self._size_abort = None
             while True:
                 output = process.stdout.readline()
                 if output == '' and process.poll() is not None:
@@ -4778,21 +9177,1725 @@ class TwoPassConversionThread(QThread):
                         # 進行状況をログに出力（頻度を制限）
                         if int(pass_progress) % 20 == 0:
                             self.log_signal.emit(f"{pass_number}pass進行状況: {pass_progress:.1f}% (全体: {progress_percent:.1f}%)")
+                            if monitor is not None and monitor.projection() is not None:
+                                self.log_signal.emit(f"📏 出力サイズ{monitor.describe()}")
+                        
+                        if monitor is not None and self._size_abort is None:
+                            monitor.add_sample(current_time, self.parse_written_bytes(output))
+                            if monitor.should_abort():
+                                self._size_abort = monitor
+                                self.log_signal.emit(f"⏹ 出力サイズが上限を超える見込みのため2pass目を中断します "
+                                                     f"(進行 {pass_progress:.0f}%, {monitor.describe()})")
+                                try:
+                                    process.terminate()
+                                except Exception:
+                                    pass
             
             return_code = process.wait()
+            self.process = None
             
-            if return_code == 0:
+            if self._size_abort is not None and not self._should_stop:
+                return False
+            if self._should_stop:
+                self.log_signal.emit(f"{pass_number}pass目が停止されました")
+                self.finished_signal.emit(False, self.output_path, "変換が停止されました")
+                return False
+            elif return_code == 0:
                 self.log_signal.emit(f"{pass_number}pass目完了")
                 return True
             else:
-                self.log_signal.emit(f"{pass_number}pass目失敗: 終了コード {return_code}")
-                self.finished_signal.emit(False, self.output_path, f"{pass_number}pass目失敗: 終了コード {return_code}")
-                return False
-                
+                self.log_signal.emit(f"{pass_number}pass目失敗: 終了コード {return_code}")
+                self.finished_signal.emit(False, self.output_path, f"{pass_number}pass目失敗: 終了コード {return_code}")
+                return False
+                
+        except Exception as e:
+            self._size_abort = None
+            self.log_signal.emit(f"{pass_number}pass目エラー: {e}")
+            self.finished_signal.emit(False, self.output_path, str(e))
+            return False
+    
+    def parse_written_bytes(self, output):
+        """進捗行のsize=から出力済みバイト数を取得（無い場合は2pass目の出力ファイルのサイズ）"""
+        import re
+        match = re.search(r'size=\s*(\d+)\s*(KiB|kB|MiB|mB|B)', output)
+        if match:
+            unit = {'KiB': 1024, 'kB': 1024, 'MiB': 1024 * 1024, 'mB': 1024 * 1024, 'B': 1}[match.group(2)]
+            return int(match.group(1)) * unit
+        try:
+            return os.path.getsize(self.pass2_output)
+        except OSError:
+            return 0
+
+# 分割並列2pass変換用のスレッドクラス（キーフレーム単位の区間を並列エンコードして結合）
+class ChunkedTwoPassConversionThread(QThread):
+    log_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(float)
+    phase_signal = pyqtSignal(int)  # 1=1pass目, 2=2pass目
+    finished_signal = pyqtSignal(bool, str, str)  # success, output_path, error_message
+    
+    MAX_CHUNKS = 16  # 分割数の上限
+    MIN_CHUNK_SECONDS = 5.0  # 1区間の最短の長さ
+    
+    def __init__(self, video_file_path, output_path, target_bitrate, total_duration, use_h265=False,
+                 chunk_count=None, complexity_profile=None, trim_range=None, speed_preset=DEFAULT_SPEED_PRESET, tune='',
+                 audio_plan=None, output_fps=None):
+        super().__init__()
+        self.video_file_path = video_file_path
+        self.output_path = output_path
+        self.target_bitrate = target_bitrate
+        self.total_duration = total_duration  # トリミング時は範囲の長さ
+        self.use_h265 = use_h265
+        self.complexity_profile = complexity_profile
+        self.trim_range = trim_range
+        self.speed_preset = speed_preset
+        self.tune = tune
+        self.audio_plan = audio_plan or AudioPlan.default()  # 音声（BitBudgetの配分）
+        self.output_fps = output_fps  # 固定フレームレートにする場合のfps（Noneはタイムスタンプを維持）
+        # 省略時は実行開始時に割り当てられたCPU数から決める（1区間あたり2スレッド程度）
+        self.chunk_count = chunk_count
+        self.elapsed_seconds = 0.0
+        self._should_stop = False
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._pass_seconds = []
+        self._thread_token = None  # ThreadAllocatorのトークン
+    
+    def stop(self):
+        """スレッドを停止（実行中のすべてのFFmpegを終了）"""
+        self._should_stop = True
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.terminate()
+            except:
+                pass
+    
+    def run(self):
+        start_time = time.time()
+        # passログに加えて区間ごとの出力と音声も置くため、目標サイズ分の容量も見込む
+        try:
+            record, _ = MediaProbe.probe_cached(self.video_file_path)
+        except MediaProbeError:
+            record = None
+        required_bytes = JobWorkspace.estimate_passlog_bytes(record, self.total_duration)
+        required_bytes += int((self.target_bitrate + self.audio_plan.bitrate_kbps) * 1000 / 8 * self.total_duration)
+        workspace = JobWorkspace('clipitbro_chunks_', required_bytes)
+        work_dir = workspace.path
+        allocator = get_thread_allocator()
+        self._thread_token = allocator.register()
+        try:
+            self.phase_signal.emit(1)
+            self.log_signal.emit("=== 分割並列エンコード開始 ===")
+            codec_name = 'H.265 (HEVC)' if self.use_h265 else 'H.264 (x264)'
+            self.log_signal.emit(f"📹 使用コーデック: {codec_name}")
+            self.log_signal.emit(f"📁 作業ディレクトリ ({workspace.describe()})")
+            
+            # キーフレーム位置で区間を分割
+            # トリミング時は範囲内のキーフレームだけを読み、範囲の先頭を0秒として分割する
+            analyzer = PacketComplexityAnalyzer(self.video_file_path, self.total_duration, lambda: self._should_stop)
+            offset = self.trim_range[0] if self.trim_range else 0.0
+            if self.trim_range:
+                keyframes = [t - offset for t in analyzer.keyframe_times(*self.trim_range)]
+            else:
+                keyframes = analyzer.keyframe_times()
+            chunk_count = self.chunk_count or max(
+                1, min(self.MAX_CHUNKS, len(allocator.allocation(self._thread_token).cpus) // 2))
+            chunks = plan_keyframe_chunks(keyframes, self.total_duration, chunk_count, self.MIN_CHUNK_SECONDS)
+            if not chunks:
+                self.finished_signal.emit(False, self.output_path, "動画の長さが不明です")
+                return
+            # 以降は元ファイル上の時刻で扱う（入力シーク位置・複雑度プロファイル）
+            chunks = [(start + offset, end + offset) for start, end in chunks]
+            bitrates = allocate_chunk_bitrates(chunks, self.target_bitrate, self.complexity_profile)
+            self.log_signal.emit(f"✂ {len(chunks)}区間に分割 (キーフレーム {len(keyframes)}個)")
+            for i, ((start, end), bitrate) in enumerate(zip(chunks, bitrates)):
+                self.log_signal.emit(f"  区間{i + 1}: {start:.2f}s - {end:.2f}s ({bitrate} kbps)")
+            
+            record, _ = MediaProbe.probe_cached(self.video_file_path)
+            has_audio = bool(record.audio_streams()) and self.audio_plan.mode != 'none'
+            audio_track = AudioTrack(self.video_file_path, self.audio_plan, work_dir, self.trim_range)
+            chunk_paths = [os.path.join(work_dir, f'chunk_{i:03d}.mp4') for i in range(len(chunks))]
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(chunks) + 1) as executor:
+                # === 1pass目（全区間を並列実行、音声も同時にエンコード） ===
+                # ジョブに割り当てられたCPUを区間ごとに分ける（passごとに取り直して再配分を反映）
+                self._pass_seconds = [0.0] * len(chunks)
+                chunk_allocations = self.split_allocation(allocator, len(chunks))
+                futures = [
+                    executor.submit(self.encode_chunk, 1, i, start, end, bitrate, chunk_allocations[i], work_dir, chunk_paths[i])
+                    for i, ((start, end), bitrate) in enumerate(zip(chunks, bitrates))
+                ]
+                if has_audio:
+                    futures.append(executor.submit(self.encode_audio, audio_track))
+                if not self.wait_all(futures, 1):
+                    return
+                if has_audio:
+                    self.log_signal.emit(f"🔊 音声: {audio_track.describe()}")
+                
+                # === 2pass目 ===
+                self.phase_signal.emit(2)
+                self.log_signal.emit("=== 2pass目開始 ===")
+                self._pass_seconds = [0.0] * len(chunks)
+                chunk_allocations = self.split_allocation(allocator, len(chunks))
+                futures = [
+                    executor.submit(self.encode_chunk, 2, i, start, end, bitrate, chunk_allocations[i], work_dir, chunk_paths[i])
+                    for i, ((start, end), bitrate) in enumerate(zip(chunks, bitrates))
+                ]
+                if not self.wait_all(futures, 2):
+                    return
+            
+            # === 再エンコードなしで結合 ===
+            self.log_signal.emit("🔗 区間を結合中...")
+            list_path = os.path.join(work_dir, 'concat.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for path in chunk_paths:
+                    escaped = path.replace("'", "'\\''")
+                    f.write(f"file '{escaped}'\n")
+            
+            cmd = [get_ffmpeg_executable_path('ffmpeg.exe'), '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+            if has_audio:
+                cmd += ['-i', audio_track.path, '-map', '0:v', '-map', '1:a']
+            cmd += ['-c', 'copy', '-movflags', '+faststart', self.output_path]
+            return_code, tail = self.run_process(cmd)
+            if return_code != 0:
+                self.log_signal.emit(f"結合失敗: {tail}")
+                self.finished_signal.emit(False, self.output_path, f"結合失敗: 終了コード {return_code}")
+                return
+            
+            self.elapsed_seconds = time.time() - start_time
+            speed = self.total_duration / self.elapsed_seconds if self.elapsed_seconds > 0 else 0
+            self.progress_signal.emit(100)
+            self.log_signal.emit(f"分割並列2pass変換完了 ({self.elapsed_seconds:.1f}秒, 再生速度の{speed:.1f}倍)")
+            self.finished_signal.emit(True, self.output_path, "")
+            
+        except Exception as e:
+            self.log_signal.emit(f"分割並列変換エラー: {e}")
+            self.finished_signal.emit(False, self.output_path, str(e))
+        finally:
+            allocator.unregister(self._thread_token)
+            workspace.cleanup()
+    
+    def split_allocation(self, allocator, count):
+        """ジョブのCPU割り当てを区間数で分割"""
+        allocation = allocator.allocation(self._thread_token)
+        chunk_allocations = allocation.split(count)
+        self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()} → 1区間あたり{chunk_allocations[0].encode_threads}スレッド")
+        return chunk_allocations
+    
+    def wait_all(self, futures, pass_number):
+        """全タスクの完了を待ち、失敗があれば残りを停止してFalseを返す"""
+        for future in concurrent.futures.as_completed(futures):
+            success, message = future.result()
+            if not success:
+                self.stop()
+                if not message:
+                    message = "変換が停止されました"
+                self.log_signal.emit(f"{pass_number}pass目失敗: {message}")
+                self.finished_signal.emit(False, self.output_path, message)
+                return False
+        self.log_signal.emit(f"{pass_number}pass目完了")
+        return True
+    
+    def encode_chunk(self, pass_number, index, start, end, bitrate, allocation, work_dir, chunk_path):
+        """1区間の指定passを実行（allocationは区間に割り当てたCPU）"""
+        if self._should_stop:
+            return False, ""
+        video_codec = 'libx265' if self.use_h265 else 'libx264'
+        codec_params = allocation.codec_params(video_codec)
+        if pass_number == 1:
+            codec_params = dict(first_pass_codec_params(video_codec), **codec_params)
+        cmd = [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y',
+        ] + allocation.input_args() + [
+            '-ss', f'{start:.6f}',
+            '-i', self.video_file_path,
+            '-t', f'{end - start:.6f}',
+            '-map', '0:v:0',
+            '-an', '-sn', '-dn',
+            '-c:v', video_codec,
+        ] + build_encoder_args(video_codec, self.speed_preset, self.tune) + allocation.encoder_args() + (
+            build_codec_params_args(video_codec, codec_params)
+        ) + build_frame_rate_args(self.output_fps) + [
+            '-b:v', f'{bitrate}k',
+            '-pass', str(pass_number),
+            '-passlogfile', os.path.join(work_dir, f'chunk_{index:03d}'),
+        ]
+        if pass_number == 1:
+            cmd += ['-f', 'null', 'NUL' if os.name == 'nt' else os.devnull]
+        else:
+            cmd += ['-f', 'mp4', chunk_path]
+        
+        def on_seconds(seconds):
+            self._pass_seconds[index] = min(seconds, end - start)
+            pass_progress = min(100, sum(self._pass_seconds) / self.total_duration * 100)
+            self.progress_signal.emit(pass_progress * 0.5 if pass_number == 1 else 50 + pass_progress * 0.5)
+        
+        return_code, tail = self.run_process(cmd, on_seconds)
+        if return_code != 0:
+            return False, "" if self._should_stop else f"区間{index + 1}: 終了コード {return_code} {tail}"
+        return True, ""
+    
+    def encode_audio(self, audio_track):
+        """音声を1回だけエンコード（キャッシュがあれば復元し、結合時にコピーする）"""
+        start = time.time()
+        if audio_track.restore():
+            return True, ""
+        return_code, tail = self.run_process(audio_track.command())
+        audio_track.elapsed = time.time() - start
+        if return_code != 0:
+            return False, "" if self._should_stop else f"音声: 終了コード {return_code} {tail}"
+        audio_track.store()
+        return True, ""
+    
+    def run_process(self, cmd, on_seconds=None):
+        """FFmpegを実行して (終了コード, 末尾の出力) を返す"""
+        import re
+        
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=get_ffmpeg_env(),
+            encoding='utf-8',
+            errors='replace',
+            universal_newlines=True,
+            **get_hidden_window_kwargs()
+        )
+        with self._lock:
+            self._processes.add(process)
+        get_thread_allocator().attach_process(self._thread_token, process)
+        tail = []
+        try:
+            for output in process.stdout:
+                time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})', output)
+                if time_match and on_seconds:
+                    hours, minutes, seconds, centiseconds = (int(g) for g in time_match.groups())
+                    on_seconds(hours * 3600 + minutes * 60 + seconds + centiseconds / 100)
+                elif output.strip():
+                    tail = (tail + [output.strip()])[-3:]
+            return process.wait(), ' / '.join(tail)
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+class CrfSearchConversionThread(QThread):
+    """
+    目標サイズをCRF探索で狙う変換（短いクリップ向け）
+
+    動画から数か所のサンプル区間を選び、候補CRFでのエンコードを並列に実行して
+    ビットレートを実測する。目標ビットレートを挟むまでCRFを絞り込み、
+    求めたCRFにVBV上限（-maxrate/-bufsize）を付けて1回だけ本番エンコードする。
+    """
+    log_signal = pyqtSignal(str)
+    progress_signal = pyqtSignal(float)
+    phase_signal = pyqtSignal(int)  # 1=CRF探索, 2=本番エンコード
+    finished_signal = pyqtSignal(bool, str, str)  # success, output_path, error_message
+
+    CRF_MIN = 10
+    CRF_MAX = 51
+    INITIAL_CRFS = (20, 30)  # 最初に並列で計測するCRF（傾きも同時に求まる）
+    MAX_ROUNDS = 4  # 最初の計測を含めた探索の回数
+    TOLERANCE = 0.03  # 目標ビットレートとの許容誤差（これ以内の計測があれば探索を終える）
+    SAMPLE_COUNT = 4
+    VBV_MAXRATE_FACTOR = 1.5  # 目標ビットレートに対する瞬間的な上限
+    VBV_BUFSIZE_FACTOR = 2.0  # VBVバッファ（目標ビットレートの2秒分）
+
+    def __init__(self, video_file_path, output_path, target_size_mb, total_duration, use_h265=False,
+                 trim_range=None, speed_preset=DEFAULT_SPEED_PRESET, tune='', audio_tracks=None, audio_mix=False,
+                 output_fps=None):
+        super().__init__()
+        self.video_file_path = video_file_path
+        self.output_path = output_path
+        self.target_size_mb = target_size_mb
+        self.audio_tracks = audio_tracks  # 使う音声ストリームの番号（Noneは既定の1本）
+        self.audio_mix = audio_mix
+        self.total_duration = total_duration  # トリミング時は範囲の長さ
+        self.use_h265 = use_h265
+        self.trim_range = trim_range
+        self.speed_preset = speed_preset
+        self.tune = tune
+        self.output_fps = output_fps  # 固定フレームレートにする場合のfps（サンプルと本番で同じ扱いにする）
+        self.final_crf = None
+        self.predicted_size = 0  # 探索結果から予測した出力サイズ（バイト）
+        self.elapsed_seconds = 0.0
+        self._should_stop = False
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._thread_token = None  # ThreadAllocatorのトークン
+
+    def stop(self):
+        """スレッドを停止（実行中のすべてのFFmpegを終了）"""
+        self._should_stop = True
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.terminate()
+            except:
+                pass
+
+    def run(self):
+        start_time = time.time()
+        workspace = JobWorkspace('clipitbro_crfsearch_')
+        allocator = get_thread_allocator()
+        self._thread_token = allocator.register()
+        try:
+            self.phase_signal.emit(1)
+            video_codec = 'libx265' if self.use_h265 else 'libx264'
+            self.log_signal.emit("=== CRF探索による目標サイズ変換開始 ===")
+            self.log_signal.emit(f"📹 使用コーデック: {'H.265 (HEVC)' if self.use_h265 else 'H.264 (x264)'}")
+
+            record, _ = MediaProbe.probe_cached(self.video_file_path)
+            budget = BitBudget.allocate(self.target_size_mb, self.total_duration, record, self.audio_tracks, self.audio_mix,
+                                        self.output_fps)
+            if not budget:
+                self.finished_signal.emit(False, self.output_path, "動画の長さが不明です")
+                return
+            target_kbps, audio_plan = budget.video_kbps, budget.audio_plan
+
+            offset = self.trim_range[0] if self.trim_range else 0.0
+            samples = [(start + offset, length) for start, length in plan_sample_segments(self.total_duration, self.SAMPLE_COUNT)]
+            sample_seconds = sum(length for _, length in samples)
+            full_clip = len(samples) == 1
+            self.log_signal.emit(f"🎯 目標: {self.target_size_mb} MB ({budget.describe()})")
+            self.log_signal.emit(f"🔬 サンプル: {len(samples)}区間 計{sample_seconds:.1f}秒"
+                                 + (" (クリップ全体)" if full_clip else ""))
+
+            # === CRF探索 ===
+            probes = {}  # CRF -> 実測kbps
+            sample_paths = {}  # CRF -> サンプルの出力パス（クリップ全体の場合に流用する）
+            round_crfs = list(self.INITIAL_CRFS)
+            crf, predicted_kbps = None, 0
+            for round_index in range(self.MAX_ROUNDS):
+                results = self.measure_crfs(round_crfs, samples, video_codec, allocator, workspace)
+                if results is None:
+                    return
+                for value, (kbps, paths) in results.items():
+                    probes[value] = kbps
+                    sample_paths[value] = paths
+                    self.log_signal.emit(f"  CRF {value}: {kbps:.0f} kbps")
+                self.progress_signal.emit(min(45, (round_index + 1) * 15))
+
+                crf, predicted_kbps = estimate_crf_for_bitrate(probes, target_kbps, self.CRF_MIN, self.CRF_MAX)
+                nearest = min(probes, key=lambda c: abs(probes[c] / target_kbps - 1))
+                if abs(probes[nearest] / target_kbps - 1) <= self.TOLERANCE:
+                    crf, predicted_kbps = nearest, probes[nearest]
+                    break
+                next_crf = int(round(crf))
+                above = [c for c in probes if probes[c] >= target_kbps]
+                below = [c for c in probes if probes[c] < target_kbps]
+                if next_crf in probes or (above and below and min(below) - max(above) <= 1):
+                    break
+                round_crfs = [next_crf]
+
+            self.final_crf = round(crf, 1)
+            self.predicted_size = int(predicted_kbps * 1000 / 8 * self.total_duration + budget.audio_bytes()
+                                      + budget.overhead_bytes)
+            self.log_signal.emit(f"✓ CRF探索完了: CRF {self.final_crf} (予測 {predicted_kbps:.0f} kbps, "
+                                 f"予測サイズ {self.predicted_size / (1024 * 1024):.2f} MB, 計測{len(probes)}回)")
+            self.progress_signal.emit(50)
+
+            # === 本番エンコード ===
+            self.phase_signal.emit(2)
+            if full_clip and self.final_crf in sample_paths and probes[self.final_crf] <= target_kbps * (1 + self.TOLERANCE):
+                # クリップ全体のサンプルが目標に収まっていれば、映像はそのまま使い音声だけ付ける
+                self.log_signal.emit("♻ 探索時のエンコード結果を流用します")
+                return_code, tail = self.mux_sample(sample_paths[self.final_crf][0], audio_plan)
+            else:
+                return_code, tail = self.encode_final(video_codec, target_kbps, allocator, audio_plan)
+            if return_code != 0:
+                if self._should_stop:
+                    self.finished_signal.emit(False, self.output_path, "変換が停止されました")
+                else:
+                    self.log_signal.emit(f"本番エンコード失敗: {tail}")
+                    self.finished_signal.emit(False, self.output_path, f"本番エンコード失敗: 終了コード {return_code}")
+                return
+
+            self.elapsed_seconds = time.time() - start_time
+            actual_size = os.path.getsize(self.output_path)
+            error = (actual_size / self.predicted_size - 1) * 100 if self.predicted_size else 0
+            self.progress_signal.emit(100)
+            self.log_signal.emit(f"📏 予測 {self.predicted_size / (1024 * 1024):.2f} MB / 実際 {actual_size / (1024 * 1024):.2f} MB "
+                                 f"(誤差 {error:+.1f}%)")
+            self.log_signal.emit(f"CRF探索変換完了 ({self.elapsed_seconds:.1f}秒)")
+            self.finished_signal.emit(True, self.output_path, "")
+
+        except Exception as e:
+            self.log_signal.emit(f"CRF探索変換エラー: {e}")
+            self.finished_signal.emit(False, self.output_path, str(e))
+        finally:
+            allocator.unregister(self._thread_token)
+            workspace.cleanup()
+
+    def measure_crfs(self, crfs, samples, video_codec, allocator, workspace):
+        """
+        複数のCRFで全サンプルを並列にエンコードしてビットレートを実測
+
+        Returns:
+            dict: CRF -> (kbps, [サンプルの出力パス])。失敗・停止時はNone
+        """
+        tasks = [(crf, index, start, length) for crf in crfs for index, (start, length) in enumerate(samples)]
+        allocations = allocator.allocation(self._thread_token).split(len(tasks))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = [
+                executor.submit(self.encode_sample, crf, start, length, video_codec, allocation,
+                                workspace.file_path(f'sample_crf{crf}_{index:02d}.mkv'))
+                for (crf, index, start, length), allocation in zip(tasks, allocations)
+            ]
+            outcomes = [future.result() for future in futures]
+
+        for success, message in outcomes:
+            if not success:
+                self.stop()
+                message = message or "変換が停止されました"
+                self.log_signal.emit(f"CRF探索失敗: {message}")
+                self.finished_signal.emit(False, self.output_path, message)
+                return None
+
+        sample_seconds = sum(length for _, length in samples)
+        results = {}
+        for crf in crfs:
+            paths = [workspace.file_path(f'sample_crf{crf}_{index:02d}.mkv') for index in range(len(samples))]
+            total_bytes = sum(os.path.getsize(path) for path in paths)
+            results[crf] = (total_bytes * 8 / 1000 / sample_seconds, paths)
+        return results
+
+    def encode_sample(self, crf, start, length, video_codec, allocation, sample_path):
+        """1サンプル区間を指定CRFでエンコード（映像のみ）"""
+        if self._should_stop:
+            return False, ""
+        cmd = [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y',
+        ] + allocation.input_args() + [
+            '-ss', f'{start:.6f}',
+            '-i', self.video_file_path,
+            '-t', f'{length:.6f}',
+            '-map', '0:v:0',
+            '-an', '-sn', '-dn',
+            '-c:v', video_codec,
+        ] + build_encoder_args(video_codec, self.speed_preset, self.tune) + allocation.encoder_args() + (
+            build_codec_params_args(video_codec, allocation.codec_params(video_codec))
+        ) + build_frame_rate_args(self.output_fps) + [
+            '-crf', str(crf),
+            '-f', 'matroska', sample_path,
+        ]
+        return_code, tail = self.run_process(cmd)
+        if return_code != 0:
+            return False, "" if self._should_stop else f"CRF {crf} サンプル: 終了コード {return_code} {tail}"
+        return True, ""
+
+    def encode_final(self, video_codec, target_kbps, allocator, audio_plan):
+        """求めたCRFとVBV上限で本番エンコード"""
+        allocation = allocator.allocation(self._thread_token)
+        self.log_signal.emit(f"🧵 スレッド割り当て: {allocation.describe()}")
+        maxrate = int(target_kbps * self.VBV_MAXRATE_FACTOR)
+        bufsize = int(target_kbps * self.VBV_BUFSIZE_FACTOR)
+        self.log_signal.emit(f"=== 本番エンコード開始 (CRF {self.final_crf}, 上限 {maxrate} kbps) ===")
+        cmd = [
+            get_ffmpeg_executable_path('ffmpeg.exe'),
+            '-y',
+        ] + allocation.input_args() + build_input_args(self.video_file_path, self.trim_range) + (
+            audio_plan.output_map_args()
+        ) + [
+            '-c:v', video_codec,
+        ] + build_encoder_args(video_codec, self.speed_preset, self.tune) + allocation.encoder_args() + (
+            build_codec_params_args(video_codec, allocation.codec_params(video_codec))
+        ) + build_frame_rate_args(self.output_fps) + [
+            '-crf', str(self.final_crf),
+            '-maxrate', f'{maxrate}k',
+            '-bufsize', f'{bufsize}k',
+        ]
+        cmd += audio_plan.ffmpeg_args()
+        cmd += ['-movflags', '+faststart', self.output_path]
+
+        def on_seconds(seconds):
+            self.progress_signal.emit(50 + min(100, seconds / self.total_duration * 100) * 0.5)
+
+        return self.run_process(cmd, on_seconds)
+
+    def mux_sample(self, sample_path, audio_plan):
+        """クリップ全体のサンプルに音声を付けて出力"""
+        cmd = [get_ffmpeg_executable_path('ffmpeg.exe'), '-y', '-i', sample_path]
+        if audio_plan.mode != 'none':
+            cmd += build_input_args(self.video_file_path, self.trim_range) + (
+                audio_plan.output_map_args(audio_input=1) or ['-map', '0:v', '-map', '1:a']) + audio_plan.ffmpeg_args()
+        cmd += ['-c:v', 'copy', '-movflags', '+faststart', self.output_path]
+        return self.run_process(cmd)
+
+    def run_process(self, cmd, on_seconds=None):
+        """FFmpegを実行して (終了コード, 末尾の出力) を返す"""
+        import re
+
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=get_ffmpeg_env(),
+            encoding='utf-8',
+            errors='replace',
+            universal_newlines=True,
+            **get_hidden_window_kwargs()
+        )
+        with self._lock:
+            self._processes.add(process)
+        get_thread_allocator().attach_process(self._thread_token, process)
+        tail = []
+        try:
+            for output in process.stdout:
+                time_match = re.search(r'time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})', output)
+                if time_match and on_seconds:
+                    hours, minutes, seconds, centiseconds = (int(g) for g in time_match.groups())
+                    on_seconds(hours * 3600 + minutes * 60 + seconds + centiseconds / 100)
+                elif output.strip():
+                    tail = (tail + [output.strip()])[-3:]
+            return process.wait(), ' / '.join(tail)
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+class SizeModel:
+    """
+    変換履歴から学習するCRF方式の出力ビットレートの回帰モデル
+
+    log(出力kbps) を対数特徴量（CRF・出力画素数・fps・元動画のbit/pixel・速度段階）の線形和で表す。
+    正規方程式の十分統計量（XᵀX, Xᵀy）を1件ごとに加算するだけなので、履歴が増えても更新は軽い。
+    """
+
+    MIN_SAMPLES = 10  # これ未満の間は予測せず、従来の推定式を使う
+    RIDGE = 1e-3  # 特徴量の偏った履歴でも解けるようにする正則化
+    PRESETS = ('fast', 'quality')  # 標準（balanced）を基準にした速度段階のダミー変数
+
+    def __init__(self):
+        size = 5 + len(self.PRESETS)
+        self.xtx = np.zeros((size, size), dtype=np.float64)
+        self.xty = np.zeros(size, dtype=np.float64)
+        self.yty = 0.0
+        self.count = 0
+        self._solution = None  # (係数, 正則化済みXᵀXの逆行列, 残差分散)
+
+    @classmethod
+    def features(cls, video_info, crf, scale_factor, speed_preset=DEFAULT_SPEED_PRESET):
+        """video_infoと変換設定から特徴量ベクトルを作成（必要な情報が無ければNone）"""
+        if scale_factor <= 0:
+            return None
+        matrix = cls.feature_matrix(video_info, np.array([crf]), np.array([scale_factor]), speed_preset)
+        return None if matrix is None else matrix[0]
+
+    @classmethod
+    def feature_matrix(cls, video_info, crfs, scales, speed_preset=DEFAULT_SPEED_PRESET):
+        """同じ動画の複数のCRF・スケール（同じ形の配列）の特徴量を (件数, 特徴量数) の行列で作成"""
+        width = video_info.get('width') or 0
+        height = video_info.get('height') or 0
+        fps = video_info.get('fps') or 0
+        source_kbps = video_info.get('bitrate') or 0
+        if not (width and height and fps and source_kbps):
+            return None
+        crfs = np.ravel(crfs).astype(np.float64)
+        scales = np.ravel(scales).astype(np.float64)
+        output_mpix = (np.maximum(1, np.floor(width * scales)) * np.maximum(1, np.floor(height * scales))) / 1e6
+        source_bpp = source_kbps * 1000 / (width * height * fps)
+        columns = [np.ones_like(crfs), crfs, np.log(output_mpix), np.full_like(crfs, math.log(fps / 30)),
+                   np.full_like(crfs, math.log(source_bpp))]
+        columns += [np.full_like(crfs, 1.0 if speed_preset == preset else 0.0) for preset in cls.PRESETS]
+        return np.column_stack(columns)
+
+    def update(self, features, output_kbps, weight=1):
+        """1件の実績（出力の総ビットレート）を加算（weight=-1で加算済みの実績を取り除く）"""
+        if features is None or output_kbps <= 0:
+            return
+        y = math.log(output_kbps)
+        self.xtx += weight * np.outer(features, features)
+        self.xty += weight * features * y
+        self.yty += weight * y * y
+        self.count += weight
+        self._solution = None
+
+    def _solve(self):
+        if self._solution is None:
+            regularizer = np.eye(len(self.xty)) * self.RIDGE
+            regularizer[0, 0] = 0.0  # 切片は正則化しない
+            inverse = np.linalg.pinv(self.xtx + regularizer)
+            coef = inverse @ self.xty
+            sse = max(0.0, self.yty - 2 * coef @ self.xty + coef @ self.xtx @ coef)
+            variance = sse / max(1, self.count - len(coef))
+            self._solution = (coef, inverse, variance)
+        return self._solution
+
+    def predict(self, video_info, crf, scale_factor, speed_preset=DEFAULT_SPEED_PRESET, z=1.96):
+        """
+        出力の総ビットレート（kbps）を予測
+
+        Returns:
+            tuple: (予測kbps, 下限kbps, 上限kbps)。履歴が足りない場合はNone
+        """
+        features = self.features(video_info, crf, scale_factor, speed_preset)
+        if features is None:
+            return None
+        prediction = self.predict_matrix(features[None, :], z)
+        return None if prediction is None else tuple(float(values[0]) for values in prediction)
+
+    def predict_matrix(self, features, z=1.96):
+        """特徴量行列の各行について (予測kbps, 下限kbps, 上限kbps) の配列を返す（履歴が足りない場合はNone）"""
+        if features is None or self.count < self.MIN_SAMPLES:
+            return None
+        coef, inverse, variance = self._solve()
+        mean = features @ coef
+        spread = z * np.sqrt(variance * (1 + np.einsum('ij,jk,ik->i', features, inverse, features)))
+        return np.exp(mean), np.exp(mean - spread), np.exp(mean + spread)
+
+class ConversionHistory:
+    """
+    完了した変換の履歴（SQLite）
+
+    入力の解像度・fps・ビットレートと変換設定、実際の出力サイズを1件ずつ保存し、
+    CRF方式の実績からSizeModelを学習する。2pass方式は初回の2pass目の出力サイズ（超過の実績）を保存し、
+    同じコーデック・解像度の以後の目標ビットレートの補正に使う。件数が上限を超えた場合は古いものから削除する。
+    """
+
+    MAX_ROWS = 10000
+    COLUMNS = ('finished_at', 'mode', 'codec', 'speed_preset', 'tune', 'width', 'height', 'fps', 'source_kbps',
+               'duration', 'crf', 'scale', 'target_size_mb', 'output_bytes', 'elapsed',
+               'video_kbps', 'first_output_bytes', 'attempts', 'attempt_seconds', 'audio_bytes')
+    # 後から追加した列（既存のデータベースにはALTER TABLEで追加する）
+    ADDED_COLUMNS = (('video_kbps', 'REAL'), ('first_output_bytes', 'INTEGER'), ('attempts', 'INTEGER'),
+                     ('attempt_seconds', 'REAL'), ('audio_bytes', 'INTEGER'))
+    LEGACY_AUDIO_KBPS = 128  # audio_bytesを保存する前の行の音声（当時は固定値）
+    # ビットレート補正に使う直近の件数・最低件数・補正係数の範囲
+    CORRECTION_ROWS = 20
+    CORRECTION_MIN_ROWS = 3
+    CORRECTION_RANGE = (0.8, 1.0)
+    # 解像度の区分（縦の画素数の上限）
+    RESOLUTION_CLASSES = (480, 720, 1080, 1440, 2160)
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(get_app_data_dir('history'), 'conversions.sqlite3')
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversions ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " finished_at REAL NOT NULL,"
+                " mode TEXT NOT NULL,"
+                " codec TEXT NOT NULL,"
+                " speed_preset TEXT,"
+                " tune TEXT,"
+                " width INTEGER, height INTEGER, fps REAL, source_kbps REAL,"
+                " duration REAL NOT NULL,"
+                " crf REAL, scale REAL, target_size_mb REAL,"
+                " output_bytes INTEGER NOT NULL,"
+                " elapsed REAL)"
+            )
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(conversions)")}
+            for column, column_type in self.ADDED_COLUMNS:
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE conversions ADD COLUMN {column} {column_type}")
+        self.model = SizeModel()
+        for row in self.rows('crf'):
+            self._learn(row)
+
+    def record(self, input_path, settings, duration, output_path, elapsed=None, size_attempts=None):
+        """
+        変換1件の実績を保存（CRF方式の場合はモデルも更新）
+
+        size_attempts: 2pass目の実行記録（TwoPassConversionThread.attempt_summary）
+        """
+        try:
+            record, _ = MediaProbe.probe_cached(input_path)
+            video_info = record.to_video_info() or {}
+            output_bytes = os.path.getsize(output_path)
+        except (MediaProbeError, OSError):
+            return None
+        if duration <= 0 or output_bytes <= 0:
+            return None
+
+        row = {
+            'finished_at': time.time(),
+            'mode': settings.get('mode', 'crf'),
+            # CRF方式は常にH.264
+            'codec': 'libx265' if settings.get('mode') == 'twopass' and settings.get('use_h265') else 'libx264',
+            'speed_preset': settings.get('speed_preset', DEFAULT_SPEED_PRESET),
+            'tune': settings.get('tune', ''),
+            'width': video_info.get('width'),
+            'height': video_info.get('height'),
+            'fps': video_info.get('fps'),
+            'source_kbps': video_info.get('bitrate'),
+            'duration': duration,
+            'crf': settings.get('crf'),
+            'scale': settings.get('scale'),
+            'target_size_mb': settings.get('target_size_mb'),
+            'output_bytes': output_bytes,
+            'elapsed': elapsed,
+        }
+        size_attempts = size_attempts or {}
+        for column in ('video_kbps', 'first_output_bytes', 'attempts', 'attempt_seconds', 'audio_bytes'):
+            row[column] = size_attempts.get(column)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO conversions ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                tuple(row[column] for column in self.COLUMNS)
+            )
+            # 上限を超えた古い行を削除（学習済みのCRF方式の行はモデルからも取り除く）
+            evicted = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM conversions"
+                " WHERE id <= (SELECT MAX(id) FROM conversions) - ? AND mode = 'crf'", (self.MAX_ROWS,)
+            ).fetchall()
+            self._conn.execute(
+                "DELETE FROM conversions WHERE id <= (SELECT MAX(id) FROM conversions) - ?", (self.MAX_ROWS,)
+            )
+        for evicted_row in evicted:
+            self._learn(dict(zip(self.COLUMNS, evicted_row)), weight=-1)
+        if row['mode'] == 'crf':
+            self._learn(row)
+        return row
+
+    def _learn(self, row, weight=1):
+        video_info = {'width': row['width'], 'height': row['height'], 'fps': row['fps'], 'bitrate': row['source_kbps']}
+        features = SizeModel.features(video_info, row['crf'] or 0, row['scale'] or 0, row['speed_preset'])
+        self.model.update(features, row['output_bytes'] * 8 / 1000 / row['duration'], weight)
+
+    def rows(self, mode=None):
+        """保存済みの履歴を古い順に取得（辞書のリスト）"""
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM conversions"
+        params = ()
+        if mode:
+            query += " WHERE mode = ?"
+            params = (mode,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    @classmethod
+    def resolution_bounds(cls, height):
+        """縦の画素数が属する解像度区分の (下限, 上限)"""
+        lower = 0
+        for upper in cls.RESOLUTION_CLASSES:
+            if height <= upper:
+                return lower, upper
+            lower = upper
+        return lower, 1 << 30
+
+    def bitrate_correction(self, codec, height):
+        """
+        同じコーデック・解像度区分の2pass変換の超過実績から、目標ビットレートに掛ける補正係数を求める
+
+        直近の実績ごとに、初回の2pass目で動画分（実際の音声のバイト数を除いた分）が
+        要求ビットレートの何倍になったかを求め、その中央値の逆数を補正係数とする（超過しない方向にだけ補正する）。
+
+        Returns:
+            tuple: (補正係数, 使った件数)。件数が足りない場合は (1.0, 件数)
+        """
+        if not height:
+            return 1.0, 0
+        lower, upper = self.resolution_bounds(height)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT video_kbps, first_output_bytes, duration, audio_bytes FROM conversions"
+                " WHERE mode = 'twopass' AND codec = ? AND height > ? AND height <= ?"
+                " AND video_kbps > 0 AND first_output_bytes > 0 ORDER BY id DESC LIMIT ?",
+                (codec, lower, upper, self.CORRECTION_ROWS)
+            ).fetchall()
+        if len(rows) < self.CORRECTION_MIN_ROWS:
+            return 1.0, len(rows)
+        video_kbps, first_output_bytes, duration, audio_bytes = (
+            np.array(column, dtype=np.float64) for column in zip(*rows))  # audio_bytesのNULLはnanになる
+        audio_bytes = np.where(np.isnan(audio_bytes), self.LEGACY_AUDIO_KBPS * 1000 / 8 * duration, audio_bytes)
+        ratios = (first_output_bytes - audio_bytes) / (video_kbps * 1000 / 8 * duration)
+        factor = 1 / float(np.median(ratios[ratios > 0])) if np.any(ratios > 0) else 1.0
+        return float(np.clip(factor, *self.CORRECTION_RANGE)), len(rows)
+
+    def clear(self):
+        """履歴を全削除してモデルを初期化"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM conversions")
+        self.model = SizeModel()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM conversions").fetchone()[0]
+            guarded, retried, attempt_seconds = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(attempts > 1), 0), COALESCE(SUM(attempt_seconds), 0)"
+                " FROM conversions WHERE attempts IS NOT NULL").fetchone()
+        return {'entries': entries, 'model_samples': self.model.count, 'guarded': guarded, 'retried': retried,
+                'attempt_seconds': attempt_seconds}
+
+_conversion_history = None
+
+def get_conversion_history():
+    """共有の変換履歴を取得（作成できない環境ではNone）"""
+    global _conversion_history
+    if _conversion_history is None:
+        try:
+            _conversion_history = ConversionHistory()
+        except Exception as e:
+            print(f"変換履歴の初期化エラー: {e}")
+            return None
+    return _conversion_history
+
+def estimate_crf_sizes(width, height, fps, duration, source_kbps, file_size_mb, crf, scale, complexity_factor=1.0,
+                       audio_kbps=128):
+    """
+    CRF方式の出力サイズを実測データ基準の係数表で推定（全引数はNumPyでブロードキャストされる配列）
+
+    1ファイルのCRF×スケールの表も、複数ファイルの一括推定も同じ式で計算する。
+    source_kbpsが0の場合は解像度とフレームレートから基準ビットレートを推定する。
+    audio_kbpsは出力する音声のビットレート（plan_crf_audioの結果、音声なしは0）。
+
+    Returns:
+        tuple: (映像ビットレートkbpsの配列, サイズMBの配列)
+    """
+    crf = np.asarray(crf, dtype=np.float64)
+    scale = np.asarray(scale, dtype=np.float64)
+    width, height, fps, duration, source_kbps, file_size_mb, complexity_factor, audio_bitrate = (
+        np.asarray(value, dtype=np.float64)
+        for value in (width, height, fps, duration, source_kbps, file_size_mb, complexity_factor, audio_kbps)
+    )
+    new_pixels = np.floor(width * scale) * np.floor(height * scale)
+    pixel_ratio = new_pixels / (width * height)
+
+    # 1. CRF値に基づく品質係数（実測: CRF28で元ビットレートの約21.6%（1316/6088））
+    quality_factor = np.select(
+        [crf <= 18, crf <= 23, crf <= 28, crf <= 35],
+        [0.65 - (crf - 15) * 0.03, 0.65 - (crf - 18) * 0.05, 0.40 - (crf - 23) * 0.035, 0.225 - (crf - 28) * 0.02],
+        0.085 - (crf - 35) * 0.008
+    )
+    quality_factor = np.maximum(0.05, quality_factor)
+
+    # 2. 元ビットレートを基準にした推定（無い場合は解像度別の基準値 kbps per million pixels per second）
+    bitrate_per_mpps = np.select(
+        [new_pixels <= 720 * 480, new_pixels <= 1280 * 720, new_pixels <= 1920 * 1080], [0.8, 0.6, 0.5], 0.4)
+    base_bitrate = np.where(
+        source_kbps > 0,
+        source_kbps * quality_factor * pixel_ratio * complexity_factor,
+        new_pixels * fps / 1000000 * bitrate_per_mpps * 1000 * quality_factor * complexity_factor
+    )
+
+    # 3. フレームレート補正（30fps基準）と 4. 短い動画の効率低下
+    base_bitrate = base_bitrate * np.clip(fps / 30.0, 0.7, 1.5)
+    base_bitrate = base_bitrate * np.select([duration < 30, duration < 120], [1.15, 1.08], 1.0)
+    # 5. スケールアップ時は効率が落ちる
+    base_bitrate = base_bitrate * np.where(scale > 1.0, 1.0 + (scale - 1.0) * 0.1, 1.0)
+    estimated_bitrate = np.maximum(100, base_bitrate)
+
+    # 6. ファイルサイズ（音声、コンテナオーバーヘッド2%）
+    estimated_size = (estimated_bitrate + audio_bitrate) * duration * 1.02 / (8 * 1024)
+
+    # 7. 元ファイルサイズと比較して極端な値（15倍以上・1/15以下）を補正
+    with np.errstate(divide='ignore', invalid='ignore'):
+        size_ratio = np.where(file_size_mb > 0, estimated_size / np.where(file_size_mb > 0, file_size_mb, 1), 1.0)
+        clamped_size = np.select([size_ratio > 15, size_ratio < 0.067], [file_size_mb * 8, file_size_mb * 0.15], estimated_size)
+        estimated_bitrate = np.where(clamped_size != estimated_size,
+                                     clamped_size * 8 * 1024 / duration - audio_bitrate, estimated_bitrate)
+    return np.maximum(150, estimated_bitrate), np.maximum(0.1, clamped_size)
+
+class SizeEstimateGrid:
+    """
+    1ファイル分のCRF（1-50）×スケール（0.1-1.0）のサイズ推定表
+
+    推定方式（校正曲線・履歴モデル・係数表）をNumPyの配列演算で全組み合わせに一括適用して保持し、
+    スライダー操作時は表を参照するだけにする。
+    """
+
+    CRF_VALUES = np.arange(1, 51, dtype=np.float64)
+    SCALE_VALUES = np.arange(1, 11, dtype=np.float64) / 10
+    AUDIO_BITRATE = 128  # video_infoに音声のビットレートが無い場合
+
+    def __init__(self, video_info, bitrate, size_mb, size_low=None, size_high=None, method='table', model_samples=0):
+        self.video_info = video_info
+        self.bitrate = bitrate  # (CRF数, スケール数) の映像ビットレート（kbps）
+        self.size_mb = size_mb  # (CRF数, スケール数) の推定サイズ（MB）
+        self.size_low = size_low  # 履歴モデルの95%区間（他の方式ではNone）
+        self.size_high = size_high
+        self.method = method  # 'calibrated', 'model', 'table'
+        self.model_samples = model_samples
+
+    @classmethod
+    def build(cls, video_info, complexity_profile=None, rate_curve=None, size_model=None,
+              speed_preset=DEFAULT_SPEED_PRESET):
+        """表を作成（必要な動画情報が無ければNone）"""
+        width, height = video_info.get('width') or 0, video_info.get('height') or 0
+        fps, duration = video_info.get('fps') or 0, video_info.get('duration') or 0
+        if not all([width, height, fps, duration]):
+            return None
+        crf, scale = np.meshgrid(cls.CRF_VALUES, cls.SCALE_VALUES, indexing='ij')
+        to_mb = lambda kbps: np.maximum(0.1, kbps * duration / (8 * 1024))
+        audio_kbps = video_info.get('audio_kbps', cls.AUDIO_BITRATE)
+
+        # 校正済みの場合はファイル専用の曲線で推定
+        if rate_curve is not None:
+            bitrate = rate_curve.predict_kbps(crf, scale)
+            return cls(video_info, bitrate, to_mb((bitrate + audio_kbps) * 1.02), method='calibrated')
+
+        # 履歴から学習したモデル（学習件数が足りなければNone）
+        if size_model is not None:
+            prediction = size_model.predict_matrix(SizeModel.feature_matrix(video_info, crf, scale, speed_preset))
+            if prediction is not None:
+                total, low, high = (values.reshape(crf.shape) for values in prediction)
+                return cls(video_info, np.maximum(0, total - audio_kbps), to_mb(total),
+                           to_mb(low), to_mb(high), 'model', size_model.count)
+
+        # 複雑度プロファイルがあれば動画ストリームのみの実ビットレートと複雑度係数を使う
+        source_kbps = video_info.get('bitrate') or 0
+        complexity_factor = 1.0
+        if complexity_profile is not None and complexity_profile.mean_kbps() > 0:
+            source_kbps = complexity_profile.mean_kbps()
+            complexity_factor = complexity_profile.complexity_factor()
+        bitrate, size_mb = estimate_crf_sizes(width, height, fps, duration, source_kbps,
+                                              video_info.get('file_size') or 0, crf, scale, complexity_factor, audio_kbps)
+        return cls(video_info, bitrate, size_mb)
+
+    def index(self, crf, scale_factor):
+        """CRF・スケールに対応する表の位置（範囲外は端に丸める）"""
+        i = int(np.clip(round(crf) - 1, 0, len(self.CRF_VALUES) - 1))
+        j = int(np.clip(round(scale_factor * 10) - 1, 0, len(self.SCALE_VALUES) - 1))
+        return i, j
+
+    def lookup(self, crf, scale_factor):
+        """従来のestimate_file_sizeと同じ形式の推定結果"""
+        i, j = self.index(crf, scale_factor)
+        width, height = self.video_info['width'], self.video_info['height']
+        new_width, new_height = int(width * self.SCALE_VALUES[j]), int(height * self.SCALE_VALUES[j])
+        result = {
+            'bitrate': round(float(self.bitrate[i, j])),
+            'size_mb': round(float(self.size_mb[i, j]), 1),
+            'new_resolution': f"{new_width}x{new_height}",
+            'pixel_ratio': round((new_width * new_height) / (width * height), 2),
+        }
+        if self.method == 'calibrated':
+            result['calibrated'] = True
+        elif self.method == 'model':
+            result['size_range_mb'] = (round(float(self.size_low[i, j]), 1), round(float(self.size_high[i, j]), 1))
+            result['model_samples'] = self.model_samples
+        return result
+
+    def crf_for_size(self, target_mb):
+        """
+        スケールごとに目標サイズに収まる最も低い（高画質な）CRF
+
+        Returns:
+            np.ndarray: スケール数分のCRF（どのCRFでも収まらない場合はnan）
+        """
+        fits = self.size_mb <= target_mb
+        first = np.argmax(fits, axis=0)
+        return np.where(fits.any(axis=0), self.CRF_VALUES[first], np.nan)
+
+    @classmethod
+    def estimate_batch(cls, video_infos, crfs, scales, size_model=None, speed_presets=None):
+        """
+        複数ファイル（キューのジョブ等）のサイズを一括推定
+
+        Args:
+            video_infos: video_info辞書のリスト
+            crfs, scales: ファイルごとのCRF・スケール
+            speed_presets: ファイルごとの速度/画質の段階（省略時は標準）
+
+        Returns:
+            np.ndarray: ファイルごとの推定サイズ（MB）。必要な情報が無いファイルはnan
+        """
+        if not video_infos:
+            return np.zeros(0)
+        columns = {key: np.array([float(info.get(key) or 0) for info in video_infos])
+                   for key in ('width', 'height', 'fps', 'duration', 'bitrate', 'file_size')}
+        crfs = np.asarray(crfs, dtype=np.float64)
+        scales = np.asarray(scales, dtype=np.float64)
+        valid = (columns['width'] > 0) & (columns['height'] > 0) & (columns['fps'] > 0) & (columns['duration'] > 0)
+        safe = {key: np.where(valid, values, 1.0) if key != 'bitrate' and key != 'file_size' else values
+                for key, values in columns.items()}
+        audio_kbps = np.array([float(info.get('audio_kbps', cls.AUDIO_BITRATE)) for info in video_infos])
+        _, size_mb = estimate_crf_sizes(safe['width'], safe['height'], safe['fps'], safe['duration'], safe['bitrate'],
+                                        safe['file_size'], crfs, scales, audio_kbps=audio_kbps)
+
+        # 学習済みの履歴モデルがあれば、元ビットレートの分かるファイルはモデルで推定
+        if size_model is not None and size_model.count >= SizeModel.MIN_SAMPLES:
+            rows, indices = [], []
+            for index, info in enumerate(video_infos):
+                speed_preset = speed_presets[index] if speed_presets else DEFAULT_SPEED_PRESET
+                features = SizeModel.feature_matrix(info, crfs[index:index + 1], scales[index:index + 1], speed_preset)
+                if valid[index] and features is not None:
+                    rows.append(features)
+                    indices.append(index)
+            if rows:
+                total_kbps = size_model.predict_matrix(np.vstack(rows))[0]
+                size_mb[indices] = np.maximum(0.1, total_kbps * columns['duration'][indices] / (8 * 1024))
+        return np.where(valid, size_mb, np.nan)
+
+class EstimationService(QObject):
+    """
+    サイズ/ビットレート推定のサービス
+
+    スライダーのドラッグ等で続けて来る要求はDEBOUNCE_MSの間まとめ、最後の要求だけを計算する。
+    結果は (ファイルのフィンガープリント, 方式, パラメータ, 推定器の状態) をキーにメモ化し、
+    フィンガープリントの計算や推定表（SizeEstimateGrid）の作成はワーカースレッドで行う。
+    計算中に新しい要求が来た場合、古い結果はメモ化だけしてestimation_readyでは通知しない。
+    """
+    estimation_ready = pyqtSignal(str, object)  # mode, 推定結果の辞書（計算できない場合はNone）
+    _computed = pyqtSignal(int, object, str, object)  # generation, メモ化キー, mode, 推定結果
+
+    DEBOUNCE_MS = 80
+    MEMO_SIZE = 512
+    GRID_CACHE_SIZE = 8
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.DEBOUNCE_MS)
+        self._timer.timeout.connect(self._flush)
+        self._pending = None  # (generation, mode, params, context)
+        self._generation = 0
+        self._coalesced = 0
+        self._memo = {}  # メモ化キー -> 推定結果
+        self._grids = {}  # (フィンガープリント, 推定器の状態) -> SizeEstimateGrid
+        self._grid_lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='estimation')
+        self._computed.connect(self._on_computed)
+
+    @staticmethod
+    def estimator_state(context):
+        """推定結果に影響する推定器の状態（校正曲線・複雑度・履歴モデルの学習件数・速度段階）"""
+        curve = context.get('rate_curve')
+        profile = context.get('complexity_profile')
+        model = context.get('size_model')
+        return (
+            (curve.intercept, curve.crf_slope, curve.scale_exponent) if curve is not None else None,
+            (round(profile.mean_kbps(), 1), round(profile.complexity_factor(), 3)) if profile is not None else None,
+            model.count if model is not None and model.count >= SizeModel.MIN_SAMPLES else 0,
+            context.get('speed_preset', DEFAULT_SPEED_PRESET),
+            context.get('audio_selection'),
+            context.get('output_fps'),
+        )
+
+    def _memo_key(self, mode, params, context, cached_only):
+        if not context.get('file_path'):
+            return None
+        try:
+            fingerprint = compute_content_fingerprint(context['file_path'], cached_only=cached_only)
+        except OSError:
+            return None
+        if fingerprint is None:
+            return None
+        return (fingerprint, mode, params,
+                self.estimator_state(context) if mode == 'crf'
+                else (context.get('audio_selection'), context.get('output_fps')))
+
+    def request(self, mode, params, context, immediate=False):
+        """
+        推定を要求
+
+        Args:
+            mode: 'crf'（params=(CRF, スケール)）または'twopass'（params=(目標サイズMB, 長さ秒)）
+            context: file_path, video_info, complexity_profile, rate_curve, size_model, speed_preset
+            immediate: Trueの場合はまとめずにすぐ計算する（ファイル選択・方式切り替え時など）
+        """
+        if self._pending is not None:
+            self._coalesced += 1
+        self._generation += 1
+        self._pending = (self._generation, mode, params, context)
+        if immediate:
+            self._timer.stop()
+            self._flush()
+        else:
+            self._timer.start()
+
+    def cancel(self):
+        """保留中の要求を破棄し、計算中の結果も通知しない"""
+        self._timer.stop()
+        self._pending = None
+        self._generation += 1
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        generation, mode, params, context = self._pending
+        self._pending = None
+        if self._coalesced:
+            estimation_logger.debug("推定要求 %d件をまとめました", self._coalesced)
+            self._coalesced = 0
+
+        key = self._memo_key(mode, params, context, cached_only=True)
+        if key is not None and key in self._memo:
+            estimation_logger.debug("推定結果のメモ化ヒット: %s %s", mode, params)
+            self.estimation_ready.emit(mode, self._memo[key])
+            return
+        self._executor.submit(self._compute, generation, mode, params, context)
+
+    def _compute(self, generation, mode, params, context):
+        """ワーカースレッドで推定を計算"""
+        if generation != self._generation:
+            return  # 待っている間に新しい要求が来た
+        start = time.perf_counter()
+        key, result = None, None
+        try:
+            key = self._memo_key(mode, params, context, cached_only=False)
+            if mode == 'crf':
+                grid = self.get_grid(context)
+                result = grid.lookup(*params) if grid is not None else None
+            else:
+                target_size, duration = params
+                audio_tracks, audio_mix = context.get('audio_selection') or (None, False)
+                budget = BitBudget.allocate(target_size, duration, cached_media_record(context.get('file_path')),
+                                            audio_tracks, audio_mix, context.get('output_fps'))
+                result = {'target_bitrate': budget.video_kbps, 'duration': duration,
+                          'audio': budget.audio_plan.describe()} if budget else None
         except Exception as e:
-            self.log_signal.emit(f"{pass_number}pass目エラー: {e}")
-            self.finished_signal.emit(False, self.output_path, str(e))
+            estimation_logger.warning("ファイルサイズ推定エラー: %s", e)
+            key = None
+        estimation_logger.debug("推定 %s %s: %.1fms", mode, params, (time.perf_counter() - start) * 1000)
+        self._computed.emit(generation, key, mode, result)
+
+    def _on_computed(self, generation, key, mode, result):
+        """GUIスレッドで結果をメモ化し、最新の要求の結果なら通知"""
+        if key is not None:
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.pop(next(iter(self._memo)))
+            self._memo[key] = result
+        if generation != self._generation:
+            estimation_logger.debug("古い推定結果を破棄: %s", mode)
+            return
+        self.estimation_ready.emit(mode, result)
+
+    def get_grid(self, context):
+        """
+        CRF×スケールの推定表を取得（作成済みでなければ呼び出したスレッドで作成）
+
+        Returns:
+            SizeEstimateGrid: 必要な動画情報が無い場合はNone
+        """
+        if not context.get('video_info') or not context.get('file_path'):
+            return None
+        grid_key = (compute_content_fingerprint(context['file_path']), self.estimator_state(context))
+        with self._grid_lock:
+            if grid_key in self._grids:
+                return self._grids[grid_key]
+        grid = SizeEstimateGrid.build(context['video_info'], context.get('complexity_profile'),
+                                      context.get('rate_curve'), context.get('size_model'),
+                                      context.get('speed_preset', DEFAULT_SPEED_PRESET))
+        with self._grid_lock:
+            if len(self._grids) >= self.GRID_CACHE_SIZE:
+                self._grids.pop(next(iter(self._grids)))
+            self._grids[grid_key] = grid
+        return grid
+
+    def shutdown(self):
+        """未着手の計算を破棄してワーカーを停止"""
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class ConversionJob:
+    """変換キューの1ジョブ（入力ファイルと変換設定）"""
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUS_LABELS = {
+        'queued': '⏳ 待機中',
+        'running': '▶ 変換中',
+        'done': '✓ 完了',
+        'failed': '✗ 失敗',
+        'cancelled': '■ キャンセル',
+    }
+
+    def __init__(self, input_path, settings, duration=0, output_path=None, job_id=None):
+        self.id = job_id or hashlib.sha1(f"{input_path}|{time.time()}|{random.random()}".encode('utf-8')).hexdigest()[:12]
+        self.input_path = input_path
+        self.settings = dict(settings)  # mode, target_size_mb, crf, scale, use_h265, speed_preset, tune等
+        self.duration = duration
+        self.output_path = output_path or build_output_path(
+            input_path, self.settings.get('mode', 'crf'), self.settings.get('use_h265', False))
+        self.status = self.STATUS_QUEUED
+        self.progress = 0.0
+        self.error = ""
+        self.output_size = 0
+        self.predicted_size = 0  # 予測した出力サイズ（バイト、CRF探索の結果またはCRF方式の推定表。予測しない方式は0）
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED, self.STATUS_CANCELLED)
+
+    def trim_range(self):
+        """トリミング範囲 (開始秒, 終了秒)。未指定の場合はNone"""
+        start, end = self.settings.get('trim_start'), self.settings.get('trim_end')
+        if start is None or end is None:
+            return None
+        return start, end
+
+    def settings_text(self):
+        """表示用の設定概要"""
+        codec = "H.265" if self.settings.get('use_h265') else "H.264"
+        speed_preset = self.settings.get('speed_preset', DEFAULT_SPEED_PRESET)
+        if speed_preset != DEFAULT_SPEED_PRESET:
+            codec += f" {ENCODER_SPEED_PRESETS.get(speed_preset, ('?',))[0]}"
+        trim_range = self.trim_range()
+        trim = f" ✂{format_timecode(trim_range[0])}-{format_timecode(trim_range[1])}" if trim_range else ""
+        if self.settings.get('mode') == 'twopass':
+            if self.settings.get('crf_search'):
+                return f"CRF探索 {self.settings.get('target_size_mb')}MB {codec}{trim}"
+            chunked = " 分割並列" if self.settings.get('chunked') else ""
+            return f"2pass{chunked} {self.settings.get('target_size_mb')}MB {codec}{trim}"
+        return f"CRF{self.settings.get('crf')} x{self.settings.get('scale')} {codec}{trim}"
+
+    def display_text(self):
+        text = f"{self.STATUS_LABELS.get(self.status, self.status)}  {os.path.basename(self.input_path)}  [{self.settings_text()}]"
+        if self.status == self.STATUS_RUNNING:
+            text += f"  {self.progress:.0f}%"
+        elif self.status == self.STATUS_QUEUED and self.predicted_size:
+            text += f"  予測 {self.predicted_size / (1024 * 1024):.1f}MB"
+        elif self.status == self.STATUS_DONE and self.output_size:
+            text += f"  {self.output_size / (1024 * 1024):.1f}MB"
+            if self.predicted_size:
+                text += f" (予測との誤差 {self.size_error_percent():+.1f}%)"
+        elif self.status == self.STATUS_FAILED and self.error:
+            text += f"  ({self.error})"
+        return text
+
+    def size_error_percent(self):
+        """予測サイズに対する実際の出力サイズの誤差（%）"""
+        if not self.predicted_size or not self.output_size:
+            return 0.0
+        return (self.output_size / self.predicted_size - 1) * 100
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'input_path': self.input_path,
+            'output_path': self.output_path,
+            'settings': self.settings,
+            'duration': self.duration,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'output_size': self.output_size,
+            'predicted_size': self.predicted_size,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['input_path'], data.get('settings', {}), data.get('duration', 0),
+                  data.get('output_path'), data.get('id'))
+        job.status = data.get('status', cls.STATUS_QUEUED)
+        job.progress = data.get('progress', 0.0)
+        job.error = data.get('error', "")
+        job.output_size = data.get('output_size', 0)
+        job.predicted_size = data.get('predicted_size', 0)
+        job.created_at = data.get('created_at', job.created_at)
+        job.started_at = data.get('started_at')
+        job.finished_at = data.get('finished_at')
+        # 前回終了時に実行中だったジョブは待機中に戻す
+        if job.status == cls.STATUS_RUNNING:
+            job.status = cls.STATUS_QUEUED
+            job.progress = 0.0
+        return job
+
+class JobQueue(QObject):
+    """
+    永続化される変換キュー
+
+    ジョブはjobs.jsonに保存され、次回起動時に未完了のものが復元される。
+    ジョブは最大max_concurrent件まで並列に実行する。2passのログや切り出したファイルは
+    ジョブごとの作業ディレクトリ（JobWorkspace）に置くため、2passジョブ同士も並列に実行できる。
+    """
+    job_added = pyqtSignal(str)  # job_id
+    job_updated = pyqtSignal(str)  # job_id
+    jobs_reordered = pyqtSignal()
+    aggregate_progress = pyqtSignal(float)  # キュー全体の進行度（0-100）
+    queue_finished = pyqtSignal()
+    log_signal = pyqtSignal(str)
+
+    TRIM_SHARE = 0.1  # トリミングありのジョブで切り出しが占める進行度の割合
+
+    def __init__(self, max_concurrent=1, queue_file=None, parent=None):
+        super().__init__(parent)
+        self.jobs = []
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_file = queue_file or os.path.join(get_app_data_dir('queue'), 'jobs.json')
+        self.running = False  # キューの処理中フラグ（一時停止中はFalse）
+        self._threads = {}  # job_id -> QThread
+        self._workspaces = {}  # job_id -> トリミング用のJobWorkspace
+        self.load()
+
+    # ===== ジョブ操作 =====
+
+    def get_job(self, job_id):
+        for job in self.jobs:
+            if job.id == job_id:
+                return job
+        return None
+
+    def enqueue(self, input_path, settings, duration=0):
+        """ジョブを追加"""
+        job = ConversionJob(input_path, settings, duration)
+        job.output_path = self._unique_output_path(job.output_path)
+        self.jobs.append(job)
+        self.save()
+        self.job_added.emit(job.id)
+        self.log_signal.emit(f"📥 キューに追加: {os.path.basename(input_path)} [{job.settings_text()}]")
+        self._schedule()
+        return job
+
+    def estimate_pending_sizes(self):
+        """
+        待機中のCRF方式ジョブの出力サイズをまとめて推定（SizeEstimateGrid.estimate_batch）
+
+        動画情報はメディア情報キャッシュから取得し、キャッシュに無いファイルは推定しない。
+        トリミングありのジョブは切り出し後の長さで推定する。
+
+        Returns:
+            int: 推定したジョブ数
+        """
+        cache = get_media_info_cache()
+        jobs, video_infos = [], []
+        for job in self.jobs:
+            if job.status != ConversionJob.STATUS_QUEUED or job.settings.get('mode') != 'crf' or job.predicted_size:
+                continue
+            record = cache.get(job.input_path) if cache else None
+            video_info = record.to_video_info() if record else None
+            if not video_info:
+                continue
+            trim_range = job.trim_range()
+            if trim_range and video_info['duration']:
+                ratio = (trim_range[1] - trim_range[0]) / video_info['duration']
+                video_info['duration'] = trim_range[1] - trim_range[0]
+                video_info['file_size'] *= ratio
+            jobs.append(job)
+            video_infos.append(video_info)
+        if not jobs:
+            return 0
+
+        history = get_conversion_history()
+        sizes_mb = SizeEstimateGrid.estimate_batch(
+            video_infos, [job.settings.get('crf', 23) for job in jobs], [job.settings.get('scale', 1.0) for job in jobs],
+            history.model if history else None,
+            [job.settings.get('speed_preset', DEFAULT_SPEED_PRESET) for job in jobs])
+        estimated = 0
+        for job, size_mb in zip(jobs, sizes_mb):
+            if not np.isnan(size_mb):
+                job.predicted_size = int(size_mb * 1024 * 1024)
+                self.job_updated.emit(job.id)
+                estimated += 1
+        if estimated:
+            self.save()
+        return estimated
+
+    def _unique_output_path(self, output_path):
+        """同じ秒に追加されたジョブや既存ファイルと出力先が重ならないように連番を付ける"""
+        taken = {MediaInfoCache.normalize_path(job.output_path) for job in self.jobs}
+        base, ext = os.path.splitext(output_path)
+        candidate = output_path
+        number = 2
+        while MediaInfoCache.normalize_path(candidate) in taken or os.path.exists(candidate):
+            candidate = f"{base}_{number}{ext}"
+            number += 1
+        return candidate
+
+    def cancel(self, job_id):
+        """ジョブをキャンセル（実行中の場合はプロセスを停止）"""
+        job = self.get_job(job_id)
+        if not job or job.is_finished():
+            return
+        thread = self._threads.get(job_id)
+        job.status = ConversionJob.STATUS_CANCELLED
+        job.finished_at = time.time()
+        if thread:
+            thread.stop()
+        self.save()
+        self.job_updated.emit(job_id)
+        self._emit_aggregate_progress()
+        self._schedule()
+
+    def move(self, job_id, offset):
+        """待機中ジョブの順番を入れ替え（offset: -1で前へ、+1で後ろへ）"""
+        job = self.get_job(job_id)
+        if not job or job.status != ConversionJob.STATUS_QUEUED:
+            return False
+        queued = [j for j in self.jobs if j.status == ConversionJob.STATUS_QUEUED]
+        position = queued.index(job)
+        new_position = position + offset
+        if new_position < 0 or new_position >= len(queued):
             return False
+        # 待機中ジョブ同士で入れ替える（実行中・完了済みの位置は保持）
+        other = queued[new_position]
+        i, j = self.jobs.index(job), self.jobs.index(other)
+        self.jobs[i], self.jobs[j] = self.jobs[j], self.jobs[i]
+        self.save()
+        self.jobs_reordered.emit()
+        return True
+
+    def clear_finished(self):
+        """完了・失敗・キャンセル済みのジョブを一覧から削除"""
+        self.jobs = [job for job in self.jobs if not job.is_finished()]
+        self.save()
+        self.jobs_reordered.emit()
+        self._emit_aggregate_progress()
+
+    def set_max_concurrent(self, count):
+        self.max_concurrent = max(1, int(count))
+        self._schedule()
+
+    def start(self):
+        """キューの処理を開始（再開）"""
+        self.running = True
+        self._schedule()
+
+    def pause(self):
+        """新しいジョブの開始を止める（実行中のジョブは継続）"""
+        self.running = False
+
+    def running_count(self):
+        return len(self._threads)
+
+    def pending_count(self):
+        return sum(1 for job in self.jobs if job.status == ConversionJob.STATUS_QUEUED)
+
+    def shutdown(self):
+        """アプリ終了時に実行中のジョブを停止（次回起動時に待機中として復元）"""
+        self.running = False
+        for thread in list(self._threads.values()):
+            thread.stop()
+        for thread in list(self._threads.values()):
+            thread.wait(3000)
+        self.save()
+
+    # ===== スケジューリング =====
+
+    def _schedule(self):
+        if not self.running:
+            return
+        for job in self.jobs:
+            if len(self._threads) >= self.max_concurrent:
+                break
+            if job.status != ConversionJob.STATUS_QUEUED:
+                continue
+            self._start_job(job)
+
+        if not self._threads and self.pending_count() == 0:
+            self.running = False
+            self.queue_finished.emit()
+
+    def _uses_trim_stage(self, job):
+        # 2passは両passで入力シークするため、切り出しはCRFのみ
+        return bool(job.trim_range()) and job.settings.get('mode') != 'twopass'
+
+    def _start_job(self, job):
+        if not os.path.exists(job.input_path):
+            self._finish_job(job, False, "入力ファイルが見つかりません")
+            return
+
+        duration = job.duration
+        if duration <= 0:
+            try:
+                record, _ = MediaProbe.probe_cached(job.input_path)
+                duration = job.duration = record.duration or 0
+            except MediaProbeError as e:
+                self._finish_job(job, False, str(e))
+                return
+
+        job.status = ConversionJob.STATUS_RUNNING
+        job.progress = 0.0
+        job.error = ""
+        job.started_at = time.time()
+        self.save()
+        self.job_updated.emit(job.id)
+        self.log_signal.emit(f"▶ キュー変換開始: {os.path.basename(job.input_path)} [{job.settings_text()}]")
+
+        trim_range = job.trim_range()
+        if self._uses_trim_stage(job):
+            # トリミング範囲を切り出してから変換
+            workspace = JobWorkspace('clipitbro_trim_',
+                                     JobWorkspace.estimate_trim_bytes(cached_media_record(job.input_path), *trim_range))
+            self._workspaces[job.id] = workspace
+            thread = SmartTrimThread(job.input_path, trim_range[0], trim_range[1], workspace.path)
+            self._launch(job, thread, 'trim')
+        elif trim_range:
+            self._start_encode(job, job.input_path, trim_range[1] - trim_range[0], trim_range)
+        else:
+            self._start_encode(job, job.input_path, duration)
+
+    def _start_encode(self, job, input_path, duration, trim_range=None):
+        """変換スレッドを開始（durationは変換対象の長さ、trim_rangeは入力シークする範囲）"""
+        settings = job.settings
+        if settings.get('mode') == 'twopass':
+            record = cached_media_record(job.input_path)
+            output_fps = resolve_output_fps(record, settings.get('vfr_output_fps', 0))
+            budget = BitBudget.allocate(settings.get('target_size_mb', 10), duration, record,
+                                        settings.get('audio_tracks'), settings.get('audio_mix', False), output_fps)
+            if not budget:
+                self._finish_job(job, False, "動画の長さが不明です")
+                return
+            target_bitrate = budget.video_kbps
+            if settings.get('size_guard') and not settings.get('crf_search'):
+                video_stream = record.video_stream() if record else None
+                if video_stream:
+                    target_bitrate, factor, samples = apply_bitrate_feedback(
+                        target_bitrate, settings.get('use_h265', False), video_stream.height)
+                    if factor < 1.0:
+                        self.log_signal.emit(f"📉 {os.path.basename(job.input_path)}: 過去の超過実績（{samples}件）から"
+                                             f"動画ビットレートを ×{factor:.3f} に補正")
+            encoder_options = {
+                'use_h265': settings.get('use_h265', False),
+                'trim_range': trim_range,
+                'speed_preset': settings.get('speed_preset', DEFAULT_SPEED_PRESET),
+                'tune': settings.get('tune', ''),
+                'output_fps': output_fps,
+            }
+            if settings.get('crf_search'):
+                thread = CrfSearchConversionThread(input_path, job.output_path, settings.get('target_size_mb', 10), duration,
+                                                   audio_tracks=settings.get('audio_tracks'),
+                                                   audio_mix=settings.get('audio_mix', False), **encoder_options)
+            elif settings.get('chunked'):
+                thread = ChunkedTwoPassConversionThread(input_path, job.output_path, target_bitrate, duration,
+                                                        audio_plan=budget.audio_plan, **encoder_options)
+            else:
+                size_cap_bytes = settings.get('target_size_mb', 10) * 1024 * 1024 if settings.get('size_guard') else None
+                thread = TwoPassConversionThread(input_path, job.output_path, target_bitrate, duration,
+                                                 size_cap_bytes=size_cap_bytes, audio_plan=budget.audio_plan,
+                                                 **encoder_options)
+        else:
+            record = cached_media_record(job.input_path)
+            cmd = build_crf_command(input_path, job.output_path, settings.get('crf', 23), settings.get('scale', 1.0),
+                                    settings.get('speed_preset', DEFAULT_SPEED_PRESET), settings.get('tune', ''),
+                                    plan_crf_audio(record, settings.get('audio_tracks'), settings.get('audio_mix', False)),
+                                    resolve_output_fps(record, settings.get('vfr_output_fps', 0)))
+            thread = ConversionThread(cmd, get_ffmpeg_env(), job.output_path, duration)
+        self._launch(job, thread, 'encode')
+
+    def _launch(self, job, thread, stage):
+        thread.job_id = job.id
+        thread.stage = stage
+        # finished_signalはrun()内から送られるため、スレッドの破棄はQThread終了後に行う
+        thread.setParent(self)
+        thread.finished.connect(thread.deleteLater)
+        thread.progress_signal.connect(self._on_job_progress)
+        if stage == 'trim':
+            thread.log_signal.connect(self.log_signal)
+            thread.finished_signal.connect(self._on_trim_finished)
+        else:
+            thread.finished_signal.connect(self._on_job_finished)
+        self._threads[job.id] = thread
+        thread.start()
+
+    def _on_job_progress(self, percent):
+        thread = self.sender()
+        job = self.get_job(getattr(thread, 'job_id', None))
+        if not job or job.status != ConversionJob.STATUS_RUNNING:
+            return
+        if self._uses_trim_stage(job):
+            # 切り出しありのジョブは切り出しを全体の10%として扱う
+            percent = percent * self.TRIM_SHARE if thread.stage == 'trim' else self.TRIM_SHARE * 100 + percent * (1 - self.TRIM_SHARE)
+        job.progress = percent
+        self.job_updated.emit(job.id)
+        self._emit_aggregate_progress()
+
+    def _on_trim_finished(self, success, trimmed_path, error_message):
+        job_id = getattr(self.sender(), 'job_id', None)
+        self._threads.pop(job_id, None)
+        job = self.get_job(job_id)
+        if job and job.status == ConversionJob.STATUS_RUNNING:
+            if success:
+                start, end = job.trim_range()
+                self._start_encode(job, trimmed_path, end - start)
+                if job.id in self._threads:
+                    return
+            else:
+                self._finish_job(job, False, error_message)
+        self._cleanup_work_dir(job_id)
+        self._schedule()
+
+    def _on_job_finished(self, success, output_path, error_message):
+        thread = self.sender()
+        job_id = getattr(thread, 'job_id', None)
+        self._threads.pop(job_id, None)
+        job = self.get_job(job_id)
+        if job and job.status == ConversionJob.STATUS_RUNNING:
+            job.predicted_size = getattr(thread, 'predicted_size', 0) or job.predicted_size
+            size_attempts = thread.attempt_summary() if hasattr(thread, 'attempt_summary') else None
+            self._finish_job(job, success, error_message, size_attempts)
+        self._cleanup_work_dir(job_id)
+        self._schedule()
+
+    def _cleanup_work_dir(self, job_id):
+        workspace = self._workspaces.pop(job_id, None)
+        if workspace:
+            workspace.cleanup()
+
+    def _finish_job(self, job, success, error_message="", size_attempts=None):
+        job.finished_at = time.time()
+        if success:
+            job.status = ConversionJob.STATUS_DONE
+            job.progress = 100.0
+            if os.path.exists(job.output_path):
+                job.output_size = os.path.getsize(job.output_path)
+            elapsed = job.finished_at - (job.started_at or job.finished_at)
+            history = get_conversion_history()
+            if history:
+                trim_range = job.trim_range()
+                duration = trim_range[1] - trim_range[0] if trim_range else job.duration
+                history.record(job.input_path, job.settings, duration, job.output_path, elapsed, size_attempts)
+            prediction = f", 予測との誤差 {job.size_error_percent():+.1f}%" if job.predicted_size else ""
+            self.log_signal.emit(f"✓ キュー変換完了: {os.path.basename(job.output_path)} "
+                                 f"({job.output_size / (1024 * 1024):.1f}MB, {elapsed:.1f}秒{prediction})")
+        else:
+            job.status = ConversionJob.STATUS_FAILED
+            job.error = error_message
+            self.log_signal.emit(f"✗ キュー変換失敗: {os.path.basename(job.input_path)} - {error_message}")
+        self.save()
+        self.job_updated.emit(job.id)
+        self._emit_aggregate_progress()
+
+    def aggregate_percent(self):
+        """キャンセル以外のジョブの進行度を動画の長さで重み付けして集計"""
+        total_weight = 0.0
+        done_weight = 0.0
+        for job in self.jobs:
+            if job.status == ConversionJob.STATUS_CANCELLED:
+                continue
+            weight = job.duration if job.duration > 0 else 1.0
+            total_weight += weight
+            if job.status in (ConversionJob.STATUS_DONE, ConversionJob.STATUS_FAILED):
+                done_weight += weight
+            else:
+                done_weight += weight * job.progress / 100
+        if total_weight <= 0:
+            return 0.0
+        return done_weight / total_weight * 100
+
+    def _emit_aggregate_progress(self):
+        self.aggregate_progress.emit(self.aggregate_percent())
+
+    # ===== 永続化 =====
+
+    def load(self):
+        try:
+            if os.path.exists(self.queue_file):
+                with open(self.queue_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.jobs = [ConversionJob.from_dict(item) for item in data.get('jobs', [])]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"キューの読み込みエラー: {e}")
+            self.jobs = []
+
+    def save(self):
+        try:
+            temp_path = self.queue_file + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'jobs': [job.to_dict() for job in self.jobs]}, f, ensure_ascii=False, indent=1)
+            os.replace(temp_path, self.queue_file)
+        except OSError as e:
+            print(f"キューの保存エラー: {e}")
 
 class AboutDialog(QDialog):
     def __init__(self, parent=None):
@@ -5179,7 +11282,409 @@ class AboutDialog(QDialog):
             # 少し遅延させて確実に適用
             QTimer.singleShot(50, lambda: set_titlebar_theme(int(self.winId()), is_dark_mode))
 
+class SizeMapWidget(QWidget):
+    """
+    CRF×スケールの推定サイズのヒートマップ
+
+    横軸がCRF（左が高画質）、縦軸がスケール（上が1.0）。色は推定サイズの対数で、
+    目標サイズに収まる境界（スケールごとの最も低いCRF）を線で、現在の設定を枠で示す。
+    セルをクリックするとcell_clickedで (CRF, スケール×10) を通知する。
+    """
+    cell_clicked = pyqtSignal(int, int)
+
+    MARGIN_LEFT = 44
+    MARGIN_BOTTOM = 28
+    MARGIN_TOP = 8
+    MARGIN_RIGHT = 8
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.grid = None
+        self.target_mb = None
+        self.current = None  # (CRF, スケール×10)
+        self.setMinimumSize(560, 260)
+        self.setMouseTracking(True)
+
+    def set_state(self, grid, target_mb, current):
+        self.grid = grid
+        self.target_mb = target_mb
+        self.current = current
+        self.update()
+
+    def _plot_rect(self):
+        return (self.MARGIN_LEFT, self.MARGIN_TOP,
+                max(1, self.width() - self.MARGIN_LEFT - self.MARGIN_RIGHT),
+                max(1, self.height() - self.MARGIN_TOP - self.MARGIN_BOTTOM))
+
+    def _cell_at(self, x, y):
+        """座標に対応する (CRF, スケール×10)。プロット外はNone"""
+        left, top, width, height = self._plot_rect()
+        columns, rows = len(SizeEstimateGrid.CRF_VALUES), len(SizeEstimateGrid.SCALE_VALUES)
+        column, row = int((x - left) * columns / width), int((y - top) * rows / height)
+        if not (0 <= column < columns and 0 <= row < rows):
+            return None
+        return column + 1, rows - row
+
+    def paintEvent(self, event):
+        from PyQt5.QtGui import QPainter, QPen, QColor
+
+        painter = QPainter(self)
+        text_color = self.palette().color(self.foregroundRole())
+        if self.grid is None:
+            painter.setPen(text_color)
+            painter.drawText(self.rect(), Qt.AlignCenter, '動画ファイルを選択してください')
+            return
+
+        left, top, width, height = self._plot_rect()
+        columns, rows = len(SizeEstimateGrid.CRF_VALUES), len(SizeEstimateGrid.SCALE_VALUES)
+        cell_width, cell_height = width / columns, height / rows
+        log_size = np.log(self.grid.size_mb)
+        low, high = float(log_size.min()), float(log_size.max())
+        levels = (log_size - low) / (high - low) if high > low else np.zeros_like(log_size)
+
+        # セル（小さいほど青、大きいほど赤）
+        for i in range(columns):
+            for j in range(rows):
+                color = QColor.fromHsv(int(240 * (1 - levels[i, j])), 190, 230)
+                x, y = left + i * cell_width, top + (rows - 1 - j) * cell_height
+                painter.fillRect(int(x), int(y), int(math.ceil(cell_width)), int(math.ceil(cell_height)), color)
+
+        # 目標サイズの境界（このCRFより右なら目標以下）
+        if self.target_mb:
+            painter.setPen(QPen(QColor('#000000'), 2))
+            boundary = self.grid.crf_for_size(self.target_mb)
+            for j, crf in enumerate(boundary):
+                if np.isnan(crf):
+                    continue
+                x = left + (crf - 1) * cell_width
+                y = top + (rows - 1 - j) * cell_height
+                painter.drawLine(int(x), int(y), int(x), int(y + cell_height))
+                if j + 1 < rows and not np.isnan(boundary[j + 1]):
+                    next_x = left + (boundary[j + 1] - 1) * cell_width
+                    painter.drawLine(int(x), int(y), int(next_x), int(y))
+
+        # 現在の設定
+        if self.current:
+            crf, scale = self.current
+            painter.setPen(QPen(QColor('#ffffff'), 2))
+            x, y = left + (crf - 1) * cell_width, top + (rows - scale) * cell_height
+            painter.drawRect(int(x), int(y), max(2, int(cell_width)), max(2, int(cell_height)))
+
+        # 軸ラベル
+        painter.setPen(text_color)
+        for crf in (1, 10, 20, 30, 40, 50):
+            painter.drawText(int(left + (crf - 0.5) * cell_width) - 10, top + height + 16, f"{crf}")
+        for scale in (1, 5, 10):
+            painter.drawText(4, int(top + (rows - scale + 0.6) * cell_height), f"x{scale / 10:.1f}")
+        painter.drawText(left + width - 40, top + height + 26, "CRF")
+
+    def mouseMoveEvent(self, event):
+        cell = self._cell_at(event.x(), event.y())
+        if cell is None or self.grid is None:
+            self.setToolTip('')
+            return
+        estimation = self.grid.lookup(cell[0], cell[1] / 10)
+        self.setToolTip(f"CRF {cell[0]} / x{cell[1] / 10:.1f} ({estimation['new_resolution']}): "
+                        f"{estimation['size_mb']} MB")
+
+    def mousePressEvent(self, event):
+        cell = self._cell_at(event.x(), event.y())
+        if cell is not None and self.grid is not None:
+            self.cell_clicked.emit(*cell)
+
+class SizeMapDialog(QDialog):
+    """CRF方式のサイズ推定マップ（クリックでCRF・スケールのスライダーに反映）"""
+
+    def __init__(self, parent):
+        super().__init__(None)  # 親をNoneに設定して独立したウィンドウとして表示
+        self.parent_window = parent
+        self.setWindowTitle("サイズ推定マップ（CRF×スケール）")
+        self.resize(720, 380)
+        self.setWindowFlags(Qt.Dialog | Qt.WindowTitleHint | Qt.WindowCloseButtonHint | Qt.WindowSystemMenuHint)
+        self.setWindowIcon(parent.windowIcon())
+
+        layout = QVBoxLayout(self)
+        self.map_widget = SizeMapWidget()
+        layout.addWidget(self.map_widget)
+
+        target_layout = QHBoxLayout()
+        target_layout.addWidget(QLabel("目標サイズ(MB):"))
+        self.target_spin = QSpinBox()
+        self.target_spin.setRange(1, 4000)
+        self.target_spin.setValue(parent.size_slider.value())
+        target_layout.addWidget(self.target_spin)
+        self.summary_label = QLabel()
+        target_layout.addWidget(self.summary_label)
+        target_layout.addStretch()
+        layout.addLayout(target_layout)
+
+        self.target_spin.valueChanged.connect(self.refresh)
+        self.map_widget.cell_clicked.connect(self.apply_cell)
+        self.apply_theme()
+
+    def refresh(self, *args):
+        """推定表・目標サイズ・現在の設定を反映"""
+        grid = self.parent_window.get_size_grid()
+        current = (self.parent_window.crf_slider.value(), self.parent_window.vf_slider.value())
+        target_mb = self.target_spin.value()
+        self.map_widget.set_state(grid, target_mb, current)
+        if grid is None:
+            self.summary_label.setText("")
+            return
+        boundary = grid.crf_for_size(target_mb)
+        best = boundary[-1]  # 等倍で収まる最も低いCRF
+        text = f"等倍で{target_mb}MB以下: CRF {int(best)}以上" if not np.isnan(best) else f"等倍では{target_mb}MB以下に収まりません"
+        method = {'calibrated': 'サンプル実測で校正', 'model': f'履歴{grid.model_samples}件から学習', 'table': '係数表'}
+        self.summary_label.setText(f"{text}（推定: {method[grid.method]}）")
+
+    def apply_cell(self, crf, scale):
+        """クリックしたセルのCRF・スケールをスライダーに設定"""
+        self.parent_window.crf_slider.setValue(crf)
+        self.parent_window.vf_slider.setValue(scale)
+        self.refresh()
+
+    def apply_theme(self):
+        """親ウィンドウのテーマを適用"""
+        theme = self.parent_window.current_theme
+        self.setStyleSheet(ThemeManager.get_stylesheet(theme) + f"""
+            QDialog {{
+                background-color: {theme['main_bg']};
+                color: {theme['text_color']};
+            }}
+            QSpinBox {{
+                background-color: {theme['text_bg']};
+                color: {theme['text_color']};
+                border: 1px solid {theme['border_color']};
+            }}
+        """)
+
+    def showEvent(self, event):
+        """ダイアログ表示時にタイトルバーテーマを適用"""
+        super().showEvent(event)
+        is_dark_mode = self.parent_window.current_theme['name'] == 'Dark'
+        QTimer.singleShot(50, lambda: set_titlebar_theme(int(self.winId()), is_dark_mode))
+
+class AudioTrackDialog(QDialog):
+    """変換に使う音声トラックの選択（OBSのマルチトラック録画など）とミックス設定"""
+
+    def __init__(self, record, selected_tracks, audio_mix, parent):
+        super().__init__(parent)
+        self.parent_window = parent
+        self.use_default = False  # 「既定に戻す」で閉じた場合True
+        self.setWindowTitle("音声トラックの選択")
+        self.resize(520, 300)
+        self.setWindowIcon(parent.windowIcon())
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("変換に使う音声トラック（選ばなかったトラックはデコードしません）"))
+        self.track_list = QListWidget()
+        for number, stream in enumerate(record.audio_streams()):
+            item = QListWidgetItem(f"トラック{number + 1}: {describe_audio_stream(stream)}")
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if number in selected_tracks else Qt.Unchecked)
+            self.track_list.addItem(item)
+        layout.addWidget(self.track_list)
+
+        self.mix_check = QCheckBox("複数選択したトラックを1つにミックス（amix、選ばない場合はトラックごとに出力）")
+        self.mix_check.setChecked(audio_mix)
+        layout.addWidget(self.mix_check)
+
+        button_layout = QHBoxLayout()
+        default_button = QPushButton("既定に戻す")
+        default_button.clicked.connect(self.reset_to_default)
+        button_layout.addWidget(default_button)
+        button_layout.addStretch()
+        ok_button = QPushButton("OK")
+        ok_button.clicked.connect(self.accept)
+        button_layout.addWidget(ok_button)
+        cancel_button = QPushButton("キャンセル")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(cancel_button)
+        layout.addLayout(button_layout)
+        self.apply_theme()
+
+    def selected_tracks(self):
+        """チェックされた音声ストリームの番号"""
+        return [i for i in range(self.track_list.count()) if self.track_list.item(i).checkState() == Qt.Checked]
+
+    def reset_to_default(self):
+        """FFmpegの既定の選択（1本）に戻して閉じる"""
+        self.use_default = True
+        self.accept()
+
+    def apply_theme(self):
+        """親ウィンドウのテーマを適用"""
+        theme = self.parent_window.current_theme
+        self.setStyleSheet(ThemeManager.get_stylesheet(theme) + f"""
+            QDialog {{
+                background-color: {theme['main_bg']};
+                color: {theme['text_color']};
+            }}
+            QListWidget {{
+                background-color: {theme['text_bg']};
+                color: {theme['text_color']};
+                border: 1px solid {theme['border_color']};
+            }}
+        """)
+
+    def showEvent(self, event):
+        """ダイアログ表示時にタイトルバーテーマを適用"""
+        super().showEvent(event)
+        is_dark_mode = self.parent_window.current_theme['name'] == 'Dark'
+        QTimer.singleShot(50, lambda: set_titlebar_theme(int(self.winId()), is_dark_mode))
+
+class JobQueueDialog(QDialog):
+    """変換キューの一覧と操作（並べ替え・キャンセル・同時実行数）"""
+
+    def __init__(self, job_queue, parent=None):
+        super().__init__(None)  # 親をNoneに設定して独立したウィンドウとして表示
+        self.parent_window = parent
+        self.job_queue = job_queue
+        self.setWindowTitle("変換キュー")
+        self.resize(640, 420)
+        self.setWindowFlags(Qt.Dialog | Qt.WindowTitleHint | Qt.WindowCloseButtonHint | Qt.WindowSystemMenuHint)
+        if parent:
+            self.setWindowIcon(parent.windowIcon())
+
+        layout = QVBoxLayout(self)
+
+        # ジョブ一覧
+        self.job_list = QListWidget()
+        layout.addWidget(self.job_list)
+
+        # 全体の進行状況
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+        self.total_progress_bar = QProgressBar()
+        self.total_progress_bar.setRange(0, 100)
+        layout.addWidget(self.total_progress_bar)
+
+        # 操作ボタン
+        button_layout = QHBoxLayout()
+        self.up_button = QPushButton("▲ 上へ")
+        self.down_button = QPushButton("▼ 下へ")
+        self.cancel_button = QPushButton("キャンセル")
+        self.clear_button = QPushButton("完了済みを削除")
+        self.start_button = QPushButton()
+        for button in (self.up_button, self.down_button, self.cancel_button, self.clear_button):
+            button_layout.addWidget(button)
+        button_layout.addStretch()
+        button_layout.addWidget(QLabel("同時実行数:"))
+        self.concurrency_spin = QSpinBox()
+        self.concurrency_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.concurrency_spin.setValue(job_queue.max_concurrent)
+        button_layout.addWidget(self.concurrency_spin)
+        button_layout.addWidget(self.start_button)
+        layout.addLayout(button_layout)
+
+        self.up_button.clicked.connect(lambda: self.move_selected(-1))
+        self.down_button.clicked.connect(lambda: self.move_selected(1))
+        self.cancel_button.clicked.connect(self.cancel_selected)
+        self.clear_button.clicked.connect(self.job_queue.clear_finished)
+        self.start_button.clicked.connect(self.toggle_running)
+        self.concurrency_spin.valueChanged.connect(self.change_concurrency)
+
+        job_queue.job_added.connect(self.refresh)
+        job_queue.job_updated.connect(self.update_job_item)
+        job_queue.jobs_reordered.connect(self.refresh)
+        job_queue.aggregate_progress.connect(self.update_summary)
+        job_queue.queue_finished.connect(self.update_summary)
+
+        self.apply_theme()
+        self.refresh()
+
+    def selected_job_id(self):
+        item = self.job_list.currentItem()
+        return item.data(Qt.UserRole) if item else None
+
+    def refresh(self, *args):
+        """ジョブ一覧を再構築（選択状態は保持）"""
+        selected_id = self.selected_job_id()
+        self.job_list.clear()
+        for job in self.job_queue.jobs:
+            item = QListWidgetItem(job.display_text())
+            item.setData(Qt.UserRole, job.id)
+            item.setToolTip(f"入力: {job.input_path}\n出力: {job.output_path}")
+            self.job_list.addItem(item)
+            if job.id == selected_id:
+                self.job_list.setCurrentItem(item)
+        self.update_summary()
+
+    def update_job_item(self, job_id):
+        job = self.job_queue.get_job(job_id)
+        for row in range(self.job_list.count()):
+            item = self.job_list.item(row)
+            if item.data(Qt.UserRole) == job_id and job:
+                item.setText(job.display_text())
+                break
+        self.update_summary()
+
+    def update_summary(self, *args):
+        jobs = self.job_queue.jobs
+        done = sum(1 for job in jobs if job.status == ConversionJob.STATUS_DONE)
+        failed = sum(1 for job in jobs if job.status == ConversionJob.STATUS_FAILED)
+        self.summary_label.setText(
+            f"全体: {len(jobs)}件 / 実行中: {self.job_queue.running_count()} / "
+            f"待機中: {self.job_queue.pending_count()} / 完了: {done} / 失敗: {failed}")
+        self.total_progress_bar.setValue(int(self.job_queue.aggregate_percent()))
+        self.start_button.setText("一時停止" if self.job_queue.running else "キュー開始")
+
+    def move_selected(self, offset):
+        job_id = self.selected_job_id()
+        if job_id:
+            self.job_queue.move(job_id, offset)
+
+    def cancel_selected(self):
+        job_id = self.selected_job_id()
+        if job_id:
+            self.job_queue.cancel(job_id)
+
+    def toggle_running(self):
+        if self.job_queue.running:
+            self.job_queue.pause()
+        else:
+            self.job_queue.start()
+        self.update_summary()
+
+    def change_concurrency(self, value):
+        if self.parent_window and hasattr(self.parent_window, 'change_queue_concurrency'):
+            self.parent_window.change_queue_concurrency(value)
+        else:
+            self.job_queue.set_max_concurrent(value)
+
+    def apply_theme(self):
+        """親ウィンドウのテーマを適用"""
+        if self.parent_window and hasattr(self.parent_window, 'current_theme'):
+            theme = self.parent_window.current_theme
+        else:
+            theme = ThemeManager.LIGHT_THEME
+        self.setStyleSheet(ThemeManager.get_stylesheet(theme) + f"""
+            QDialog {{
+                background-color: {theme['main_bg']};
+                color: {theme['text_color']};
+            }}
+            QListWidget {{
+                background-color: {theme['log_bg']};
+                color: {theme['log_text']};
+                border: 1px solid {theme['border_color']};
+            }}
+            QSpinBox {{
+                background-color: {theme['text_bg']};
+                color: {theme['text_color']};
+                border: 1px solid {theme['border_color']};
+            }}
+        """)
+
+    def showEvent(self, event):
+        """ダイアログ表示時にタイトルバーテーマを適用"""
+        super().showEvent(event)
+        if self.parent_window and hasattr(self.parent_window, 'current_theme'):
+            is_dark_mode = self.parent_window.current_theme['name'] == 'Dark'
+            QTimer.singleShot(50, lambda: set_titlebar_theme(int(self.winId()), is_dark_mode))
+
 if __name__ == '__main__':
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.WARNING),
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s')
     app = QApplication(sys.argv)
     
     # アプリケーション情報を設定（タスクバー統合のため固定値を使用）